@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication
+
+from .revocation import token_revogado
+
+ALGORITHM = "HS256"
+
+# Limites do cache de usuários por processo
+USUARIO_CACHE_MAX = getattr(settings, 'USUARIO_CACHE_MAX', 1024)
+USUARIO_CACHE_TTL = getattr(settings, 'USUARIO_CACHE_TTL', 300)  # segundos
+
+
+class UsuarioCache:
+    """
+    Cache LRU com TTL de linhas de Usuario, local ao processo.
+    Cada worker tem o seu; a invalidação é feita pelos signals de Usuario
+    e, nos outros workers, pelo TTL.
+    """
+
+    def __init__(self, max_itens=USUARIO_CACHE_MAX, ttl=USUARIO_CACHE_TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(user_id)
+            if item is not None:
+                usuario, expira_em = item
+                if expira_em > agora:
+                    self._itens.move_to_end(user_id)
+                    return usuario
+                del self._itens[user_id]
+
+        from .models import Usuario
+        usuario = Usuario.objects.filter(id=user_id).first()
+        if usuario is not None:
+            self.set(usuario)
+        return usuario
+
+    def set(self, usuario):
+        with self._lock:
+            self._itens[usuario.id] = (usuario, time.monotonic() + self.ttl)
+            self._itens.move_to_end(usuario.id)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._itens.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+
+usuario_cache = UsuarioCache()
+
+
+class UsuarioPrincipal:
+    """
+    Usuário autenticado montado só com as claims do JWT (id, role, nome, email).
+    A linha completa de Usuario só é buscada (no cache) quando alguém acessa `.usuario`.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.id = payload.get('user_id')
+        self.pk = self.id
+        self.role = payload.get('role')
+        self.nome = payload.get('nome')
+        self.email = payload.get('email')
+        # Tokens antigos (emitidos sem as claims extras): completa pelo cache
+        if self.role is None or self.nome is None:
+            usuario = self.usuario
+            if usuario is not None:
+                self.role = usuario.role
+                self.nome = usuario.nome
+                self.email = usuario.email
+
+    @property
+    def usuario(self):
+        return usuario_cache.get(self.id)
+
+    def __eq__(self, other):
+        other_id = getattr(other, 'id', None)
+        return other_id is not None and other_id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.nome or str(self.id)
+
+
+def extrair_token(request):
+    """Busca o JWT no cookie 'jwt' ou no cabeçalho Authorization: Bearer."""
+    token = request.COOKIES.get('jwt')
+    if not token:
+        auth_header = request.headers.get('Authorization', '')
+        if auth_header.startswith('Bearer '):
+            token = auth_header.replace('Bearer ', '').strip()
+    if not token or token.lower() == 'null':
+        return None
+    return token
+
+
+def decodificar_token(token):
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+
+
+def principal_do_token(token):
+    """UsuarioPrincipal de um JWT válido e não revogado, ou None."""
+    payload = decodificar_token(token) if token else None
+    if not payload or not payload.get('user_id'):
+        return None
+    if token_revogado(payload):
+        return None
+    principal = UsuarioPrincipal(payload)
+    if principal.role is None:
+        return None  # Usuário removido
+    return principal
+
+
+class JWTUsuarioAuthentication(BaseAuthentication):
+    """
+    Autenticação DRF para os tokens emitidos para Usuario.
+    Decodifica o token uma vez e coloca um UsuarioPrincipal em request.user,
+    sem consultar o banco. Token ausente ou inválido deixa a requisição anônima:
+    cada view decide se exige login (ver `usuario_da_requisicao`).
+    """
+
+    def authenticate(self, request):
+        principal = principal_do_token(extrair_token(request))
+        if principal is None:
+            return None
+        return (principal, principal.payload)
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+def usuario_da_requisicao(request):
+    """
+    Retorna (principal, None) se a requisição estiver autenticada,
+    ou (None, Response 401) no mesmo formato que as views já usavam.
+    """
+    from rest_framework.response import Response
+
+    user = getattr(request, 'user', None)
+    if isinstance(user, UsuarioPrincipal):
+        return user, None
+    if not extrair_token(request):
+        return None, Response({'error': 'Não autenticado.'}, status=401)
+    return None, Response({'error': 'Usuário não autenticado.'}, status=401)
@@ -0,0 +1,391 @@
+"""
+Motor de disponibilidade dos profissionais.
+
+Cada dia de um profissional vira dois bitmaps (inteiros) com um bit por
+minuto do dia, no fuso local:
+
+    inicios   minutos em que começa um slot de 30 min dos horários de trabalho
+    reservas  minutos em que começa um agendamento que ocupa a agenda
+
+Os slots livres saem de operações de bits, sem montar/ordenar listas de
+strings. A grade semanal (HorarioTrabalho) é carregada uma vez por
+profissional e os agendamentos são buscados em bloco para vários dias de
+uma vez (DISPONIBILIDADE_JANELA_DIAS). Tudo fica em cache no processo e é
+invalidado pelos sinais de save/delete de Agendamento e HorarioTrabalho
+(ver models.py); o TTL limita a defasagem entre processos diferentes.
+"""
+import hashlib
+import heapq
+import threading
+import time as _time
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+DURACAO_SLOT = 30  # minutos
+MINUTOS_DIA = 24 * 60
+STATUS_OCUPAM = ('pendente', 'confirmado', 'paga')
+
+DISPONIBILIDADE_CACHE_MAX = getattr(settings, 'DISPONIBILIDADE_CACHE_MAX', 512)
+DISPONIBILIDADE_CACHE_TTL = getattr(settings, 'DISPONIBILIDADE_CACHE_TTL', 60)
+DISPONIBILIDADE_JANELA_DIAS = getattr(settings, 'DISPONIBILIDADE_JANELA_DIAS', 7)
+DISPONIBILIDADE_MAX_DIAS = getattr(settings, 'DISPONIBILIDADE_MAX_DIAS', 62)
+DISPONIBILIDADE_HTTP_MAX_AGE = getattr(settings, 'DISPONIBILIDADE_HTTP_MAX_AGE', 30)
+DISPONIBILIDADE_BUSCA_DIAS = getattr(settings, 'DISPONIBILIDADE_BUSCA_DIAS', 30)
+DISPONIBILIDADE_MEMBROS_TTL = getattr(settings, 'DISPONIBILIDADE_MEMBROS_TTL', 300)
+
+ROLE_POR_TIPO = {'psicologo': 'Psicologo', 'psiquiatra': 'Psiquiatra'}
+
+
+def _bits_slots(inicio_min, fim_min):
+    """Bits dos inícios de slot de inicio_min (inclusive) até fim_min (exclusivo)."""
+    bits = 0
+    for minuto in range(inicio_min, fim_min, DURACAO_SLOT):
+        bits |= 1 << minuto
+    return bits
+
+
+# Horário fixo antigo, para dias sem HorarioTrabalho cadastrado: 8h às 17h30 (20 slots)
+INICIOS_FIXOS = _bits_slots(8 * 60, 18 * 60)
+
+
+def _minutos(valor):
+    return valor.hour * 60 + valor.minute
+
+
+def _formatar(bits):
+    """Lista ordenada 'HH:MM' dos bits ligados."""
+    horarios = []
+    while bits:
+        menor = bits & -bits
+        minuto = menor.bit_length() - 1
+        horarios.append(f"{minuto // 60:02d}:{minuto % 60:02d}")
+        bits ^= menor
+    return horarios
+
+
+def _bloqueio(reservas):
+    """
+    Inícios de slot que colidem com alguma reserva: um slot em m colide com
+    uma reserva em r se |m - r| < DURACAO_SLOT.
+    """
+    bloqueados = reservas
+    for deslocamento in range(1, DURACAO_SLOT):
+        bloqueados |= (reservas << deslocamento) | (reservas >> deslocamento)
+    return bloqueados & ((1 << MINUTOS_DIA) - 1)
+
+
+def _datetime_local(data, minuto):
+    return timezone.make_aware(datetime.combine(data, time(minuto // 60, minuto % 60)))
+
+
+def limites_do_dia(data):
+    """[início, fim) do dia local, em datetimes com fuso."""
+    inicio = timezone.make_aware(datetime.combine(data, time.min))
+    return inicio, timezone.make_aware(datetime.combine(data + timedelta(days=1), time.min))
+
+
+class DiaDisponibilidade:
+    __slots__ = ('data', 'inicios', 'reservas', 'usando_horarios_fixos')
+
+    def __init__(self, data, inicios, reservas, usando_horarios_fixos):
+        self.data = data
+        self.inicios = inicios
+        self.reservas = reservas
+        self.usando_horarios_fixos = usando_horarios_fixos
+
+    @property
+    def livres(self):
+        return self.inicios & ~_bloqueio(self.reservas)
+
+    def horarios_disponiveis(self):
+        return _formatar(self.livres)
+
+    def horarios_ocupados(self):
+        return _formatar(self.reservas)
+
+
+def etag_dias(profissional_id, dias):
+    """ETag (forte) de uma sequência de DiaDisponibilidade: muda se qualquer bitmap mudar."""
+    h = hashlib.blake2b(str(profissional_id).encode(), digest_size=12)
+    for dia in dias:
+        h.update(f'|{dia.data}:{dia.inicios:x}:{dia.reservas:x}:{int(dia.usando_horarios_fixos)}'.encode())
+    return f'"{h.hexdigest()}"'
+
+
+class _AgendaProfissional:
+    """Estado em cache de um profissional: grade semanal + reservas por dia."""
+
+    def __init__(self):
+        self.semana = None   # 7 bitmaps de inícios (um por dia da semana)
+        self.reservas = {}   # date -> bitmap
+        self.criado_em = _time.monotonic()
+
+
+class MotorDisponibilidade:
+    def __init__(self, max_profissionais=DISPONIBILIDADE_CACHE_MAX, ttl=DISPONIBILIDADE_CACHE_TTL,
+                 janela_dias=DISPONIBILIDADE_JANELA_DIAS):
+        self.max_profissionais = max_profissionais
+        self.ttl = ttl
+        self.janela_dias = janela_dias
+        self._agendas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _agenda(self, profissional_id):
+        with self._lock:
+            agenda = self._agendas.get(profissional_id)
+            if agenda is not None and _time.monotonic() - agenda.criado_em > self.ttl:
+                agenda = None
+            if agenda is None:
+                agenda = _AgendaProfissional()
+                self._agendas[profissional_id] = agenda
+            self._agendas.move_to_end(profissional_id)
+            while len(self._agendas) > self.max_profissionais:
+                self._agendas.popitem(last=False)
+            return agenda
+
+    def _carregar_grades(self, profissional_ids):
+        from .models import HorarioTrabalho
+
+        # None = dia sem horário cadastrado (cai no horário fixo antigo)
+        semanas = {pid: [None] * 7 for pid in profissional_ids}
+        horarios = HorarioTrabalho.objects.filter(profissional_id__in=profissional_ids, ativo=True).values_list(
+            'profissional_id', 'dia_semana', 'horario_inicio', 'horario_fim')
+        for pid, dia_semana, inicio, fim in horarios:
+            semana = semanas[pid]
+            semana[dia_semana] = (semana[dia_semana] or 0) | _bits_slots(_minutos(inicio), _minutos(fim))
+        return semanas
+
+    def _carregar_reservas(self, profissional_ids, primeiro, ultimo):
+        """Reservas de todos os dias em [primeiro, ultimo], numa query só."""
+        from .models import Agendamento
+
+        inicio, _ = limites_do_dia(primeiro)
+        _, fim = limites_do_dia(ultimo)
+        datas = [primeiro + timedelta(days=i) for i in range((ultimo - primeiro).days + 1)]
+        reservas = {pid: dict.fromkeys(datas, 0) for pid in profissional_ids}
+        linhas = Agendamento.objects.filter(
+            profissional_id__in=profissional_ids,
+            data_hora__gte=inicio, data_hora__lt=fim, status__in=STATUS_OCUPAM,
+        ).values_list('profissional_id', 'data_hora')
+        for pid, data_hora in linhas:
+            local = timezone.localtime(data_hora)
+            reservas[pid][local.date()] |= 1 << _minutos(local)
+        return reservas
+
+    def precarregar(self, profissional_ids, datas):
+        """
+        Garante grade e reservas de vários profissionais nas datas pedidas, com
+        no máximo uma query de HorarioTrabalho e uma de Agendamento para todos.
+        Devolve {profissional_id: _AgendaProfissional}.
+        """
+        agendas = {pid: self._agenda(pid) for pid in profissional_ids}
+        sem_grade = [pid for pid, agenda in agendas.items() if agenda.semana is None]
+        if sem_grade:
+            for pid, semana in self._carregar_grades(sem_grade).items():
+                agendas[pid].semana = semana
+
+        incompletos = [pid for pid, agenda in agendas.items() if any(d not in agenda.reservas for d in datas)]
+        if incompletos:
+            faltando = sorted({d for pid in incompletos for d in datas if d not in agendas[pid].reservas})
+            # Busca em bloco: cobre as datas pedidas e os próximos dias da janela
+            ultimo = max(faltando[-1], faltando[0] + timedelta(days=self.janela_dias - 1))
+            for pid, reservas in self._carregar_reservas(incompletos, faltando[0], ultimo).items():
+                agendas[pid].reservas.update(reservas)
+        return agendas
+
+    @staticmethod
+    def _dia(agenda, data):
+        inicios = agenda.semana[data.weekday()]
+        fixo = inicios is None
+        if fixo:
+            inicios = INICIOS_FIXOS
+        return DiaDisponibilidade(data, inicios, agenda.reservas[data], fixo)
+
+    def dias(self, profissional_id, datas):
+        """Disponibilidade de cada data pedida, como {date: DiaDisponibilidade}."""
+        agenda = self.precarregar([profissional_id], datas)[profissional_id]
+        return {data: self._dia(agenda, data) for data in datas}
+
+    def dia(self, profissional_id, data):
+        return self.dias(profissional_id, [data])[data]
+
+    def invalidar(self, profissional_id):
+        with self._lock:
+            self._agendas.pop(profissional_id, None)
+
+    def limpar(self):
+        with self._lock:
+            self._agendas.clear()
+
+
+disponibilidade = MotorDisponibilidade()
+
+
+def _slots_livres(dias, desde):
+    """Gera, em ordem, os inícios de slot livres (datetimes locais) a partir de `desde`."""
+    desde_local = timezone.localtime(desde)
+    primeiro_minuto = _minutos(desde_local) + (1 if desde_local.second or desde_local.microsecond else 0)
+    for dia in dias:
+        if dia.data < desde_local.date():
+            continue
+        bits = dia.livres
+        if dia.data == desde_local.date():
+            bits &= ~((1 << primeiro_minuto) - 1)
+        while bits:
+            menor = bits & -bits
+            yield _datetime_local(dia.data, menor.bit_length() - 1)
+            bits ^= menor
+
+
+class IndiceProximoLivre:
+    """
+    Próximo slot livre de cada profissional ativo, por tipo, para as buscas
+    entre profissionais. É mantido de forma incremental: save/delete de
+    Agendamento/HorarioTrabalho só marca o profissional como sujo, e a busca
+    recalcula apenas os sujos, aqueles cujo próximo slot já passou e os
+    calculados há mais que o TTL do motor (reservas feitas em outro processo).
+    A lista de profissionais é recarregada a cada DISPONIBILIDADE_MEMBROS_TTL
+    ou quando um Usuario é salvo/excluído.
+    """
+
+    def __init__(self, motor, horizonte_dias=DISPONIBILIDADE_BUSCA_DIAS, ttl_membros=DISPONIBILIDADE_MEMBROS_TTL):
+        self.motor = motor
+        self.horizonte_dias = horizonte_dias
+        self.ttl_membros = ttl_membros
+        self._proximos = {}       # tipo -> {pid: (datetime | None, data do cálculo, monotonic do cálculo)}
+        self._membros_em = {}     # tipo -> monotonic da última carga da lista
+        self._sujos = set()
+        self._lock = threading.Lock()
+
+    def _horizonte(self, agora):
+        hoje = timezone.localtime(agora).date()
+        return [hoje + timedelta(days=i) for i in range(self.horizonte_dias)]
+
+    def _membros(self, tipo):
+        from .models import Usuario
+        return set(Usuario.objects.filter(role=ROLE_POR_TIPO[tipo], status='ativo').values_list('id', flat=True))
+
+    def _atualizar(self, tipo, agora):
+        """Recalcula o que for preciso e devolve {pid: próximo slot livre | None}."""
+        hoje = timezone.localtime(agora).date()
+        with self._lock:
+            proximos = self._proximos.setdefault(tipo, {})
+            membros_em = self._membros_em.get(tipo)
+        if membros_em is None or _time.monotonic() - membros_em > self.ttl_membros:
+            membros = self._membros(tipo)
+            with self._lock:
+                for pid in set(proximos) - membros:
+                    del proximos[pid]
+                for pid in membros - set(proximos):
+                    proximos[pid] = (None, None, None)
+                self._membros_em[tipo] = _time.monotonic()
+
+        limite = _time.monotonic() - self.motor.ttl
+        with self._lock:
+            recalcular = [
+                pid for pid, (proximo, calculado_em, calculado_mono) in proximos.items()
+                if pid in self._sujos or calculado_em != hoje or calculado_mono < limite
+                or (proximo is not None and proximo < agora)
+            ]
+            self._sujos.difference_update(recalcular)
+
+        if recalcular:
+            datas = self._horizonte(agora)
+            agendas = self.motor.precarregar(recalcular, datas)
+            novos = {}
+            for pid, agenda in agendas.items():
+                dias = (self.motor._dia(agenda, d) for d in datas)
+                novos[pid] = (next(_slots_livres(dias, agora), None), hoje, _time.monotonic())
+            with self._lock:
+                for pid, valor in novos.items():
+                    if pid in proximos:
+                        proximos[pid] = valor
+
+        with self._lock:
+            return {pid: valor[0] for pid, valor in proximos.items()}
+
+    def primeiros_livres(self, tipo, quantidade, agora=None):
+        """Os `quantidade` slots livres mais cedo entre todos os profissionais: [(datetime, pid)]."""
+        agora = agora or timezone.now()
+        proximos = self._atualizar(tipo, agora)
+        heap = [(proximo, pid) for pid, proximo in proximos.items() if proximo is not None]
+        heapq.heapify(heap)
+        datas = self._horizonte(agora)
+        geradores = {}
+        resultado = []
+        # Merge das agendas: só expande quem está na frente da fila
+        while heap and len(resultado) < quantidade:
+            slot, pid = heapq.heappop(heap)
+            if pid not in geradores:
+                # O índice pode estar defasado: a cabeça só vale se o motor confirmar
+                dias = self.motor.dias(pid, datas)
+                geradores[pid] = _slots_livres((dias[d] for d in datas), agora)
+                atual = next(geradores[pid], None)
+                if atual != slot:
+                    self._corrigir(tipo, pid, atual, agora)
+                    if atual is not None:
+                        heapq.heappush(heap, (atual, pid))
+                    continue
+            resultado.append((slot, pid))
+            seguinte = next(geradores[pid], None)
+            if seguinte is not None:
+                heapq.heappush(heap, (seguinte, pid))
+        return resultado
+
+    def _corrigir(self, tipo, pid, proximo, agora):
+        with self._lock:
+            proximos = self._proximos.get(tipo, {})
+            if pid in proximos:
+                proximos[pid] = (proximo, timezone.localtime(agora).date(), _time.monotonic())
+
+    def livres_entre(self, tipo, inicio, fim, agora=None):
+        """Profissionais com slot livre que caiba em [inicio, fim): {pid: [datetimes]}."""
+        agora = agora or timezone.now()
+        proximos = self._atualizar(tipo, agora)
+        # Quem só tem slot livre depois do fim da janela não precisa ser olhado
+        candidatos = [pid for pid, proximo in proximos.items() if proximo is not None and proximo < fim]
+        if not candidatos:
+            return {}
+        primeiro = timezone.localtime(inicio).date()
+        ultimo = timezone.localtime(fim).date()
+        datas = [primeiro + timedelta(days=i) for i in range((ultimo - primeiro).days + 1)]
+        # Os slots saem do motor (não do índice), então uma cabeça defasada não passa
+        agendas = self.motor.precarregar(candidatos, datas)
+        ultimo_inicio = fim - timedelta(minutes=DURACAO_SLOT)
+        resultado = {}
+        for pid, agenda in agendas.items():
+            dias = (self.motor._dia(agenda, d) for d in datas)
+            slots = []
+            for slot in _slots_livres(dias, max(inicio, agora)):
+                if slot > ultimo_inicio:
+                    break
+                slots.append(slot)
+            if slots:
+                resultado[pid] = slots
+        return resultado
+
+    def marcar(self, profissional_id):
+        with self._lock:
+            self._sujos.add(profissional_id)
+
+    def recarregar_membros(self):
+        with self._lock:
+            self._membros_em.clear()
+
+    def limpar(self):
+        with self._lock:
+            self._proximos.clear()
+            self._membros_em.clear()
+            self._sujos.clear()
+
+
+indice_proximo_livre = IndiceProximoLivre(disponibilidade)
+
+
+def invalidar_profissional(profissional_id):
+    """Chamado pelos sinais de Agendamento/HorarioTrabalho (models.py)."""
+    disponibilidade.invalidar(profissional_id)
+    indice_proximo_livre.marcar(profissional_id)
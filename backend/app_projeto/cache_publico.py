@@ -0,0 +1,128 @@
+"""
+Cache das leituras públicas (listagem de profissionais, perfil, horários de
+trabalho e avaliações de um profissional), sobre o cache do Django (CACHES).
+
+Invalidação por versão: cada chave inclui a versão dos namespaces de que
+depende ('profissionais', 'usuario:<id>', 'horarios:<id>', 'avaliacoes:<id>').
+Os sinais de Usuario, Endereco, HorarioTrabalho e Avaliacao trocam a versão e as
+entradas antigas simplesmente deixam de ser lidas (e saem pelo TTL/LRU).
+
+`lembrar` faz o recálculo em voo único: numa chave vencida, só uma requisição
+por processo (trava local) e, com backend compartilhado, só um processo
+(trava via cache.add) vai ao banco; as outras esperam o valor.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+CACHE_PUBLICO_TTL = getattr(settings, 'CACHE_PUBLICO_TTL', 300)  # segundos
+# Tempo máximo que um recálculo segura a trava (e que os outros esperam por ele)
+CACHE_TRAVA_SEGUNDOS = getattr(settings, 'CACHE_TRAVA_SEGUNDOS', 10)
+
+_AUSENTE = object()
+_travas_locais = [threading.Lock() for _ in range(64)]
+
+
+def _chave_versao(namespace):
+    return f'cache_publico:versao:{namespace}'
+
+
+def versoes(namespaces):
+    """Versão atual de cada namespace (criada na primeira leitura)."""
+    chaves = [_chave_versao(ns) for ns in namespaces]
+    atuais = cache.get_many(chaves)
+    faltando = {chave: time.time_ns() for chave in chaves if chave not in atuais}
+    if faltando:
+        cache.set_many(faltando, None)
+        atuais.update(faltando)
+    return [atuais[chave] for chave in chaves]
+
+
+def _trocar_versoes(namespaces):
+    # Valor novo a cada troca (não incr): nunca volta a uma versão já usada,
+    # mesmo se a chave de versão tiver sido descartada pelo LRU
+    cache.set_many({_chave_versao(ns): time.time_ns() for ns in namespaces}, None)
+
+
+def agora_e_no_commit(descartar):
+    """
+    Roda a invalidação `descartar` já e de novo no commit. A primeira tira o
+    estado antigo de quem lê durante a transação; a segunda, o que uma leitura
+    concorrente guardou nesse meio tempo com o estado de antes do commit e que
+    ficaria no cache até o TTL. Fora de transação o on_commit roda na hora.
+    """
+    descartar()
+    transaction.on_commit(descartar)
+
+
+def invalidar(*namespaces):
+    agora_e_no_commit(lambda: _trocar_versoes(namespaces))
+
+
+def lembrar(chave, calcular, ttl=CACHE_PUBLICO_TTL):
+    """Valor de `chave` no cache ou calculado por uma única requisição."""
+    valor = cache.get(chave, _AUSENTE)
+    if valor is not _AUSENTE:
+        return valor
+    with _travas_locais[hash(chave) % len(_travas_locais)]:
+        valor = cache.get(chave, _AUSENTE)
+        if valor is not _AUSENTE:
+            return valor
+        trava = f'{chave}:trava'
+        if not cache.add(trava, 1, CACHE_TRAVA_SEGUNDOS):
+            # Outro processo está recalculando: espera o valor aparecer
+            limite = time.monotonic() + CACHE_TRAVA_SEGUNDOS
+            while time.monotonic() < limite:
+                time.sleep(0.05)
+                valor = cache.get(chave, _AUSENTE)
+                if valor is not _AUSENTE:
+                    return valor
+        try:
+            valor = calcular()
+            cache.set(chave, valor, ttl)
+        finally:
+            cache.delete(trava)
+        return valor
+
+
+class _NaoGuardar(Exception):
+    def __init__(self, resposta):
+        self.resposta = resposta
+
+
+def em_cache(namespaces):
+    """
+    Decorator de view GET pública (abaixo do @api_view): guarda (status, dados)
+    da resposta por view + argumentos + query string. `namespaces(**kwargs)`
+    diz de quais namespaces a resposta depende.
+    """
+    def decorator(view):
+        @wraps(view)
+        def envolvida(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            lista = namespaces(**kwargs)
+            consulta = hashlib.sha1(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:16]
+            argumentos = ':'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))
+            versao = '.'.join(str(v) for v in versoes(lista))
+            chave = f'cache_publico:{view.__name__}:{argumentos}:{consulta}:{versao}'
+
+            def calcular():
+                resposta = view(request, *args, **kwargs)
+                if not isinstance(resposta, Response) or resposta.status_code >= 500:
+                    raise _NaoGuardar(resposta)
+                return resposta.status_code, resposta.data
+
+            try:
+                status, dados = lembrar(chave, calcular)
+            except _NaoGuardar as erro:
+                return erro.resposta
+            return Response(dados, status=status)
+        return envolvida
+    return decorator
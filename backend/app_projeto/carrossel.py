@@ -0,0 +1,107 @@
+"""
+Carrossel de avaliações da página inicial (listar_melhores_avaliacoes).
+
+O payload é montado uma vez, numa query, e guardado no cache do Django já
+serializado (JSON + ETag). Os sinais de Avaliacao e Usuario descartam a
+entrada quando algo que aparece (ou passaria a aparecer) no carrossel muda;
+o TTL é só uma rede de segurança para os outros processos.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .cache_publico import agora_e_no_commit, lembrar
+
+CARROSSEL_CHAVE = 'carrossel_avaliacoes'
+CARROSSEL_TAMANHO = 20
+CARROSSEL_CACHE_TTL = getattr(settings, 'CARROSSEL_CACHE_TTL', 3600)
+CARROSSEL_HTTP_MAX_AGE = getattr(settings, 'CARROSSEL_HTTP_MAX_AGE', 60)
+
+
+def avaliacoes_elegiveis():
+    """Avaliações de pacientes com nota >= 4 e comentário."""
+    from .models import Avaliacao
+    return Avaliacao.objects.filter(
+        nota__gte=4, tipo_avaliador='paciente', comentario__isnull=False,
+    ).exclude(Q(comentario__exact='') | Q(comentario__exact=' '))
+
+
+def elegivel(avaliacao):
+    return (
+        avaliacao.tipo_avaliador == 'paciente' and avaliacao.nota >= 4
+        and avaliacao.comentario not in (None, '', ' ')
+    )
+
+
+def _url_foto(foto):
+    if not foto:
+        return None
+    # Corrige caminho da foto (remove /media/ duplicado se existir)
+    url = foto.url
+    if url.startswith('/media/media/'):
+        url = url.replace('/media/media/', '/media/', 1)
+    return url
+
+
+def montar():
+    avaliacoes = avaliacoes_elegiveis().select_related(
+        'avaliador', 'agendamento__profissional',
+    ).order_by('-nota', '-data_criacao')[:CARROSSEL_TAMANHO]
+
+    itens, usuarios = [], set()
+    for avaliacao in avaliacoes:
+        profissional = avaliacao.agendamento.profissional
+        if not profissional:
+            continue
+        usuarios.update((avaliacao.avaliador_id, profissional.id))
+        itens.append({
+            'id': avaliacao.id,
+            'nota': avaliacao.nota,
+            'comentario': avaliacao.comentario,
+            'data_criacao': avaliacao.data_criacao.isoformat(),
+            'avaliador_nome': avaliacao.avaliador.nome,
+            'avaliador_foto': _url_foto(avaliacao.avaliador.foto),
+            'profissional_nome': profissional.nome,
+            'profissional_foto': _url_foto(profissional.foto),
+            'profissional_tipo': 'Psiquiatra' if profissional.role == 'Psiquiatra' else 'Psicólogo',
+            'tipo_avaliador_display': avaliacao.get_tipo_avaliador_display(),
+        })
+    corpo = json.dumps(itens, ensure_ascii=False).encode()
+    return {
+        'corpo': corpo,
+        'etag': '"%s"' % hashlib.sha1(corpo).hexdigest(),
+        'avaliacoes': {item['id'] for item in itens},
+        'usuarios': usuarios,
+    }
+
+
+def obter_carrossel():
+    """Payload do carrossel: do cache ou montado agora, por uma requisição só."""
+    return lembrar(CARROSSEL_CHAVE, montar, CARROSSEL_CACHE_TTL)
+
+
+def invalidar():
+    agora_e_no_commit(lambda: cache.delete(CARROSSEL_CHAVE))
+
+
+def _descartar_se_exibe(campo, objeto_id):
+    def descartar():
+        carrossel = cache.get(CARROSSEL_CHAVE)
+        if carrossel is not None and objeto_id in carrossel[campo]:
+            cache.delete(CARROSSEL_CHAVE)
+    agora_e_no_commit(descartar)
+
+
+def avaliacao_mudou(avaliacao):
+    # Elegível agora (pode entrar) ou já exibida (pode ter mudado ou saído)
+    if elegivel(avaliacao):
+        invalidar()
+        return
+    _descartar_se_exibe('avaliacoes', avaliacao.id)
+
+
+def usuario_mudou(usuario_id):
+    _descartar_se_exibe('usuarios', usuario_id)
@@ -0,0 +1,66 @@
+"""
+GET condicional (ETag / Last-Modified / 304) nas listagens do usuário logado.
+
+A versão de uma listagem sai de uma query agregada (quantidade de linhas e a
+maior data_atualizacao das tabelas que aparecem no payload). O ETag junta essa
+versão com a view, o usuário e a query string; se o cliente já tem o mesmo
+ETag, a resposta é 304 sem a view rodar (nada é serializado).
+
+Só o ETag decide o 304: Last-Modified vai na resposta, mas If-Modified-Since
+sozinho não é usado, porque apagar uma linha não move a maior data.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .authentication import usuario_da_requisicao
+
+
+def versao_queryset(queryset, *campos_data):
+    """(quantidade, maior valor entre os campos de data) das linhas do queryset."""
+    agregados = {'quantidade': Count('pk')}
+    agregados.update({f'data_{i}': Max(campo) for i, campo in enumerate(campos_data)})
+    valores = queryset.order_by().aggregate(**agregados)
+    datas = [valores[f'data_{i}'] for i in range(len(campos_data)) if valores[f'data_{i}'] is not None]
+    return valores['quantidade'], max(datas, default=None)
+
+
+def condicional(versao):
+    """
+    Decorator de view GET autenticada (abaixo do @api_view). `versao(usuario,
+    request, **kwargs)` devolve (quantidade, ultima_modificacao), ou None para
+    responder sem validação (ex.: requisição que a view vai recusar).
+    """
+    def decorator(view):
+        @wraps(view)
+        def envolvida(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            usuario, erro = usuario_da_requisicao(request)
+            atual = None if erro else versao(usuario, request, **kwargs)
+            if atual is None:
+                return view(request, *args, **kwargs)
+
+            quantidade, modificado = atual
+            partes = [
+                view.__name__, usuario.id, usuario.role, request.META.get('QUERY_STRING', ''),
+                quantidade, modificado.isoformat() if modificado else '',
+            ]
+            etag = '"%s"' % hashlib.sha1(':'.join(map(str, partes)).encode()).hexdigest()
+            resposta = get_conditional_response(request, etag=etag)
+            if resposta is None:
+                resposta = view(request, *args, **kwargs)
+                if resposta.status_code != 200:
+                    return resposta
+            resposta.headers.setdefault('ETag', etag)
+            if modificado:
+                resposta.headers.setdefault('Last-Modified', http_date(modificado.timestamp()))
+            # Navegador guarda, mas revalida a cada uso; resposta é de um usuário só
+            patch_cache_control(resposta, private=True, no_cache=True)
+            patch_vary_headers(resposta, ['Authorization', 'Cookie'])
+            return resposta
+        return envolvida
+    return decorator
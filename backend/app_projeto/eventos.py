@@ -0,0 +1,220 @@
+"""
+Log de eventos de status de Agendamento (AgendamentoHistorico), só de inserção.
+
+O evento é gravado na mesma transação da mudança de status: Agendamento.save()
+grava o status e o evento num atomic() só, e quem já está numa transação leva o
+evento junto (se ela for desfeita, o evento vai embora junto). Quem muda status
+em lote (os jobs, a criação em lote) usa `na_transacao()`: os eventos do bloco
+vão num bulk_create só, dentro da própria transação, antes do commit.
+
+As linhas do feed de sincronização (sincronizacao.py) entram no commit, em
+lote: no fim da requisição (EventosAgendamentoMiddleware), na saída de
+`em_lote()` ou, fora dos dois, na hora. Dentro de `na_transacao()` elas também
+vão antes do commit, com os eventos.
+"""
+import json
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Eventos acumulados antes de gravar no meio do lote (limita a memória)
+AGENDAMENTO_EVENTOS_LOTE_MAX = getattr(settings, 'AGENDAMENTO_EVENTOS_LOTE_MAX', 500)
+# Dias que um evento fica em AgendamentoHistorico antes de ir para o arquivo
+AGENDAMENTO_HISTORICO_RETENCAO_DIAS = getattr(settings, 'AGENDAMENTO_HISTORICO_RETENCAO_DIAS', 180)
+
+_contexto = ContextVar('eventos_agendamento', default=None)
+
+
+class _Lote:
+    def __init__(self, origem, usuario_id, request=None, na_transacao=False):
+        self.origem = origem
+        self.usuario_id = usuario_id
+        self.request = request
+        self.na_transacao = na_transacao
+        self.eventos = []
+        self.alteracoes = []
+
+    @property
+    def autor(self):
+        # Na requisição, o autor é quem a view autenticou (request.user do DRF)
+        if self.usuario_id is None and self.request is not None:
+            from .authentication import UsuarioPrincipal
+            usuario = getattr(self.request, 'user', None)
+            if isinstance(usuario, UsuarioPrincipal):
+                return usuario.id
+        return self.usuario_id
+
+    def descarregar(self):
+        eventos, self.eventos = self.eventos, []
+        alteracoes, self.alteracoes = self.alteracoes, []
+        _gravar(eventos)
+        _gravar_alteracoes(alteracoes)
+
+
+def _gravar(eventos):
+    if eventos:
+        from .models import AgendamentoHistorico
+        AgendamentoHistorico.objects.bulk_create(eventos)
+
+
+def _gravar_alteracoes(alteracoes):
+    if alteracoes:
+        from .sincronizacao import gravar
+        gravar(alteracoes)
+
+
+def _enfileirar(lote, evento):
+    lote.eventos.append(evento)
+    if len(lote.eventos) >= AGENDAMENTO_EVENTOS_LOTE_MAX:
+        lote.descarregar()
+
+
+def enfileirar_alteracao(alteracao):
+    """Como _enfileirar, para uma linha do feed de sincronização (chamar no commit)."""
+    lote = _contexto.get()
+    if lote is None:
+        _gravar_alteracoes([alteracao])
+        return
+    lote.alteracoes.append(alteracao)
+    if len(lote.alteracoes) >= AGENDAMENTO_EVENTOS_LOTE_MAX:
+        lote.descarregar()
+
+
+def agendar_gravacao(funcao):
+    """
+    Roda `funcao` (que enfileira uma alteração) no commit ou, dentro de
+    `na_transacao()`, já: o lote grava antes do commit.
+    """
+    lote = _contexto.get()
+    if lote is not None and lote.na_transacao:
+        funcao()
+    else:
+        # Fora de transação o on_commit roda na hora
+        transaction.on_commit(funcao)
+
+
+def registrar(agendamento_id, para, de=None, origem=None, usuario_id=None, destinatarios=()):
+    """
+    Registra a mudança de status `de` -> `para` (`de=None` na criação), na
+    transação atual. Origem e autor não informados vêm do lote atual. `destinatarios` (ids do
+    paciente e do profissional) recebem a mudança por SSE (notificacoes.py).
+    """
+    from .models import AgendamentoHistorico
+
+    lote = _contexto.get()
+    evento = AgendamentoHistorico(
+        agendamento_id=agendamento_id,
+        status_anterior=de,
+        status_novo=para,
+        origem=origem or (lote.origem if lote else 'sistema'),
+        usuario_id=usuario_id if usuario_id is not None else (lote.autor if lote else None),
+        data_status=timezone.now(),
+    )
+    if lote is not None and lote.na_transacao:
+        _enfileirar(lote, evento)
+    else:
+        # Na transação de quem mudou o status (Agendamento.save abre uma)
+        _gravar([evento])
+    if destinatarios:
+        from .notificacoes import notificar_status
+        transaction.on_commit(lambda: notificar_status(evento, destinatarios))
+
+
+@contextmanager
+def em_lote(origem='sistema', usuario_id=None, request=None):
+    """Acumula as alterações do feed registradas no bloco e grava todas juntas no fim."""
+    lote = _Lote(origem, usuario_id, request)
+    token = _contexto.set(lote)
+    try:
+        yield lote
+    finally:
+        _contexto.reset(token)
+        lote.descarregar()
+
+
+@asynccontextmanager
+async def em_lote_async(origem='sistema', usuario_id=None, request=None):
+    """em_lote para código async: a gravação do fim roda numa thread."""
+    lote = _Lote(origem, usuario_id, request)
+    token = _contexto.set(lote)
+    try:
+        yield lote
+    finally:
+        _contexto.reset(token)
+        if lote.eventos or lote.alteracoes:
+            await sync_to_async(lote.descarregar)()
+
+
+@contextmanager
+def na_transacao(origem='sistema', usuario_id=None):
+    """
+    Lote gravado dentro da transação atual, na saída do bloco (usar dentro do
+    atomic()). Se o bloco falhar nada é gravado e a transação é desfeita.
+    Numa requisição, o autor continua vindo dela.
+    """
+    externo = _contexto.get()
+    lote = _Lote(origem, usuario_id, request=externo.request if externo else None, na_transacao=True)
+    token = _contexto.set(lote)
+    try:
+        yield lote
+    finally:
+        _contexto.reset(token)
+    lote.descarregar()
+
+
+@contextmanager
+def origem_eventos(origem):
+    """
+    Troca a origem dos eventos no lote atual (abre um lote se não houver).
+    Serve também como decorator de view.
+    """
+    lote = _contexto.get()
+    if lote is None:
+        with em_lote(origem):
+            yield
+        return
+    anterior, lote.origem = lote.origem, origem
+    try:
+        yield
+    finally:
+        lote.origem = anterior
+
+
+def comprimir(eventos):
+    return zlib.compress(json.dumps(eventos, separators=(',', ':'), default=str).encode(), 9)
+
+
+def descomprimir(dados):
+    return json.loads(zlib.decompress(bytes(dados)))
+
+
+def arquivar_lote(limite, tamanho):
+    """
+    Move até `tamanho` eventos anteriores a `limite` para um bloco comprimido de
+    AgendamentoHistoricoArquivo, numa transação. Devolve quantos moveu.
+    """
+    from .models import AgendamentoHistorico, AgendamentoHistoricoArquivo
+
+    campos = ['id', 'agendamento_id', 'status_anterior', 'status_novo', 'origem', 'usuario_id', 'data_status']
+    with transaction.atomic():
+        eventos = list(
+            AgendamentoHistorico.objects.filter(data_status__lt=limite)
+            .order_by('id').values(*campos)[:tamanho]
+        )
+        if not eventos:
+            return 0
+        AgendamentoHistoricoArquivo.objects.create(
+            primeiro_id=eventos[0]['id'],
+            ultimo_id=eventos[-1]['id'],
+            inicio=min(e['data_status'] for e in eventos),
+            fim=max(e['data_status'] for e in eventos),
+            quantidade=len(eventos),
+            dados=comprimir([[e[c] for c in campos] for e in eventos]),
+        )
+        AgendamentoHistorico.objects.filter(id__in=[e['id'] for e in eventos]).delete()
+    return len(eventos)
@@ -0,0 +1,137 @@
+"""
+Verificação local de ID tokens do Google.
+
+Em vez de chamar o endpoint tokeninfo a cada login, o token é validado aqui
+(assinatura RS256, emissor, expiração, audience e e-mail verificado) com as
+chaves públicas do Google (JWKS). Sem GOOGLE_CLIENT_ID o login com Google é
+recusado: sem checar o audience, um token emitido para outro app passaria. As chaves ficam em cache no processo,
+respeitando o Cache-Control max-age da resposta; um `kid` desconhecido ou o
+cache vencido disparam uma atualização em background (uma de cada vez).
+"""
+import json
+import re
+import threading
+import time
+
+import jwt
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+GOOGLE_JWKS_URL = getattr(settings, 'GOOGLE_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+GOOGLE_CLIENT_ID = getattr(settings, 'GOOGLE_CLIENT_ID', None)
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+JWKS_MAX_AGE_PADRAO = 3600       # segundos, se a resposta não trouxer max-age
+JWKS_INTERVALO_MINIMO = 30       # evita refetch em rajada por kid desconhecido
+JWKS_ESPERA_REFRESH = 5          # quanto um login espera por uma atualização em curso
+
+
+class JWKSCache:
+    def __init__(self, url_func):
+        self._url_func = url_func
+        self._chaves = {}
+        self._expira_em = 0.0
+        self._ultimo_fetch = 0.0
+        self._lock = threading.Lock()
+        self._atualizando = None  # threading.Event da atualização em curso
+
+    def _buscar(self):
+        resposta = requests.get(self._url_func(), timeout=5)
+        resposta.raise_for_status()
+        chaves = {}
+        for jwk in resposta.json().get('keys', []):
+            if jwk.get('kid'):
+                chaves[jwk['kid']] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+        max_age = JWKS_MAX_AGE_PADRAO
+        match = re.search(r'max-age=(\d+)', resposta.headers.get('Cache-Control', ''))
+        if match:
+            max_age = int(match.group(1))
+        return chaves, max_age
+
+    def _executar_refresh(self, evento):
+        try:
+            chaves, max_age = self._buscar()
+            with self._lock:
+                self._chaves = chaves
+                self._expira_em = time.monotonic() + max_age
+        except Exception as e:
+            print(f"Erro ao atualizar chaves do Google (JWKS): {e}")
+        finally:
+            with self._lock:
+                self._atualizando = None
+            evento.set()
+
+    def _disparar_refresh(self, forcar=False):
+        """Inicia (ou reaproveita) a atualização em background e devolve o Event dela."""
+        with self._lock:
+            if self._atualizando is not None:
+                return self._atualizando
+            agora = time.monotonic()
+            if not forcar and agora - self._ultimo_fetch < JWKS_INTERVALO_MINIMO:
+                return None
+            self._ultimo_fetch = agora
+            evento = threading.Event()
+            self._atualizando = evento
+        threading.Thread(target=self._executar_refresh, args=(evento,), daemon=True).start()
+        return evento
+
+    def get(self, kid):
+        with self._lock:
+            chave = self._chaves.get(kid)
+            vencido = time.monotonic() >= self._expira_em
+            vazio = not self._chaves
+
+        if chave is not None:
+            if vencido:
+                # Usa a chave atual e renova em background
+                self._disparar_refresh()
+            return chave
+
+        # kid desconhecido (rotação de chaves) ou cache vazio: espera a atualização
+        evento = self._disparar_refresh(forcar=vazio)
+        if evento is not None:
+            evento.wait(JWKS_ESPERA_REFRESH)
+        with self._lock:
+            return self._chaves.get(kid)
+
+    def limpar(self):
+        with self._lock:
+            self._chaves = {}
+            self._expira_em = 0.0
+            self._ultimo_fetch = 0.0
+
+
+# A URL é lida das settings a cada busca para os testes poderem apontar
+# para um servidor de chaves local (override_settings).
+jwks_google = JWKSCache(lambda: getattr(settings, 'GOOGLE_JWKS_URL', GOOGLE_JWKS_URL))
+
+
+def verificar_id_token_google(token):
+    """
+    Valida o ID token e devolve as claims (email, name, ...).
+    Levanta jwt.InvalidTokenError se o token não for válido e
+    ImproperlyConfigured se GOOGLE_CLIENT_ID não estiver definido.
+    """
+    client_id = getattr(settings, 'GOOGLE_CLIENT_ID', GOOGLE_CLIENT_ID)
+    if not client_id:
+        raise ImproperlyConfigured('GOOGLE_CLIENT_ID não configurado: login com Google desativado.')
+
+    cabecalho = jwt.get_unverified_header(token)
+    chave = jwks_google.get(cabecalho.get('kid'))
+    if chave is None:
+        raise jwt.InvalidTokenError('Chave de assinatura do Google desconhecida.')
+
+    claims = jwt.decode(
+        token,
+        chave,
+        algorithms=['RS256'],
+        audience=client_id,
+        options={'require': ['exp', 'iat', 'aud', 'iss']},
+    )
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise jwt.InvalidIssuerError('Emissor do token não é o Google.')
+    # O e-mail identifica a conta: só vale se o Google confirmou que é do usuário
+    if claims.get('email_verified') not in (True, 'true'):
+        raise jwt.InvalidTokenError('E-mail do token não verificado pelo Google.')
+    return claims
@@ -0,0 +1,58 @@
+"""
+Política de hash de senhas.
+
+O hasher padrão é Argon2 com custos lidos das settings (ARGON2_TIME_COST,
+ARGON2_MEMORY_COST, ARGON2_PARALLELISM), para poder ajustar o custo ao hardware
+com o comando `benchmark_login`. Hashes antigos (PBKDF2) continuam válidos e são
+regravados com a política atual no primeiro login bem-sucedido, fora do
+caminho da resposta.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, check_password, make_password
+
+_executor_rehash = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'REHASH_SENHA_WORKERS', 1),
+    thread_name_prefix='rehash-senha',
+)
+
+
+class Argon2AjustavelPasswordHasher(Argon2PasswordHasher):
+    """Argon2 com os parâmetros de custo configuráveis pelas settings."""
+    time_cost = getattr(settings, 'ARGON2_TIME_COST', Argon2PasswordHasher.time_cost)
+    memory_cost = getattr(settings, 'ARGON2_MEMORY_COST', Argon2PasswordHasher.memory_cost)
+    parallelism = getattr(settings, 'ARGON2_PARALLELISM', Argon2PasswordHasher.parallelism)
+
+
+def _regravar_hash(usuario_id, senha, hash_antigo):
+    from django.db import close_old_connections
+    from .models import Usuario
+    from .authentication import usuario_cache
+
+    try:
+        novo_hash = make_password(senha)
+        # Só troca se a senha não mudou nesse meio tempo
+        Usuario.objects.filter(id=usuario_id, senha=hash_antigo).update(senha=novo_hash)
+        usuario_cache.invalidate(usuario_id)
+    except Exception as e:
+        print(f"Erro ao atualizar hash de senha do usuário {usuario_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def agendar_rehash(usuario_id, senha, hash_antigo):
+    return _executor_rehash.submit(_regravar_hash, usuario_id, senha, hash_antigo)
+
+
+def verificar_senha(usuario, senha):
+    """
+    Confere a senha do Usuario. Se o hash estiver num formato/custo antigo,
+    agenda a regravação em background em vez de fazê-la durante a requisição.
+    """
+    hash_antigo = usuario.senha
+
+    def setter(senha_em_texto):
+        agendar_rehash(usuario.id, senha_em_texto, hash_antigo)
+
+    return check_password(senha, hash_antigo, setter)
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_projeto.eventos import AGENDAMENTO_HISTORICO_RETENCAO_DIAS, arquivar_lote
+
+
+class Command(BaseCommand):
+    help = (
+        "Move os eventos de AgendamentoHistorico mais antigos que a retenção para "
+        "AgendamentoHistoricoArquivo, em blocos comprimidos, para manter a tabela pequena."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=AGENDAMENTO_HISTORICO_RETENCAO_DIAS,
+                            help='Eventos com mais dias que isso são arquivados.')
+        parser.add_argument('--lote', type=int, default=1000, help='Eventos por bloco (e por transação).')
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(days=options['dias'])
+        lote = max(1, options['lote'])
+        total = 0
+        while True:
+            movidos = arquivar_lote(limite, lote)
+            total += movidos
+            if movidos < lote:
+                break
+        self.stdout.write(f"{total} evento(s) arquivado(s).")
@@ -0,0 +1,101 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+
+def _criar_usuario(role, **extra):
+    from app_projeto.models import Usuario
+    sufixo = uuid.uuid4().hex[:12]
+    return Usuario.objects.create(
+        nome=f'Benchmark {role} {sufixo}', email=f'benchmark-{sufixo}@exemplo.com', cpf=sufixo,
+        senha=make_password(None), role=role, **extra,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Testa criar_agendamento sob concorrência contra o banco configurado: dispara '
+        'muitas reservas em paralelo para o MESMO horário (deve haver exatamente um '
+        'vencedor) e mede agendamentos/s para horários distintos. Os dados criados '
+        'são removidos no fim.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concorrentes', type=int, default=200, help='Reservas simultâneas para o mesmo horário.')
+        parser.add_argument('--distintos', type=int, default=200, help='Reservas para horários distintos (vazão).')
+        parser.add_argument('--threads', type=int, default=32, help='Threads disparando requisições.')
+        parser.add_argument('--manter', action='store_true', help='Não apaga os usuários/agendamentos criados.')
+
+    def _reservar(self, payload, barreira=None):
+        from app_projeto.views import criar_agendamento
+        try:
+            request = APIRequestFactory().post('/api/agendamentos/criar/', payload, format='json')
+            if barreira is not None:
+                barreira.wait()
+            return criar_agendamento(request).status_code
+        except Exception as e:
+            # Erro do banco (lock/deadlock) conta como falha, sem derrubar o benchmark
+            return type(e).__name__
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        from app_projeto.models import Agendamento
+
+        profissional = _criar_usuario('Psicologo', crp='00/0000', valor_consulta=100)
+        paciente = _criar_usuario('Paciente')
+        threads = max(1, options['threads'])
+        try:
+            # 1) Muitos pacientes no mesmo slot ao mesmo tempo
+            slot = (timezone.now() + timedelta(days=365)).replace(minute=0, second=0, microsecond=0)
+            payload = {'usuario': paciente.id, 'psicologo': profissional.id, 'data_hora': slot.isoformat()}
+            concorrentes = max(1, options['concorrentes'])
+            # A primeira leva (uma requisição por thread) sai junto, presa numa barreira
+            barreira = threading.Barrier(min(threads, concorrentes), timeout=30)
+
+            def disparar(i):
+                return self._reservar(payload, barreira if i < barreira.parties else None)
+
+            with ThreadPoolExecutor(threads) as pool:
+                status_codes = list(pool.map(disparar, range(concorrentes)))
+            vencedores = status_codes.count(201)
+            erros = sum(1 for c in status_codes if isinstance(c, str))
+            no_banco = Agendamento.objects.filter(
+                psicologo=profissional, data_hora=slot, status__in=Agendamento.STATUS_OCUPAM_AGENDA,
+            ).count()
+            resumo = f'{concorrentes} reservas simultâneas: {vencedores} aceita(s), {erros} erro(s) de banco, {no_banco} no banco'
+            if vencedores == 1 and no_banco == 1:
+                self.stdout.write(self.style.SUCCESS(resumo + ' (ok)'))
+            else:
+                self.stdout.write(self.style.ERROR(resumo + ' (esperado exatamente 1)'))
+
+            # 2) Vazão com horários distintos
+            distintos = max(1, options['distintos'])
+            inicio_slots = slot + timedelta(days=1)
+            payloads = [
+                {'usuario': paciente.id, 'psicologo': profissional.id,
+                 'data_hora': (inicio_slots + timedelta(minutes=30 * i)).isoformat()}
+                for i in range(distintos)
+            ]
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                status_codes = list(pool.map(self._reservar, payloads))
+            duracao = time.perf_counter() - t0
+            aceitos = status_codes.count(201)
+            erros = sum(1 for c in status_codes if isinstance(c, str))
+            self.stdout.write(
+                f'{distintos} horários distintos: {aceitos} aceitos, {erros} erro(s) de banco em {duracao:.2f}s '
+                f'({aceitos / duracao:.1f} agendamentos/s com {threads} threads)'
+            )
+        finally:
+            if not options['manter']:
+                profissional.delete()
+                paciente.delete()
@@ -0,0 +1,73 @@
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def _rodar_worker(args):
+    """Executa num processo separado: mede check_password contra um hash da política atual."""
+    import django
+    django.setup()
+    from django.contrib.auth.hashers import check_password, make_password
+
+    iteracoes, senha, overrides = args
+    from app_projeto.hashers import Argon2AjustavelPasswordHasher
+    for campo, valor in overrides.items():
+        setattr(Argon2AjustavelPasswordHasher, campo, valor)
+
+    encoded = make_password(senha)
+    latencias = []
+    inicio = time.perf_counter()
+    for _ in range(iteracoes):
+        t0 = time.perf_counter()
+        check_password(senha, encoded)
+        latencias.append(time.perf_counter() - t0)
+    total = time.perf_counter() - inicio
+    return {
+        'algoritmo': encoded.split('$', 1)[0],
+        'logins_por_segundo': iteracoes / total,
+        'p50_ms': _percentil(latencias, 50) * 1000,
+        'p99_ms': _percentil(latencias, 99) * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o custo do hash de senha usado no login: logins/s e latência p99 '
+        'por worker, para dimensionar os parâmetros do Argon2 no hardware atual.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Processos em paralelo (simula workers do servidor).')
+        parser.add_argument('--iteracoes', type=int, default=50, help='Verificações de senha por worker.')
+        parser.add_argument('--time-cost', type=int, help='Sobrescreve ARGON2_TIME_COST só para o benchmark.')
+        parser.add_argument('--memory-cost', type=int, help='Sobrescreve ARGON2_MEMORY_COST (KiB) só para o benchmark.')
+        parser.add_argument('--parallelism', type=int, help='Sobrescreve ARGON2_PARALLELISM só para o benchmark.')
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['time_cost'] is not None:
+            overrides['time_cost'] = options['time_cost']
+        if options['memory_cost'] is not None:
+            overrides['memory_cost'] = options['memory_cost']
+        if options['parallelism'] is not None:
+            overrides['parallelism'] = options['parallelism']
+
+        workers = max(1, options['workers'])
+        tarefa = (options['iteracoes'], 'senha-de-benchmark-123', overrides)
+        with Pool(workers) as pool:
+            resultados = pool.map(_rodar_worker, [tarefa] * workers)
+
+        for i, r in enumerate(resultados, start=1):
+            self.stdout.write(
+                f"worker {i}: {r['algoritmo']} | {r['logins_por_segundo']:.1f} logins/s | "
+                f"p50 {r['p50_ms']:.1f} ms | p99 {r['p99_ms']:.1f} ms"
+            )
+        total = sum(r['logins_por_segundo'] for r in resultados)
+        self.stdout.write(self.style.SUCCESS(f"Total: {total:.1f} logins/s com {workers} worker(s)"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app_projeto.sincronizacao import compactar_lote
+
+
+class Command(BaseCommand):
+    help = (
+        "Apaga do feed de sincronização (Alteracao) as linhas que já têm uma alteração "
+        "mais nova do mesmo objeto, deixando uma linha por registro."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Linhas examinadas por vez.')
+
+    def handle(self, *args, **options):
+        lote = max(1, options['lote'])
+        ultima, total = 0, 0
+        while True:
+            ultima, apagadas = compactar_lote(ultima, lote)
+            total += apagadas
+            if ultima is None:
+                break
+        self.stdout.write(f"{total} alteração(ões) superada(s) apagada(s).")
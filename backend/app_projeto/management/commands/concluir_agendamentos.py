@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from app_projeto.availability import DURACAO_SLOT
+from app_projeto.models import Agendamento
+from app_projeto.transicoes import ComandoTransicaoLote, transicionar_lote
+
+STATUS_A_CONCLUIR = ['paga', 'confirmado']
+
+
+def passadas(limite):
+    """Consultas pagas/confirmadas que começaram antes de `limite`."""
+    return Agendamento.objects.filter(
+        status__in=STATUS_A_CONCLUIR, data_hora__lt=limite,
+    ).order_by('data_hora')
+
+
+def concluir_lote(limite, tamanho):
+    """Marca como 'Concluida' até `tamanho` consultas passadas. Devolve quantas concluiu."""
+    return transicionar_lote(passadas(limite), 'Concluida', 'conclusao', tamanho)
+
+
+class Command(ComandoTransicaoLote):
+    help = (
+        "Marca como 'Concluida' as consultas pagas/confirmadas que já terminaram, "
+        "liberando a avaliação. Roda uma vez ou em loop (--loop) como worker."
+    )
+    status_novo = 'Concluida'
+    origem = 'conclusao'
+    mensagem = '{} agendamento(s) concluído(s).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duracao', type=int, default=DURACAO_SLOT,
+                            help='Minutos de consulta: conclui as que começaram antes de agora menos isso.')
+        super().add_arguments(parser)
+
+    def agendamentos(self, options):
+        return passadas(timezone.now() - timedelta(minutes=options['duracao']))
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from app_projeto.models import Agendamento
+from app_projeto.transicoes import ComandoTransicaoLote, transicionar_lote
+
+AGENDAMENTO_PENDENTE_TTL_MINUTOS = getattr(settings, 'AGENDAMENTO_PENDENTE_TTL_MINUTOS', 30)
+AGENDAMENTO_CHECKOUT_TTL_MINUTOS = getattr(settings, 'AGENDAMENTO_CHECKOUT_TTL_MINUTOS', 25 * 60)
+
+
+def vencidos(limite_sem_checkout, limite_checkout):
+    """Pendentes criados antes do limite (mais curto sem sessão de checkout)."""
+    sem_checkout = Q(stripe_session_id__isnull=True) | Q(stripe_session_id='')
+    return Agendamento.objects.filter(
+        (sem_checkout & Q(data_criacao__lt=limite_sem_checkout)) | Q(data_criacao__lt=limite_checkout),
+        status='pendente',
+    ).order_by('data_criacao')
+
+
+def expirar_lote(limite_sem_checkout, limite_checkout, tamanho):
+    """Cancela até `tamanho` agendamentos 'pendente' vencidos. Devolve quantos cancelou."""
+    return transicionar_lote(vencidos(limite_sem_checkout, limite_checkout), 'cancelado', 'expiracao', tamanho)
+
+
+class Command(ComandoTransicaoLote):
+    help = (
+        "Cancela agendamentos 'pendente' cujo pagamento não foi concluído dentro do "
+        "prazo, liberando o horário. Roda uma vez ou em loop (--loop) como worker."
+    )
+    status_novo = 'cancelado'
+    origem = 'expiracao'
+    mensagem = '{} agendamento(s) pendente(s) expirado(s).'
+    intervalo_padrao = 60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=AGENDAMENTO_PENDENTE_TTL_MINUTOS,
+                            help='Minutos até expirar um pendente sem sessão de checkout.')
+        parser.add_argument('--ttl-checkout', type=int, default=AGENDAMENTO_CHECKOUT_TTL_MINUTOS,
+                            help='Minutos até expirar um pendente com sessão de checkout aberta.')
+        super().add_arguments(parser)
+
+    def agendamentos(self, options):
+        agora = timezone.now()
+        return vencidos(agora - timedelta(minutes=options['ttl']), agora - timedelta(minutes=options['ttl_checkout']))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_projeto.revocation import limpar_tokens_expirados
+
+
+class Command(BaseCommand):
+    help = "Apaga os tokens revogados (TokenRevogado) que já passaram da expiração."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Linhas apagadas por vez.')
+
+    def handle(self, *args, **options):
+        total = limpar_tokens_expirados(max(1, options['lote']))
+        self.stdout.write(f"{total} token(s) revogado(s) expirado(s) apagado(s).")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from app_projeto.cache_publico import invalidar
+from app_projeto.models import Avaliacao, AvaliacaoResumo
+
+
+def agregar_notas(avaliacoes):
+    """Um GROUP BY por profissional com total, soma e histograma das notas."""
+    return avaliacoes.filter(tipo_avaliador='paciente', agendamento__profissional__isnull=False).values(
+        'agendamento__profissional',
+    ).annotate(
+        total=Count('id'),
+        soma=Sum('nota'),
+        **{f'notas_{nota}': Count('id', filter=Q(nota=nota)) for nota in range(1, 6)},
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Refaz AvaliacaoResumo a partir das avaliações (normalmente mantido pelos "
+        "sinais de Avaliacao). Use depois de updates/deletes em lote ou para conferir."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profissional', type=int, help='Só este profissional.')
+
+    def handle(self, *args, **options):
+        avaliacoes = Avaliacao.objects.all()
+        resumos = AvaliacaoResumo.objects.all()
+        if options['profissional']:
+            avaliacoes = avaliacoes.filter(agendamento__profissional_id=options['profissional'])
+            resumos = resumos.filter(profissional_id=options['profissional'])
+        novos = [
+            AvaliacaoResumo(profissional_id=linha.pop('agendamento__profissional'), **linha)
+            for linha in agregar_notas(avaliacoes)
+        ]
+        with transaction.atomic():
+            antigos = set(resumos.values_list('profissional_id', flat=True))
+            resumos.delete()
+            AvaliacaoResumo.objects.bulk_create(novos)
+            # A média aparece nas leituras em cache (cache_publico.py)
+            profissionais = antigos | {r.profissional_id for r in novos}
+            invalidar('profissionais', *[f'avaliacoes:{pid}' for pid in profissionais])
+        self.stdout.write(f"{len(novos)} resumo(s) de avaliação recalculado(s).")
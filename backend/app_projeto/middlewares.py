@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
 from .utils import verify_jwt  # Função que valida o JWT
 
@@ -29,3 +30,34 @@ class JWTAuthenticationMiddleware:
         # Se o token for válido, continua com a requisição
         response = self.get_response(request)
         return response
+
+
+class EventosAgendamentoMiddleware:
+    """
+    Abre um lote de eventos de agendamento por requisição: dá origem e autor
+    aos eventos de status (gravados na transação de cada mudança) e grava as
+    linhas do feed de sincronização da view juntas, no fim. Uma falha nessa
+    gravação sobe como erro da requisição.
+    Funciona também no modo async (ASGI), para o stream SSE não prender uma thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        from .eventos import em_lote
+
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with em_lote('api', request=request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        from .eventos import em_lote_async
+
+        async with em_lote_async('api', request=request):
+            return await self.get_response(request)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0031_alter_agendamento_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevogacaoUsuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usuario_id', models.BigIntegerField(unique=True)),
+                ('revogar_antes_de', models.DateTimeField(help_text='Tokens emitidos antes desta data são recusados')),
+                ('data_atualizacao', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TokenRevogado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jti', models.CharField(max_length=255, unique=True)),
+                ('usuario_id', models.BigIntegerField(blank=True, null=True)),
+                ('expira_em', models.DateTimeField(db_index=True)),
+                ('data_criacao', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 10:45
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def cancelar_pendentes_duplicados(apps, schema_editor):
+    """
+    Antes da restrição de unicidade: onde o mesmo profissional tem vários
+    agendamentos ativos no mesmo horário, mantém um (de preferência um já
+    pago/confirmado, senão o mais antigo) e cancela os 'pendente' excedentes.
+    Duplicados já pagos ficam para resolução manual (a migração falha na
+    restrição).
+    """
+    Agendamento = apps.get_model('app_projeto', 'Agendamento')
+    ativos = ['pendente', 'confirmado', 'paga']
+    for campo in ('psicologo', 'psiquiatra'):
+        duplicados = (
+            Agendamento.objects.filter(status__in=ativos, **{f'{campo}__isnull': False})
+            .values(campo, 'data_hora')
+            .annotate(total=Count('id'))
+            .filter(total__gt=1)
+        )
+        for dup in duplicados:
+            grupo = list(
+                Agendamento.objects.filter(status__in=ativos, data_hora=dup['data_hora'], **{campo: dup[campo]})
+                .order_by('id').values_list('id', 'status')
+            )
+            mantido = next((i for i, st in grupo if st != 'pendente'), grupo[0][0])
+            excedentes = [i for i, st in grupo if st == 'pendente' and i != mantido]
+            Agendamento.objects.filter(id__in=excedentes).update(status='cancelado')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0032_tokenrevogado_revogacaousuario'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancelar_pendentes_duplicados, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='agendamento',
+            name='slot_ativo',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(status__in=['pendente', 'confirmado', 'paga'], then=models.F('data_hora')), default=None), output_field=models.DateTimeField(null=True)),
+        ),
+        migrations.AddConstraint(
+            model_name='agendamento',
+            constraint=models.UniqueConstraint(fields=('psicologo', 'slot_ativo'), name='agendamento_slot_unico_psicologo'),
+        ),
+        migrations.AddConstraint(
+            model_name='agendamento',
+            constraint=models.UniqueConstraint(fields=('psiquiatra', 'slot_ativo'), name='agendamento_slot_unico_psiquiatra'),
+        ),
+    ]
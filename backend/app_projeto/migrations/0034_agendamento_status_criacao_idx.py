@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0033_agendamento_slot_unico'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['status', 'data_criacao'], name='agendamento_status_criacao'),
+        ),
+    ]
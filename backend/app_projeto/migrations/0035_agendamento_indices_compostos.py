@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0034_agendamento_status_criacao_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['psicologo', 'data_hora', 'status'], name='agendamento_psicologo_data'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['psiquiatra', 'data_hora', 'status'], name='agendamento_psiquiatra_data'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['usuario', 'data_hora'], name='agendamento_paciente_data'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['stripe_session_id'], name='agendamento_stripe_session'),
+        ),
+    ]
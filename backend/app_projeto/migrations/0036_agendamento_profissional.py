@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+TAMANHO_LOTE = 1000
+
+
+def preencher_profissional(apps, schema_editor):
+    """
+    Backfill em lotes por faixa de id, cada lote na sua transação, para não
+    segurar locks na tabela inteira.
+    """
+    Agendamento = apps.get_model('app_projeto', 'Agendamento')
+    ultimo_id = Agendamento.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for inicio in range(0, ultimo_id + 1, TAMANHO_LOTE):
+        with transaction.atomic():
+            Agendamento.objects.filter(
+                id__gte=inicio, id__lt=inicio + TAMANHO_LOTE, profissional__isnull=True,
+            ).update(profissional=Coalesce(F('psiquiatra'), F('psicologo')))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('app_projeto', '0035_agendamento_indices_compostos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agendamento',
+            name='profissional',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='agendamentos_profissional', to='app_projeto.usuario'),
+        ),
+        migrations.RunPython(preencher_profissional, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['profissional', 'data_hora', 'status'], name='agendamento_profissional_data'),
+        ),
+        migrations.AddConstraint(
+            model_name='agendamento',
+            constraint=models.UniqueConstraint(fields=('profissional', 'slot_ativo'), name='agendamento_slot_unico'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='agendamento',
+            name='agendamento_slot_unico_psicologo',
+        ),
+        migrations.RemoveConstraint(
+            model_name='agendamento',
+            name='agendamento_slot_unico_psiquiatra',
+        ),
+        migrations.RemoveIndex(
+            model_name='agendamento',
+            name='agendamento_psicologo_data',
+        ),
+        migrations.RemoveIndex(
+            model_name='agendamento',
+            name='agendamento_psiquiatra_data',
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, transaction
+from django.db.models import Q
+
+TAMANHO_LOTE = 1000
+
+
+def remover_prontuarios_vazios(apps, schema_editor):
+    """
+    Apaga os prontuários vazios que o antigo sinal criou para consultas depois
+    canceladas. Em lotes por faixa de id, cada lote na sua transação.
+    """
+    Prontuario = apps.get_model('app_projeto', 'Prontuario')
+    vazios = Prontuario.objects.filter(
+        Q(texto__isnull=True) | Q(texto=''),
+        Q(mensagem_paciente__isnull=True) | Q(mensagem_paciente=''),
+        Q(atestado_pdf__isnull=True) | Q(atestado_pdf=''),
+        Q(receita_pdf__isnull=True) | Q(receita_pdf=''),
+        agendamento__status='cancelado',
+    )
+    ultimo_id = Prontuario.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for inicio in range(0, ultimo_id + 1, TAMANHO_LOTE):
+        with transaction.atomic():
+            vazios.filter(id__gte=inicio, id__lt=inicio + TAMANHO_LOTE).delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('app_projeto', '0036_agendamento_profissional'),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_prontuarios_vazios, migrations.RunPython.noop),
+    ]
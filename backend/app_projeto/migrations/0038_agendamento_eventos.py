@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 11:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0037_remover_prontuarios_vazios_cancelados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendamentoHistoricoArquivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primeiro_id', models.BigIntegerField()),
+                ('ultimo_id', models.BigIntegerField()),
+                ('inicio', models.DateTimeField()),
+                ('fim', models.DateTimeField()),
+                ('quantidade', models.PositiveIntegerField()),
+                ('dados', models.BinaryField()),
+                ('data_arquivamento', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='agendamentohistorico',
+            name='origem',
+            field=models.CharField(choices=[('api', 'API'), ('lote', 'Criação em lote'), ('checkout', 'Checkout Stripe'), ('webhook', 'Webhook Stripe'), ('estorno', 'Estorno/cancelamento'), ('expiracao', 'Expiração de pendentes'), ('sistema', 'Sistema')], default='sistema', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='agendamentohistorico',
+            name='status_novo',
+            field=models.CharField(blank=True, choices=[('pendente', 'Pendente'), ('paga', 'Consulta paga'), ('confirmado', 'Confirmado'), ('Concluida', 'Concluída'), ('cancelado', 'Cancelado')], max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='agendamentohistorico',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos_agendamento', to='app_projeto.usuario'),
+        ),
+        migrations.AlterField(
+            model_name='agendamentohistorico',
+            name='data_status',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='agendamentohistorico',
+            name='status_anterior',
+            field=models.CharField(blank=True, choices=[('pendente', 'Pendente'), ('paga', 'Consulta paga'), ('confirmado', 'Confirmado'), ('Concluida', 'Concluída'), ('cancelado', 'Cancelado')], max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='agendamentohistorico',
+            index=models.Index(fields=['data_status'], name='historico_data_status'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0038_agendamento_eventos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='agendamentohistorico',
+            name='origem',
+            field=models.CharField(choices=[('api', 'API'), ('lote', 'Criação em lote'), ('checkout', 'Checkout Stripe'), ('webhook', 'Webhook Stripe'), ('estorno', 'Estorno/cancelamento'), ('expiracao', 'Expiração de pendentes'), ('conclusao', 'Conclusão automática'), ('sistema', 'Sistema')], default='sistema', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['status', 'data_hora'], name='agendamento_status_data'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def preencher_resumos(apps, schema_editor):
+    """Mesmo cálculo do comando recalcular_avaliacoes, para os dados já existentes."""
+    Avaliacao = apps.get_model('app_projeto', 'Avaliacao')
+    AvaliacaoResumo = apps.get_model('app_projeto', 'AvaliacaoResumo')
+    linhas = Avaliacao.objects.filter(
+        tipo_avaliador='paciente', agendamento__profissional__isnull=False,
+    ).values('agendamento__profissional').annotate(
+        total=Count('id'),
+        soma=Sum('nota'),
+        **{f'notas_{nota}': Count('id', filter=Q(nota=nota)) for nota in range(1, 6)},
+    )
+    AvaliacaoResumo.objects.bulk_create([
+        AvaliacaoResumo(profissional_id=linha.pop('agendamento__profissional'), **linha) for linha in linhas
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0039_agendamento_conclusao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvaliacaoResumo',
+            fields=[
+                ('profissional', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='avaliacao_resumo', serialize=False, to='app_projeto.usuario')),
+                ('total', models.IntegerField(default=0)),
+                ('soma', models.IntegerField(default=0)),
+                ('notas_1', models.IntegerField(default=0)),
+                ('notas_2', models.IntegerField(default=0)),
+                ('notas_3', models.IntegerField(default=0)),
+                ('notas_4', models.IntegerField(default=0)),
+                ('notas_5', models.IntegerField(default=0)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
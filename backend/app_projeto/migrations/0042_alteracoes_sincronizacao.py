@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-18 11:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def criar_sequencia(apps, schema_editor):
+    SequenciaAlteracao = apps.get_model('app_projeto', 'SequenciaAlteracao')
+    SequenciaAlteracao.objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0041_data_atualizacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenciaAlteracao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Alteracao',
+            fields=[
+                ('sequencia', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('modelo', models.CharField(choices=[('agendamento', 'Agendamento'), ('prontuario', 'Prontuário'), ('avaliacao', 'Avaliação')], max_length=12)),
+                ('objeto_id', models.BigIntegerField()),
+                ('paciente_id', models.BigIntegerField(blank=True, null=True)),
+                ('profissional_id', models.BigIntegerField(blank=True, null=True)),
+                ('removido', models.BooleanField(default=False)),
+                ('data', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['paciente_id', 'sequencia'], name='alteracao_paciente_seq'), models.Index(fields=['profissional_id', 'sequencia'], name='alteracao_profissional_seq'), models.Index(fields=['modelo', 'objeto_id', 'sequencia'], name='alteracao_objeto_seq')],
+            },
+        ),
+        migrations.RunPython(criar_sequencia, migrations.RunPython.noop),
+    ]
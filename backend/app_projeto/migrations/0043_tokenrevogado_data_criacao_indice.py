@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_projeto', '0042_alteracoes_sincronizacao'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tokenrevogado',
+            name='data_criacao',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,11 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
 import os
-from django.db.models.signals import post_save
+from django.db.models.functions import Cast, NullIf
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
 # Modelo de Prontuário: cada consulta tem UM prontuário
 class Prontuario(models.Model):
@@ -20,13 +22,20 @@ class Prontuario(models.Model):
     def __str__(self):
         return f'Prontuário de {self.agendamento.usuario.nome} ({self.agendamento.data_hora.date()})'
 
+    @classmethod
+    def do_agendamento(cls, agendamento):
+        """
+        Prontuário da consulta. Ele só é gravado na primeira escrita; até lá
+        devolve um registro virtual vazio (sem id), que vira INSERT no save().
+        """
+        try:
+            return agendamento.prontuario
+        except cls.DoesNotExist:
+            return cls(agendamento=agendamento)
 
-
-@receiver(post_save, sender='app_projeto.agendamento')
-def criar_prontuario_automatico(sender, instance, created, **kwargs):
-    if created:
-        from .models import Prontuario
-        Prontuario.objects.create(agendamento=instance)
+    @property
+    def virtual(self):
+        return self.pk is None
 
 
 
@@ -73,6 +82,7 @@ class Usuario(models.Model):
     foto = models.ImageField(upload_to=user_foto_upload_path, blank=True, null=True)  # Foto do profissional
     stripe_email = models.EmailField(blank=True, null=True, help_text='E-mail da conta Stripe do profissional')
     stripe_account_id = models.CharField(max_length=255, blank=True, null=True, help_text='ID da conta Stripe Connect')
+    data_atualizacao = models.DateTimeField(auto_now=True)  # Entra na versão das listagens (condicional.py)
     # Mercado Pago
     # mp_user_id = models.CharField(max_length=255, blank=True, null=True, help_text='ID da conta Mercado Pago Connect')
     # mp_access_token = models.CharField(max_length=255, blank=True, null=True, help_text='Access Token Mercado Pago')
@@ -90,7 +100,44 @@ class Usuario(models.Model):
         return self.nome
 
 
+# Mantém o cache de usuários da autenticação JWT (e a lista de profissionais da
+# busca de horários e o carrossel) coerente com editar_usuario/excluir_usuario
+@receiver([post_save, post_delete], sender=Usuario)
+def invalidar_cache_usuario(sender, instance, **kwargs):
+    from .authentication import usuario_cache
+    from .availability import indice_proximo_livre
+    from .cache_publico import invalidar
+    from .carrossel import usuario_mudou
+    usuario_cache.invalidate(instance.id)
+    indice_proximo_livre.recarregar_membros()
+    usuario_mudou(instance.id)
+    # Qualquer usuário: uma troca de papel também tira/põe alguém na listagem
+    invalidar('profissionais', f'usuario:{instance.id}')
+
+
+# Revogação de JWT (ver revocation.py). usuario_id não é FK para a marca
+# continuar valendo depois que o usuário é excluído.
+class TokenRevogado(models.Model):
+    jti = models.CharField(max_length=255, unique=True)
+    usuario_id = models.BigIntegerField(blank=True, null=True)
+    expira_em = models.DateTimeField(db_index=True)
+    data_criacao = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Token {self.jti} (usuário {self.usuario_id})"
+
+
+class RevogacaoUsuario(models.Model):
+    usuario_id = models.BigIntegerField(unique=True)
+    revogar_antes_de = models.DateTimeField(help_text="Tokens emitidos antes desta data são recusados")
+    data_atualizacao = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Usuário {self.usuario_id}: tokens antes de {self.revogar_antes_de}"
+
+
 class Agendamento(models.Model):
+    STATUS_OCUPAM_AGENDA = ['pendente', 'confirmado', 'paga']
     STATUS_CHOICES = [
         ('pendente', 'Pendente'),
         ('paga', 'Consulta paga'),
@@ -102,6 +149,10 @@ class Agendamento(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='agendamentos_paciente')
     psiquiatra = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='agendamentos_psiquiatra', blank=True, null=True)
     psicologo = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='agendamentos_psicologo', blank=True, null=True)  # NOVO CAMPO
+    # Profissional da consulta, seja psiquiatra ou psicólogo: é o campo usado nas
+    # consultas. Durante a transição psiquiatra/psicologo continuam preenchidos
+    # (ver sincronizar_profissional) e alimentam os payloads antigos.
+    profissional = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='agendamentos_profissional', blank=True, null=True)
     data_hora = models.DateTimeField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
     link_consulta = models.URLField(max_length=255, blank=True, null=True)
@@ -112,17 +163,148 @@ class Agendamento(models.Model):
     valor_recebido_profissional = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="Valor recebido pelo profissional (R$)")
     valor_plataforma = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="Valor recebido pela plataforma (R$)")
     data_criacao = models.DateTimeField(auto_now_add=True)
+    # auto_now só vale no save(): os UPDATEs em lote também precisam gravar este campo
+    data_atualizacao = models.DateTimeField(auto_now=True)
     stripe_session_id = models.CharField(max_length=255, blank=True, null=True, help_text="ID da sessão Stripe para refund")
 
+    # Igual a data_hora enquanto o agendamento ocupa a agenda e NULL depois
+    # (cancelado/Concluida). Calculado pelo banco, para a unicidade abaixo valer
+    # também em updates em lote.
+    slot_ativo = models.GeneratedField(
+        expression=models.Case(
+            models.When(status__in=STATUS_OCUPAM_AGENDA, then=models.F('data_hora')),
+            default=None,
+        ),
+        output_field=models.DateTimeField(null=True),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Agenda do profissional por período (disponibilidade, conflito ao agendar,
+            # listagem do profissional). status no fim cobre o filtro status__in.
+            models.Index(fields=['profissional', 'data_hora', 'status'], name='agendamento_profissional_data'),
+            # Agendamentos do paciente em ordem de data (listagem paginada)
+            models.Index(fields=['usuario', 'data_hora'], name='agendamento_paciente_data'),
+            # Webhook do Stripe busca o agendamento pela sessão de checkout
+            models.Index(fields=['stripe_session_id'], name='agendamento_stripe_session'),
+            # Varredura de 'pendente' antigos (expirar_agendamentos_pendentes)
+            models.Index(fields=['status', 'data_criacao'], name='agendamento_status_criacao'),
+            # Consultas pagas/confirmadas já passadas (concluir_agendamentos)
+            models.Index(fields=['status', 'data_hora'], name='agendamento_status_data'),
+        ]
+        constraints = [
+            # Um profissional não pode ter dois agendamentos ativos no mesmo horário.
+            # Só cobre inícios idênticos: 10h00 e 10h15, que se sobrepõem, ainda
+            # dependem da checagem sem trava feita antes do insert (criar_agendamento).
+            models.UniqueConstraint(fields=['profissional', 'slot_ativo'], name='agendamento_slot_unico'),
+        ]
+
+    def sincronizar_profissional(self):
+        """
+        Mantém `profissional` e os campos antigos coerentes: quem grava
+        psiquiatra/psicologo define o profissional; quem grava só o profissional
+        tem o campo antigo correspondente preenchido pelo papel dele. Valores
+        que apontam para profissionais diferentes são recusados.
+        """
+        if self.psiquiatra_id and self.psicologo_id:
+            raise ValidationError('Informe psiquiatra ou psicólogo, não os dois.')
+        legado_id = self.psiquiatra_id or self.psicologo_id
+        if legado_id and self.profissional_id and self.profissional_id != legado_id:
+            raise ValidationError('Profissional diferente do psiquiatra/psicólogo informado.')
+        if legado_id:
+            self.profissional_id = legado_id
+        elif self.profissional_id:
+            if self.profissional.role == 'Psiquiatra':
+                self.psiquiatra_id = self.profissional_id
+            else:
+                self.psicologo_id = self.profissional_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Status lido do banco, para o save() saber se houve transição
+        if 'status' in instancia.__dict__:
+            instancia._status_salvo = instancia.status
+        return instancia
+
+    def save(self, *args, **kwargs):
+        from .eventos import registrar
+
+        self.sincronizar_profissional()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'psiquiatra', 'psicologo', 'profissional'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'psiquiatra', 'psicologo', 'profissional'}
+        criando = self._state.adding
+        # Status e evento do histórico no mesmo commit
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            update_fields = kwargs.get('update_fields')
+            destinatarios = (self.usuario_id, self.profissional_id)
+            if criando:
+                registrar(self.id, self.status, destinatarios=destinatarios)
+            elif ('_status_salvo' in self.__dict__ and self._status_salvo != self.status
+                    and (update_fields is None or 'status' in update_fields)):
+                registrar(self.id, self.status, de=self._status_salvo, destinatarios=destinatarios)
+        if 'status' in self.__dict__:
+            self._status_salvo = self.status
 
     def __str__(self):
         return f"{self.usuario.nome} com {self.psiquiatra.nome if self.psiquiatra else ''}{' / ' + self.psicologo.nome if self.psicologo else ''} - {self.data_hora}"
 
 
+# Log só de inserção das mudanças de status de Agendamento. Gravado por
+# eventos.registrar na transação da mudança; linhas antigas vão para AgendamentoHistoricoArquivo.
 class AgendamentoHistorico(models.Model):
+    ORIGEM_CHOICES = [
+        ('api', 'API'),
+        ('lote', 'Criação em lote'),
+        ('checkout', 'Checkout Stripe'),
+        ('webhook', 'Webhook Stripe'),
+        ('estorno', 'Estorno/cancelamento'),
+        ('expiracao', 'Expiração de pendentes'),
+        ('conclusao', 'Conclusão automática'),
+        ('sistema', 'Sistema'),
+    ]
+
     agendamento = models.ForeignKey(Agendamento, on_delete=models.CASCADE)
-    status_anterior = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES)
-    data_status = models.DateTimeField(auto_now_add=True)
+    # Vazio no evento de criação
+    status_anterior = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES, blank=True, null=True)
+    # Vazio nas linhas anteriores ao log de eventos
+    status_novo = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES, blank=True, null=True)
+    origem = models.CharField(max_length=20, choices=ORIGEM_CHOICES, default='sistema')
+    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, related_name='eventos_agendamento', blank=True, null=True)
+    # Momento da mudança (não o da gravação, que num lote vem no fim do bloco)
+    data_status = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Arquivamento por idade (eventos.arquivar_lote)
+            models.Index(fields=['data_status'], name='historico_data_status'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('AgendamentoHistorico é só de inserção.')
+        super().save(*args, **kwargs)
+
+
+class AgendamentoHistoricoArquivo(models.Model):
+    """
+    Eventos de AgendamentoHistorico além da retenção, em blocos: `dados` é a
+    lista de eventos em JSON comprimido com zlib (ver eventos.descomprimir).
+    """
+    primeiro_id = models.BigIntegerField()
+    ultimo_id = models.BigIntegerField()
+    inicio = models.DateTimeField()
+    fim = models.DateTimeField()
+    quantidade = models.PositiveIntegerField()
+    dados = models.BinaryField()
+    data_arquivamento = models.DateTimeField(auto_now_add=True)
+
+    def eventos(self):
+        from .eventos import descomprimir
+        return descomprimir(self.dados)
 
 
 class Endereco(models.Model):
@@ -141,6 +323,13 @@ class Endereco(models.Model):
         return f"{self.logradouro}, {self.numero} - {self.cidade}/{self.estado} ({self.tipo})"
 
 
+# Perfil público (detalhar_usuario) traz os endereços
+@receiver([post_save, post_delete], sender=Endereco)
+def invalidar_cache_endereco(sender, instance, **kwargs):
+    from .cache_publico import invalidar
+    invalidar(f'usuario:{instance.usuario_id}')
+
+
 class HorarioTrabalho(models.Model):
     DIAS_SEMANA = [
         (0, 'Segunda-feira'),
@@ -182,6 +371,24 @@ class HorarioTrabalho(models.Model):
         return f"{self.profissional.nome} - {dia_nome} ({self.horario_inicio} às {self.horario_fim})"
 
 
+# Mantém o cache do motor de disponibilidade (availability.py) em dia
+@receiver([post_save, post_delete], sender=Agendamento)
+def invalidar_disponibilidade_agendamento(sender, instance, **kwargs):
+    from .availability import invalidar_profissional
+    from .cache_publico import agora_e_no_commit
+    for profissional_id in (instance.psiquiatra_id, instance.psicologo_id):
+        if profissional_id:
+            agora_e_no_commit(lambda pid=profissional_id: invalidar_profissional(pid))
+
+
+@receiver([post_save, post_delete], sender=HorarioTrabalho)
+def invalidar_disponibilidade_horario(sender, instance, **kwargs):
+    from .availability import invalidar_profissional
+    from .cache_publico import agora_e_no_commit, invalidar
+    agora_e_no_commit(lambda: invalidar_profissional(instance.profissional_id))
+    invalidar(f'horarios:{instance.profissional_id}')
+
+
 class Avaliacao(models.Model):
     TIPO_AVALIADOR_CHOICES = [
         ('paciente', 'Paciente'),
@@ -215,4 +422,166 @@ class Avaliacao(models.Model):
             raise ValidationError('Só é possível avaliar consultas concluídas.')
 
     def __str__(self):
-        return f"Avaliação {self.nota}★ - {self.tipo_avaliador} - {self.agendamento}"
\ No newline at end of file
+        return f"Avaliação {self.nota}★ - {self.tipo_avaliador} - {self.agendamento}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # O que está contado em AvaliacaoResumo, para o sinal aplicar só a diferença
+        instancia._contada = instancia.contagem()
+        return instancia
+
+    def contagem(self):
+        """(agendamento_id, nota) se a avaliação entra no resumo do profissional."""
+        if self.tipo_avaliador == 'paciente':
+            return (self.agendamento_id, self.nota)
+        return None
+
+
+class AvaliacaoResumo(models.Model):
+    """
+    Notas dos pacientes agregadas por profissional: total, soma e quantas de
+    cada nota. Mantido pelos sinais de Avaliacao; o comando recalcular_avaliacoes
+    refaz do zero (updates/deletes em lote não passam pelos sinais).
+    """
+    profissional = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name='avaliacao_resumo')
+    total = models.IntegerField(default=0)
+    soma = models.IntegerField(default=0)
+    notas_1 = models.IntegerField(default=0)
+    notas_2 = models.IntegerField(default=0)
+    notas_3 = models.IntegerField(default=0)
+    notas_4 = models.IntegerField(default=0)
+    notas_5 = models.IntegerField(default=0)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    @property
+    def media(self):
+        return self.soma / self.total if self.total else 0
+
+    def distribuicao(self):
+        return {nota: getattr(self, f'notas_{nota}') for nota in range(1, 6)}
+
+    @staticmethod
+    def expressao_media(prefixo=''):
+        """Média calculada no banco (NULL sem avaliações), para ordenar listagens."""
+        return Cast(models.F(f'{prefixo}soma'), models.FloatField()) / NullIf(models.F(f'{prefixo}total'), 0)
+
+    @classmethod
+    def aplicar(cls, profissional_id, nota, delta):
+        """Soma (delta=1) ou tira (delta=-1) uma nota do resumo, com UPDATE atômico."""
+        if not profissional_id:
+            return
+        # Só cria na soma: ao tirar, não existir já é o resultado certo (e não
+        # recria o resumo de um profissional sendo excluído em cascata)
+        if delta > 0:
+            cls.objects.get_or_create(profissional_id=profissional_id)
+        cls.objects.filter(profissional_id=profissional_id).update(
+            total=models.F('total') + delta,
+            soma=models.F('soma') + nota * delta,
+            data_atualizacao=timezone.now(),
+            **{f'notas_{nota}': models.F(f'notas_{nota}') + delta},
+        )
+
+
+def _profissional_da_avaliacao(avaliacao, agendamento_id):
+    if Avaliacao.agendamento.is_cached(avaliacao) and avaliacao.agendamento_id == agendamento_id:
+        return avaliacao.agendamento.profissional_id
+    return Agendamento.objects.filter(id=agendamento_id).values_list('profissional_id', flat=True).first()
+
+
+@receiver(post_save, sender=Avaliacao)
+def atualizar_resumo_avaliacao(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = None if created else getattr(instance, '_contada', None)
+    atual = instance.contagem()
+    if anterior != atual:
+        if anterior:
+            AvaliacaoResumo.aplicar(_profissional_da_avaliacao(instance, anterior[0]), anterior[1], -1)
+        if atual:
+            AvaliacaoResumo.aplicar(_profissional_da_avaliacao(instance, atual[0]), atual[1], 1)
+    instance._contada = atual
+
+
+@receiver(post_delete, sender=Avaliacao)
+def remover_do_resumo_avaliacao(sender, instance, **kwargs):
+    contada = getattr(instance, '_contada', instance.contagem())
+    if contada:
+        AvaliacaoResumo.aplicar(_profissional_da_avaliacao(instance, contada[0]), contada[1], -1)
+
+
+# Carrossel da página inicial (carrossel.py): descarta o payload em cache
+@receiver([post_save, post_delete], sender=Avaliacao)
+def invalidar_carrossel_avaliacao(sender, instance, **kwargs):
+    from .carrossel import avaliacao_mudou
+    avaliacao_mudou(instance)
+
+
+# Leituras públicas em cache (cache_publico.py): a média aparece nos cards
+@receiver([post_save, post_delete], sender=Avaliacao)
+def invalidar_cache_avaliacao(sender, instance, **kwargs):
+    from .cache_publico import invalidar
+    profissional_id = _profissional_da_avaliacao(instance, instance.agendamento_id)
+    invalidar('profissionais', f'avaliacoes:{profissional_id}')
+
+
+# Feed de sincronização incremental (sincronizacao.py): uma linha por gravação
+# ou remoção de Agendamento, Prontuario e Avaliacao.
+class Alteracao(models.Model):
+    MODELO_CHOICES = [
+        ('agendamento', 'Agendamento'),
+        ('prontuario', 'Prontuário'),
+        ('avaliacao', 'Avaliação'),
+    ]
+
+    # Numerada por SequenciaAlteracao na ordem em que as linhas ficam visíveis
+    sequencia = models.BigIntegerField(primary_key=True)
+    modelo = models.CharField(max_length=12, choices=MODELO_CHOICES)
+    objeto_id = models.BigIntegerField()
+    # Quem enxerga o registro. Não são FK para a remoção continuar no feed
+    # depois que o usuário é excluído.
+    paciente_id = models.BigIntegerField(blank=True, null=True)
+    profissional_id = models.BigIntegerField(blank=True, null=True)
+    removido = models.BooleanField(default=False)
+    data = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['paciente_id', 'sequencia'], name='alteracao_paciente_seq'),
+            models.Index(fields=['profissional_id', 'sequencia'], name='alteracao_profissional_seq'),
+            # Compactação: linhas antigas do mesmo objeto (compactar_alteracoes)
+            models.Index(fields=['modelo', 'objeto_id', 'sequencia'], name='alteracao_objeto_seq'),
+        ]
+
+    def __str__(self):
+        return f"#{self.sequencia} {self.modelo} {self.objeto_id}{' (removido)' if self.removido else ''}"
+
+
+class SequenciaAlteracao(models.Model):
+    """Último número usado em Alteracao.sequencia (linha única, id=1)."""
+    valor = models.BigIntegerField(default=0)
+
+
+def _donos_da_consulta(instancia):
+    """(paciente_id, profissional_id) da consulta de um Prontuario ou Avaliacao."""
+    if type(instancia).agendamento.is_cached(instancia):
+        return instancia.agendamento.usuario_id, instancia.agendamento.profissional_id
+    donos = Agendamento.objects.filter(id=instancia.agendamento_id).values_list('usuario_id', 'profissional_id').first()
+    return donos or (None, None)
+
+
+@receiver([post_save, post_delete], sender=Agendamento)
+def registrar_alteracao_agendamento(sender, instance, signal, raw=False, **kwargs):
+    from .sincronizacao import registrar
+    if not raw:
+        registrar('agendamento', instance.id, instance.usuario_id, instance.profissional_id,
+                  removido=signal is post_delete)
+
+
+@receiver([post_save, post_delete], sender=Prontuario)
+@receiver([post_save, post_delete], sender=Avaliacao)
+def registrar_alteracao_consulta(sender, instance, signal, raw=False, **kwargs):
+    from .sincronizacao import registrar
+    if not raw:
+        registrar(sender._meta.model_name, instance.id, *_donos_da_consulta(instance),
+                  removido=signal is post_delete)
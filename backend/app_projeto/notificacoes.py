@@ -0,0 +1,210 @@
+"""
+Mudanças de status de agendamento em tempo real, por Server-Sent Events
+(stream_notificacoes, GET /api/notificacoes/stream/, servido pelo ASGI).
+
+O hub é local ao processo: cada conexão SSE aberta assina uma fila do usuário
+e `publicar` entrega o evento nas filas dele. As views síncronas publicam de
+threads e as conexões vivem no event loop, então a entrega passa por
+call_soon_threadsafe. Os eventos saem de eventos.registrar no commit: checkout,
+webhook, estorno, lote, expiração e conclusão chegam sem cada view avisar.
+
+Com NOTIFICACOES_REDIS_URL definido (pacote redis instalado), `publicar` manda o
+evento para um canal pub/sub e cada processo com conexões abertas o entrega às
+suas: o webhook atendido por um worker, ou o comando de conclusão, alcança a aba
+conectada em outro. Sem ele, só as conexões do mesmo processo recebem.
+
+A conexão vale o que vale o token que a abriu: termina no `exp` dele e a
+revogação (logout, desativação, troca de papel) é conferida a cada heartbeat.
+O navegador reconecta com o cookie atual, ou recebe 401 e desiste.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Comentário enviado na conexão parada, para proxies não derrubarem por inatividade
+NOTIFICACOES_HEARTBEAT_SEGUNDOS = getattr(settings, 'NOTIFICACOES_HEARTBEAT_SEGUNDOS', 15)
+# Eventos pendentes por conexão; uma conexão que não consome é encerrada (o navegador reconecta)
+NOTIFICACOES_FILA_MAX = getattr(settings, 'NOTIFICACOES_FILA_MAX', 100)
+NOTIFICACOES_REDIS_URL = getattr(settings, 'NOTIFICACOES_REDIS_URL', None)
+NOTIFICACOES_CANAL = 'notificacoes_agendamento'
+# Espera do navegador antes de reconectar (campo retry do SSE), em ms
+NOTIFICACOES_RECONEXAO_MS = 5000
+
+_FIM = object()
+
+
+def tipo_evento(para, de, origem):
+    """Nome do evento SSE para a transição."""
+    if para == 'paga':
+        return 'pago'
+    if para == 'Concluida':
+        return 'concluido'
+    if para == 'cancelado':
+        return 'estornado' if origem == 'estorno' and de in ('paga', 'confirmado') else 'cancelado'
+    return 'status'
+
+
+class _Assinatura:
+    def __init__(self, loop):
+        self.loop = loop
+        self.fila = asyncio.Queue()
+        self.encerrada = False
+
+    def receber(self, evento):
+        # Roda no loop da conexão
+        if self.encerrada:
+            return
+        if self.fila.qsize() >= NOTIFICACOES_FILA_MAX:
+            self.encerrada = True
+            evento = _FIM
+        self.fila.put_nowait(evento)
+
+    def encerrar(self):
+        if not self.encerrada:
+            self.encerrada = True
+            self.fila.put_nowait(_FIM)
+
+
+class Hub:
+    """Conexões abertas no processo, por usuário."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinaturas = {}
+
+    def assinar(self, usuario_id):
+        assinatura = _Assinatura(asyncio.get_running_loop())
+        with self._lock:
+            self._assinaturas.setdefault(usuario_id, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, usuario_id, assinatura):
+        with self._lock:
+            assinaturas = self._assinaturas.get(usuario_id)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinaturas[usuario_id]
+
+    def conexoes(self, usuario_id):
+        with self._lock:
+            return len(self._assinaturas.get(usuario_id, ()))
+
+    def entregar(self, usuario_ids, evento):
+        with self._lock:
+            alvos = [a for uid in set(usuario_ids) for a in self._assinaturas.get(uid, ())]
+        for assinatura in alvos:
+            try:
+                assinatura.loop.call_soon_threadsafe(assinatura.receber, evento)
+            except RuntimeError:
+                pass  # Loop já fechado: a conexão está sendo desfeita
+
+
+hub = Hub()
+
+_redis = None
+_ponte = None
+
+
+def _cliente_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(NOTIFICACOES_REDIS_URL)
+    return _redis
+
+
+def publicar(usuario_ids, evento):
+    """Entrega `evento` às conexões dos usuários (neste processo ou, com Redis, em todos)."""
+    usuario_ids = [uid for uid in usuario_ids if uid]
+    if not usuario_ids:
+        return
+    if NOTIFICACOES_REDIS_URL:
+        try:
+            _cliente_redis().publish(NOTIFICACOES_CANAL, json.dumps({'usuarios': usuario_ids, 'evento': evento}))
+            return
+        except Exception:
+            # Redis fora do ar: ao menos as conexões deste processo recebem
+            logger.exception('Falha ao publicar notificação no Redis')
+    hub.entregar(usuario_ids, evento)
+
+
+def notificar_status(evento, destinatarios):
+    """Publica um AgendamentoHistorico recém-registrado (chamado no commit)."""
+    publicar(destinatarios, {
+        'tipo': tipo_evento(evento.status_novo, evento.status_anterior, evento.origem),
+        'agendamento_id': evento.agendamento_id,
+        'status': evento.status_novo,
+        'status_anterior': evento.status_anterior,
+        'origem': evento.origem,
+        'data': evento.data_status.isoformat(),
+    })
+
+
+async def _ouvir_redis():
+    import redis.asyncio as aioredis
+
+    while True:
+        try:
+            cliente = aioredis.from_url(NOTIFICACOES_REDIS_URL)
+            async with cliente.pubsub() as pubsub:
+                await pubsub.subscribe(NOTIFICACOES_CANAL)
+                async for mensagem in pubsub.listen():
+                    if mensagem['type'] == 'message':
+                        dados = json.loads(mensagem['data'])
+                        hub.entregar(dados['usuarios'], dados['evento'])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Ponte Redis de notificações caiu; reconectando')
+            await asyncio.sleep(1)
+
+
+def _iniciar_ponte():
+    # Uma tarefa por processo, criada no loop da primeira conexão
+    global _ponte
+    if NOTIFICACOES_REDIS_URL and (_ponte is None or _ponte.done()):
+        _ponte = asyncio.get_running_loop().create_task(_ouvir_redis())
+
+
+def _formatar(evento):
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+
+async def fluxo(usuario_id, expira_em=None, valido=None):
+    """
+    Corpo do stream SSE de um usuário: eventos e, parado, um comentário de
+    heartbeat. Termina em `expira_em` (timestamp do exp do token) ou no
+    heartbeat em que a corrotina `valido()` disser que o token não vale mais.
+    """
+    assinatura = hub.assinar(usuario_id)
+    _iniciar_ponte()
+    try:
+        yield f'retry: {NOTIFICACOES_RECONEXAO_MS}\n: conectado\n\n'
+        while True:
+            espera = NOTIFICACOES_HEARTBEAT_SEGUNDOS
+            if expira_em is not None:
+                restante = expira_em - time.time()
+                if restante <= 0:
+                    return
+                espera = min(espera, restante)
+            try:
+                evento = await asyncio.wait_for(assinatura.fila.get(), espera)
+            except asyncio.TimeoutError:
+                if valido is not None and not await valido():
+                    assinatura.encerrar()
+                    continue
+                if expira_em is None or time.time() < expira_em:
+                    yield ': ping\n\n'
+                continue
+            if evento is _FIM:
+                return
+            yield _formatar(evento)
+    finally:
+        hub.cancelar(usuario_id, assinatura)
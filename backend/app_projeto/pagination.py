@@ -0,0 +1,159 @@
+"""
+Paginação por cursor (keyset) para as listagens.
+
+A página seguinte é buscada com WHERE (campo, id) > (último campo, último id)
+em vez de OFFSET, então o custo não cresce com a página. O cursor é opaco
+(base64 de JSON). Parâmetros aceitos na query string:
+
+    paginado=true|false  liga/desliga a paginação (padrão: settings.PAGINACAO_PADRAO)
+    cursor=<opaco>       continua de onde a página anterior parou
+    limite=<n>           itens por página (padrão 50, máximo 200)
+    total=1              inclui uma contagem total estimada (opt-in)
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.response import Response
+
+PAGINACAO_PADRAO = getattr(settings, 'PAGINACAO_PADRAO', False)
+PAGINACAO_LIMITE_PADRAO = getattr(settings, 'PAGINACAO_LIMITE_PADRAO', 50)
+PAGINACAO_LIMITE_MAX = getattr(settings, 'PAGINACAO_LIMITE_MAX', 200)
+PAGINACAO_CONTAGEM_MAX = getattr(settings, 'PAGINACAO_CONTAGEM_MAX', 10000)
+
+VERDADEIRO = ('1', 'true', 'sim')
+FALSO = ('0', 'false', 'nao', 'não')
+
+
+def _codificar_cursor(valores):
+    dados = [v.isoformat() if isinstance(v, datetime) else v for v in valores]
+    return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    preenchimento = '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(cursor + preenchimento).decode())
+
+
+def _valor(linha, campo):
+    return linha[campo] if isinstance(linha, dict) else getattr(linha, campo)
+
+
+def contagem_estimada(queryset):
+    """
+    Total aproximado: no MySQL, para a tabela inteira, usa a estatística do
+    information_schema; nos demais casos conta até PAGINACAO_CONTAGEM_MAX linhas.
+    Retorna (total, exato).
+    """
+    if connection.vendor == 'mysql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [queryset.model._meta.db_table],
+            )
+            linha = cursor.fetchone()
+        if linha and linha[0] is not None:
+            return int(linha[0]), False
+    total = queryset.order_by()[:PAGINACAO_CONTAGEM_MAX + 1].count()
+    if total > PAGINACAO_CONTAGEM_MAX:
+        return PAGINACAO_CONTAGEM_MAX, False
+    return total, True
+
+
+class Pagina:
+    def __init__(self, itens, proximo_cursor, total=None):
+        self.itens = itens
+        self.proximo_cursor = proximo_cursor
+        self.total = total
+
+    def metadados(self):
+        dados = {'proximo_cursor': self.proximo_cursor}
+        if self.total is not None:
+            dados['total_estimado'], dados['total_exato'] = self.total
+        return dados
+
+    def resposta(self, resultados):
+        return Response({'resultados': resultados, **self.metadados()})
+
+
+class PaginacaoKeyset:
+    """
+    Pagina um queryset pela chave (campo, id). `campo=None` pagina só pelo id.
+    `paginar` devolve (None, None) quando a paginação está desligada na
+    requisição, para a view manter a resposta antiga (lista completa).
+    """
+
+    def __init__(self, campo='data_hora', decrescente=False):
+        self.campo = campo
+        self.decrescente = decrescente
+
+    @property
+    def campos(self):
+        return (self.campo, 'id') if self.campo else ('id',)
+
+    def ativa(self, request):
+        valor = request.GET.get('paginado', '').lower()
+        if valor in FALSO:
+            return False
+        if valor in VERDADEIRO or 'cursor' in request.GET or 'limite' in request.GET:
+            return True
+        return PAGINACAO_PADRAO
+
+    def ordenar(self, queryset):
+        prefixo = '-' if self.decrescente else ''
+        return queryset.order_by(*[prefixo + c for c in self.campos])
+
+    def _valores_cursor(self, dados):
+        """Valores (campo, id) do cursor decodificado; ValueError/TypeError se não servirem."""
+        if not isinstance(dados, list) or len(dados) != len(self.campos):
+            raise ValueError('cursor inválido')
+        ultimo_id = int(dados[-1])
+        if not self.campo:
+            return [ultimo_id]
+        valor_campo = parse_datetime(dados[0])
+        if valor_campo is None:
+            raise ValueError('cursor inválido')
+        if timezone.is_naive(valor_campo):
+            valor_campo = timezone.make_aware(valor_campo)
+        return [valor_campo, ultimo_id]
+
+    def _filtro_cursor(self, valores):
+        op = 'lt' if self.decrescente else 'gt'
+        if not self.campo:
+            return Q(**{f'id__{op}': valores[0]})
+        valor_campo, ultimo_id = valores
+        return Q(**{f'{self.campo}__{op}': valor_campo}) | Q(**{self.campo: valor_campo, f'id__{op}': ultimo_id})
+
+    def paginar(self, request, queryset):
+        if not self.ativa(request):
+            return None, None
+        try:
+            limite = int(request.GET.get('limite', PAGINACAO_LIMITE_PADRAO))
+        except ValueError:
+            return None, Response({'error': 'limite deve ser um número inteiro.'}, status=400)
+        limite = max(1, min(limite, PAGINACAO_LIMITE_MAX))
+
+        total = None
+        if request.GET.get('total', '').lower() in VERDADEIRO:
+            total = contagem_estimada(queryset)
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            try:
+                valores = self._valores_cursor(_decodificar_cursor(cursor))
+            except (ValueError, TypeError):
+                return None, Response({'error': 'cursor inválido.'}, status=400)
+            queryset = queryset.filter(self._filtro_cursor(valores))
+
+        # Busca um item a mais só para saber se existe próxima página
+        itens = list(self.ordenar(queryset)[:limite + 1])
+        proximo_cursor = None
+        if len(itens) > limite:
+            itens = itens[:limite]
+            proximo_cursor = _codificar_cursor([_valor(itens[-1], c) for c in self.campos])
+        return Pagina(itens, proximo_cursor, total), None
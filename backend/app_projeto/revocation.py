@@ -0,0 +1,209 @@
+"""
+Revogação de tokens JWT.
+
+A fonte da verdade fica no banco (TokenRevogado por jti e RevogacaoUsuario com a
+marca "tokens emitidos antes de"). Cada processo mantém uma cópia compacta:
+um filtro de Bloom com os jti revogados, um conjunto pequeno com os jti já
+confirmados e um dict usuario_id -> marca. A cópia é atualizada de forma
+incremental a cada REVOGACAO_REFRESH_SEGUNDOS, então a checagem por requisição
+não consulta o banco (só um positivo do Bloom ainda não confirmado consulta).
+
+A atualização incremental lê por data_criacao / data_atualizacao a partir da
+maior data já vista menos REVOGACAO_JANELA_SEGUNDOS: uma linha gravada antes de
+outra mas com commit depois ainda é lida. Linhas que demoram mais que a janela
+para ficar visíveis entram na recarga completa, a cada REVOGACAO_RECARGA_SEGUNDOS.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+REVOGACAO_REFRESH_SEGUNDOS = getattr(settings, 'REVOGACAO_REFRESH_SEGUNDOS', 5)
+REVOGACAO_BLOOM_CAPACIDADE = getattr(settings, 'REVOGACAO_BLOOM_CAPACIDADE', 100000)
+REVOGACAO_BLOOM_ERRO = getattr(settings, 'REVOGACAO_BLOOM_ERRO', 0.001)
+REVOGACAO_JANELA_SEGUNDOS = getattr(settings, 'REVOGACAO_JANELA_SEGUNDOS', 60)
+REVOGACAO_RECARGA_SEGUNDOS = getattr(settings, 'REVOGACAO_RECARGA_SEGUNDOS', 600)
+REVOGACAO_CONFIRMADOS_MAX = 4096
+
+
+def _segundos(data):
+    """
+    Marca em segundos inteiros, a precisão do `iat`: um token emitido no mesmo
+    segundo da revogação (ex.: novo login logo depois de reativar a conta) vale.
+    """
+    return math.floor(data.timestamp())
+
+
+class BloomFilter:
+    """Filtro de Bloom simples sobre um bytearray (sem falsos negativos)."""
+
+    def __init__(self, capacidade, taxa_erro):
+        self.num_bits = max(8, int(-capacidade * math.log(taxa_erro) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacidade * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.total = 0
+
+    def _posicoes(self, chave):
+        digest = hashlib.blake2b(chave.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, chave):
+        for pos in self._posicoes(chave):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.total += 1
+
+    def __contains__(self, chave):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._posicoes(chave))
+
+
+class RevogacaoLocal:
+    """Espelho, no processo, das tabelas de revogação."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.bloom = BloomFilter(REVOGACAO_BLOOM_CAPACIDADE, REVOGACAO_BLOOM_ERRO)
+        self.confirmados = set()      # jti revogados (confirmados no banco)
+        self.falsos_positivos = set()  # jti que o Bloom acusou mas não estão revogados
+        self.marcas = {}              # usuario_id -> marca, em segundos inteiros (ver _segundos)
+        self.ultima_criacao = None
+        self.ultima_marca = None
+        self.proximo_refresh = 0.0
+        self.proxima_recarga = 0.0
+
+    def _atualizar(self, forcar=False):
+        agora = time.monotonic()
+        if not forcar and agora < self.proximo_refresh:
+            return
+        with self._lock:
+            if not forcar and agora < self.proximo_refresh:
+                return
+            from .models import TokenRevogado, RevogacaoUsuario
+
+            janela = timedelta(seconds=REVOGACAO_JANELA_SEGUNDOS)
+            if self.bloom.total >= REVOGACAO_BLOOM_CAPACIDADE or agora >= self.proxima_recarga:
+                # Recarga completa (Bloom cheio ou periódica): só os tokens ainda não expirados
+                self._reset()
+                self.proxima_recarga = agora + REVOGACAO_RECARGA_SEGUNDOS
+                novos = TokenRevogado.objects.filter(expira_em__gt=django_timezone.now())
+            elif self.ultima_criacao is not None:
+                novos = TokenRevogado.objects.filter(data_criacao__gte=self.ultima_criacao - janela)
+            else:
+                novos = TokenRevogado.objects.all()
+            for jti, data_criacao in novos.values_list('jti', 'data_criacao'):
+                # Linhas relidas na janela já estão no filtro: não contam de novo
+                if jti not in self.bloom:
+                    self.bloom.add(jti)
+                self.falsos_positivos.discard(jti)
+                if self.ultima_criacao is None or data_criacao > self.ultima_criacao:
+                    self.ultima_criacao = data_criacao
+
+            marcas = RevogacaoUsuario.objects.all()
+            if self.ultima_marca is not None:
+                marcas = marcas.filter(data_atualizacao__gte=self.ultima_marca - janela)
+            for usuario_id, revogar_antes_de, data_atualizacao in marcas.values_list(
+                'usuario_id', 'revogar_antes_de', 'data_atualizacao'
+            ):
+                self.marcas[usuario_id] = _segundos(revogar_antes_de)
+                if self.ultima_marca is None or data_atualizacao > self.ultima_marca:
+                    self.ultima_marca = data_atualizacao
+
+            self.proximo_refresh = time.monotonic() + REVOGACAO_REFRESH_SEGUNDOS
+
+    def token_revogado(self, payload):
+        self._atualizar()
+
+        marca = self.marcas.get(payload.get('user_id'))
+        if marca is not None and payload.get('iat', 0) < marca:
+            return True
+
+        jti = payload.get('jti')
+        if not jti or jti not in self.bloom:
+            return False
+        if jti in self.confirmados:
+            return True
+        if jti in self.falsos_positivos:
+            return False
+
+        # Positivo do Bloom ainda não confirmado: uma consulta pontual
+        from .models import TokenRevogado
+        revogado = TokenRevogado.objects.filter(jti=jti).exists()
+        with self._lock:
+            destino = self.confirmados if revogado else self.falsos_positivos
+            if len(destino) >= REVOGACAO_CONFIRMADOS_MAX:
+                destino.clear()
+            destino.add(jti)
+        return revogado
+
+    def registrar_jti(self, jti):
+        with self._lock:
+            self.bloom.add(jti)
+            self.falsos_positivos.discard(jti)
+            if len(self.confirmados) >= REVOGACAO_CONFIRMADOS_MAX:
+                self.confirmados.clear()
+            self.confirmados.add(jti)
+
+    def registrar_marca(self, usuario_id, revogar_antes_de):
+        with self._lock:
+            self.marcas[usuario_id] = _segundos(revogar_antes_de)
+
+    def limpar(self):
+        with self._lock:
+            self._reset()
+
+
+revogacao_local = RevogacaoLocal()
+
+
+def token_revogado(payload):
+    return revogacao_local.token_revogado(payload)
+
+
+def revogar_token(payload):
+    """Revoga um token específico (ex.: logout) pelo jti."""
+    from .models import TokenRevogado
+
+    jti = payload.get('jti')
+    if not jti:
+        return
+    exp = payload.get('exp')
+    expira_em = datetime.fromtimestamp(exp, tz=timezone.utc) if exp else django_timezone.now()
+    TokenRevogado.objects.get_or_create(
+        jti=jti,
+        defaults={'usuario_id': payload.get('user_id'), 'expira_em': expira_em},
+    )
+    revogacao_local.registrar_jti(jti)
+
+
+def revogar_tokens_do_usuario(usuario_id):
+    """Invalida todos os tokens já emitidos para o usuário (desativação, exclusão)."""
+    from .models import RevogacaoUsuario
+
+    agora = django_timezone.now()
+    RevogacaoUsuario.objects.update_or_create(
+        usuario_id=usuario_id,
+        defaults={'revogar_antes_de': agora},
+    )
+    revogacao_local.registrar_marca(usuario_id, agora)
+
+
+def limpar_tokens_expirados(lote=1000):
+    """Apaga, em lotes, os TokenRevogado já expirados (o token seria recusado de qualquer forma)."""
+    from .models import TokenRevogado
+
+    agora = django_timezone.now()
+    total = 0
+    while True:
+        ids = list(TokenRevogado.objects.filter(expira_em__lte=agora).values_list('id', flat=True)[:lote])
+        if not ids:
+            return total
+        total += TokenRevogado.objects.filter(id__in=ids).delete()[0]
@@ -1,7 +1,8 @@
 # serializers.py
+from django.utils.timezone import localtime
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Usuario, Agendamento, AgendamentoHistorico, Endereco, Prontuario, HorarioTrabalho, Avaliacao
+from .models import Usuario, Agendamento, AgendamentoHistorico, Endereco, Prontuario, HorarioTrabalho, Avaliacao, AvaliacaoResumo
 
 class UsuarioSerializer(serializers.ModelSerializer):
     foto = serializers.SerializerMethodField()
@@ -24,6 +25,30 @@ class UsuarioSerializer(serializers.ModelSerializer):
             'stripe_account_id', 'stripe_email',
         ]
 
+def estatisticas_avaliacoes(profissional):
+    """Resumo das notas recebidas, lido de AvaliacaoResumo (select_related('avaliacao_resumo'))."""
+    try:
+        resumo = profissional.avaliacao_resumo
+    except AvaliacaoResumo.DoesNotExist:
+        resumo = AvaliacaoResumo()
+    return {
+        'media_avaliacoes': round(resumo.media, 1),
+        'total_avaliacoes': resumo.total,
+        'distribuicao': resumo.distribuicao(),
+    }
+
+
+# Cards da listagem de profissionais: UsuarioSerializer + resumo das avaliações
+# (um JOIN a mais na mesma query, ver _listar_profissionais)
+class ProfissionalSerializer(UsuarioSerializer):
+    avaliacoes = serializers.SerializerMethodField()
+
+    class Meta(UsuarioSerializer.Meta):
+        fields = UsuarioSerializer.Meta.fields + ['avaliacoes']
+
+    def get_avaliacoes(self, obj):
+        return estatisticas_avaliacoes(obj)
+
 class UsuarioDetailSerializer(UsuarioSerializer):
     # Caso queira retornar dados mais detalhados do usuário (ex. senha ou informações sensíveis)
     class Meta:
@@ -56,8 +81,10 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'data_hora', 'data_hora_local', 'status', 'link_consulta', 'observacoes', 'data_criacao',
             'usuario', 'usuario_nome', 'psiquiatra', 'psiquiatra_nome', 'psicologo', 'psicologo_nome',
-            'valor_recebido_profissional', 'valor_plataforma'
+            'profissional', 'valor_recebido_profissional', 'valor_plataforma'
         ]
+        # Preenchido a partir de psiquiatra/psicologo (Agendamento.sincronizar_profissional)
+        read_only_fields = ['profissional']
 
 class AgendamentoHistoricoSerializer(serializers.ModelSerializer):
     class Meta:
@@ -141,6 +168,69 @@ class ProntuarioSerializer(serializers.ModelSerializer):
         return None
 
 
+# Representação enxuta para listar prontuários: tudo vem de uma query com JOIN
+# (ver ProntuarioListSerializer.otimizar_queryset) e o texto privado não é carregado.
+# A query parte das consultas, porque o prontuário só existe depois da primeira
+# escrita (ver Prontuario.do_agendamento); os virtuais saem com id nulo.
+class ProntuarioListSerializer(serializers.ModelSerializer):
+    agendamento = serializers.SerializerMethodField()
+    paciente = serializers.SerializerMethodField()
+    atestado_pdf = serializers.SerializerMethodField()
+    receita_pdf = serializers.SerializerMethodField()
+
+    CAMPOS_QUERY = [
+        'id', 'data_hora', 'status', 'observacoes', 'link_consulta', 'psiquiatra', 'psicologo', 'data_criacao',
+        'profissional__nome',
+        'usuario__nome', 'usuario__email', 'usuario__telefone', 'usuario__cpf',
+        'prontuario__id', 'prontuario__mensagem_paciente', 'prontuario__atestado_pdf',
+        'prontuario__receita_pdf', 'prontuario__data_criacao', 'prontuario__data_atualizacao',
+    ]
+
+    class Meta:
+        model = Prontuario
+        fields = ['id', 'agendamento', 'paciente', 'mensagem_paciente', 'atestado_pdf', 'receita_pdf', 'data_criacao', 'data_atualizacao']
+
+    @classmethod
+    def otimizar_queryset(cls, agendamentos):
+        return agendamentos.select_related(
+            'usuario', 'profissional', 'prontuario'
+        ).only(*cls.CAMPOS_QUERY)
+
+    def get_agendamento(self, obj):
+        ag = obj.agendamento
+        # Um JOIN só (profissional); psiquiatra/psicologo continuam no payload
+        nome_profissional = ag.profissional.nome if ag.profissional_id else None
+        return {
+            'id': ag.id,
+            'data_hora': serializers.DateTimeField().to_representation(ag.data_hora),
+            'data_hora_local': localtime(ag.data_hora).isoformat() if ag.data_hora else None,
+            'status': ag.status,
+            'observacoes': ag.observacoes,
+            'link_consulta': ag.link_consulta,
+            'psiquiatra': ag.psiquiatra_id,
+            'psiquiatra_nome': nome_profissional if ag.psiquiatra_id == ag.profissional_id else None,
+            'psicologo': ag.psicologo_id,
+            'psicologo_nome': nome_profissional if ag.psicologo_id == ag.profissional_id else None,
+        }
+
+    def get_paciente(self, obj):
+        paciente = obj.agendamento.usuario
+        return {
+            'id': paciente.id,
+            'nome': paciente.nome,
+            'email': paciente.email,
+            'telefone': paciente.telefone,
+            'cpf': paciente.cpf,
+        }
+
+    # URL relativa do arquivo (sem build_absolute_uri por item)
+    def get_atestado_pdf(self, obj):
+        return obj.atestado_pdf.url if obj.atestado_pdf else None
+
+    def get_receita_pdf(self, obj):
+        return obj.receita_pdf.url if obj.receita_pdf else None
+
+
 class HorarioTrabalhoSerializer(serializers.ModelSerializer):
     dia_semana_nome = serializers.SerializerMethodField()
     profissional_nome = serializers.CharField(source='profissional.nome', read_only=True)
@@ -176,6 +266,19 @@ class HorarioTrabalhoSerializer(serializers.ModelSerializer):
         return data
 
 
+class HorarioTrabalhoLoteSerializer(serializers.Serializer):
+    """Um item do PUT em lote de horários: validação sem consultar o banco."""
+    dia_semana = serializers.ChoiceField(choices=HorarioTrabalho.DIAS_SEMANA)
+    horario_inicio = serializers.TimeField()
+    horario_fim = serializers.TimeField()
+    ativo = serializers.BooleanField(default=True)
+
+    def validate(self, data):
+        if data['horario_inicio'] >= data['horario_fim']:
+            raise serializers.ValidationError("Horário de início deve ser anterior ao horário de fim.")
+        return data
+
+
 class AvaliacaoSerializer(serializers.ModelSerializer):
     avaliador_nome = serializers.CharField(source='avaliador.nome', read_only=True)
     paciente_nome = serializers.CharField(source='agendamento.usuario.nome', read_only=True)
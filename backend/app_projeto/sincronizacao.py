@@ -0,0 +1,130 @@
+"""
+Feed de sincronização incremental de Agendamento, Prontuario e Avaliacao
+(listar_alteracoes, GET /api/alteracoes/?cursor=...).
+
+Cada gravação ou remoção vira uma linha de Alteracao (remoção = marca com
+removido=True) com um número de sequência crescente. O cliente guarda o cursor
+da última resposta e recebe só o que mudou depois dele: o custo é proporcional
+às mudanças, não ao histórico.
+
+As linhas entram no commit da transação que mudou o registro, no mesmo lote dos
+eventos de eventos.py, e são numeradas com a linha de SequenciaAlteracao travada
+até o fim da transação curta que as grava. A ordem da sequência é então a ordem
+em que as linhas ficam visíveis: quem já leu até N nunca vê surgir depois uma
+linha com número menor que N.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .pagination import _codificar_cursor, _decodificar_cursor
+
+# Linhas de Alteracao lidas por chamada do feed (o resto vem com mais=true)
+SINCRONIZACAO_LIMITE = getattr(settings, 'SINCRONIZACAO_LIMITE', 500)
+
+MODELOS = ('agendamento', 'prontuario', 'avaliacao')
+
+
+def registrar(modelo, objeto_id, paciente_id, profissional_id, removido=False):
+    """Registra que o objeto mudou (ou foi removido); entra no feed no commit."""
+    from .eventos import agendar_gravacao, enfileirar_alteracao
+
+    alteracao = (modelo, objeto_id, paciente_id, profissional_id, removido)
+    agendar_gravacao(lambda: enfileirar_alteracao(alteracao))
+
+
+def gravar(alteracoes):
+    """Numera e grava as alterações numa transação (chamado pelo lote de eventos.py)."""
+    from .models import Alteracao, SequenciaAlteracao
+
+    # Só a última alteração de cada objeto no lote interessa ao cliente
+    ultimas = {}
+    for alteracao in alteracoes:
+        chave = alteracao[:2]
+        ultimas.pop(chave, None)
+        ultimas[chave] = alteracao
+    with transaction.atomic():
+        # A trava fica até o commit: dois lotes nunca se intercalam na numeração
+        contador, _ = SequenciaAlteracao.objects.select_for_update().get_or_create(id=1)
+        inicio = contador.valor
+        Alteracao.objects.bulk_create([
+            Alteracao(
+                sequencia=inicio + i, modelo=modelo, objeto_id=objeto_id,
+                paciente_id=paciente_id, profissional_id=profissional_id, removido=removido,
+            )
+            for i, (modelo, objeto_id, paciente_id, profissional_id, removido) in enumerate(ultimas.values(), 1)
+        ])
+        contador.valor = inicio + len(ultimas)
+        contador.save(update_fields=['valor'])
+
+
+def cursor_atual():
+    from .models import SequenciaAlteracao
+
+    valor = SequenciaAlteracao.objects.filter(id=1).values_list('valor', flat=True).first()
+    return codificar_cursor(valor or 0)
+
+
+def codificar_cursor(sequencia):
+    return _codificar_cursor([sequencia])
+
+
+def decodificar_cursor(cursor):
+    """Sequência do cursor; ValueError se for inválido."""
+    try:
+        sequencia, = _decodificar_cursor(cursor)
+    except Exception:
+        raise ValueError('cursor inválido')
+    if not isinstance(sequencia, int) or sequencia < 0:
+        raise ValueError('cursor inválido')
+    return sequencia
+
+
+def ler(usuario, sequencia, limite=SINCRONIZACAO_LIMITE):
+    """
+    Alterações visíveis ao usuário depois de `sequencia`. Devolve
+    (última sequência lida, mais, {modelo: ids alterados}, {modelo: ids removidos}),
+    com cada objeto só no estado da última alteração lida.
+    """
+    from .models import Alteracao
+
+    linhas = Alteracao.objects.filter(sequencia__gt=sequencia)
+    if usuario.role != 'Admin':
+        linhas = linhas.filter(Q(paciente_id=usuario.id) | Q(profissional_id=usuario.id))
+    linhas = list(linhas.order_by('sequencia').values_list('sequencia', 'modelo', 'objeto_id', 'removido')[:limite])
+
+    estado = {}
+    for _, modelo, objeto_id, removido in linhas:
+        estado[modelo, objeto_id] = removido
+    alterados = {modelo: [] for modelo in MODELOS}
+    removidos = {modelo: [] for modelo in MODELOS}
+    for (modelo, objeto_id), removido in estado.items():
+        (removidos if removido else alterados)[modelo].append(objeto_id)
+    ultima = linhas[-1][0] if linhas else sequencia
+    return ultima, len(linhas) == limite, alterados, removidos
+
+
+def compactar_lote(depois_de, tamanho):
+    """
+    Apaga, entre as `tamanho` linhas seguintes a `depois_de`, as que já têm uma
+    alteração mais nova do mesmo objeto (quem lê a partir de qualquer cursor
+    ainda encontra a mais nova). Devolve (última sequência vista, quantas apagou).
+    """
+    from .models import Alteracao
+
+    sequencias = list(
+        Alteracao.objects.filter(sequencia__gt=depois_de)
+        .order_by('sequencia').values_list('sequencia', flat=True)[:tamanho]
+    )
+    if not sequencias:
+        return None, 0
+    mais_novas = Alteracao.objects.filter(
+        modelo=OuterRef('modelo'), objeto_id=OuterRef('objeto_id'), sequencia__gt=OuterRef('sequencia'),
+    )
+    superadas = list(
+        Alteracao.objects.filter(sequencia__in=sequencias)
+        .filter(Exists(mais_novas)).values_list('sequencia', flat=True)
+    )
+    if superadas:
+        Alteracao.objects.filter(sequencia__in=superadas).delete()
+    return sequencias[-1], len(superadas)
@@ -1,3 +1,1378 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import json
+import os
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .authentication import usuario_cache
+from .availability import DISPONIBILIDADE_MAX_DIAS, IndiceProximoLivre, MotorDisponibilidade, disponibilidade
+from .cache_publico import agora_e_no_commit, lembrar
+from .eventos import arquivar_lote, em_lote, registrar
+from .google_auth import jwks_google
+from .models import (
+    Usuario, Agendamento, AgendamentoHistorico, AgendamentoHistoricoArquivo, Alteracao, Avaliacao, AvaliacaoResumo,
+    HorarioTrabalho, Prontuario, RevogacaoUsuario, TokenRevogado,
+)
+from .pagination import _codificar_cursor
+from . import google_auth, hashers, notificacoes, sincronizacao, views
+from .revocation import revogacao_local
+from .serializers import MyTokenObtainPairSerializer
+
+
+def token_para(usuario):
+    return str(MyTokenObtainPairSerializer.get_token(usuario).access_token)
+
+
+class BaseAPITestCase(TestCase):
+    def setUp(self):
+        usuario_cache.clear()
+        disponibilidade.limpar()
+        cache.clear()
+        # Sincroniza o espelho de revogação agora, para não contar essas queries nos testes
+        revogacao_local.limpar()
+        revogacao_local.token_revogado({})
+        self.paciente = Usuario.objects.create(
+            nome='Paciente', email='paciente@teste.com', cpf='111.111.111-11',
+            senha=make_password('senha'), role='Paciente',
+        )
+        self.psicologo = Usuario.objects.create(
+            nome='Psicólogo', email='psicologo@teste.com', cpf='222.222.222-22',
+            senha=make_password('senha'), role='Psicologo', crp='06/1234', valor_consulta=150,
+        )
+
+    def get(self, url, usuario, **params):
+        return self.client.get(url, params, HTTP_AUTHORIZATION=f'Bearer {token_para(usuario)}')
+
+    def criar_agendamentos(self, quantidade, **kwargs):
+        base = timezone.now() + timedelta(days=1)
+        for i in range(quantidade):
+            Agendamento.objects.create(
+                usuario=self.paciente, psicologo=self.psicologo,
+                data_hora=base + timedelta(hours=i), **kwargs,
+            )
+
+    def avaliar(self, profissional, nota, tipo='paciente'):
+        ag = Agendamento.objects.create(
+            usuario=self.paciente, psicologo=profissional, status='Concluida',
+            data_hora=timezone.now() - timedelta(days=1, hours=Agendamento.objects.count()),
+        )
+        avaliador = self.paciente if tipo == 'paciente' else profissional
+        return Avaliacao.objects.create(agendamento=ag, avaliador=avaliador, tipo_avaliador=tipo, nota=nota)
+
+
+class AutenticacaoJWTTests(BaseAPITestCase):
+    def test_leitura_sem_consulta_de_usuario(self):
+        self.criar_agendamentos(3)
+        token = token_para(self.psicologo)
+        # Só a listagem: o usuário vem das claims do token
+        with self.assertNumQueries(1):
+            resposta = self.client.get('/api/agendamentos_profissional/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_edicao_e_exclusao_invalidam_cache(self):
+        self.assertEqual(usuario_cache.get(self.paciente.id).nome, 'Paciente')
+        with self.assertNumQueries(0):
+            usuario_cache.get(self.paciente.id)
+        resposta = self.client.put(
+            f'/api/users/{self.paciente.id}/', json.dumps({'nome': 'Paciente Novo'}), content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(usuario_cache.get(self.paciente.id).nome, 'Paciente Novo')
+
+        self.client.delete(f'/api/users/{self.paciente.id}/delete/')
+        self.assertIsNone(usuario_cache.get(self.paciente.id))
+
+    def test_troca_de_papel_revoga_tokens(self):
+        # Emitido num segundo anterior: a marca tem precisão de segundo, como o iat
+        token = MyTokenObtainPairSerializer.get_token(self.psicologo).access_token
+        token['iat'] = int(timezone.now().timestamp()) - 5
+        token = str(token)
+        url = '/api/agendamentos_profissional/'
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 200)
+        self.client.put(f'/api/users/{self.psicologo.id}/', json.dumps({'nome': 'Psicólogo'}), content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 200)
+        self.client.put(f'/api/users/{self.psicologo.id}/', json.dumps({'role': 'Paciente'}), content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 401)
+
+
+class RevogacaoTokensTests(BaseAPITestCase):
+    url = '/api/agendamentos_profissional/'
+
+    def acessar(self, token):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code
+
+    def token_emitido_ha(self, usuario, segundos):
+        token = MyTokenObtainPairSerializer.get_token(usuario).access_token
+        token['iat'] = int(timezone.now().timestamp()) - segundos
+        return str(token)
+
+    def test_logout_revoga_o_token(self):
+        token = token_para(self.psicologo)
+        self.assertEqual(self.acessar(token), 200)
+        self.client.post('/logout/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertTrue(TokenRevogado.objects.exists())
+        self.assertEqual(self.acessar(token), 401)
+        self.assertEqual(self.acessar(token_para(self.psicologo)), 200)
+
+    def test_marca_do_usuario_recusa_so_tokens_anteriores(self):
+        antigo = self.token_emitido_ha(self.psicologo, 60)
+        RevogacaoUsuario.objects.create(
+            usuario_id=self.psicologo.id, revogar_antes_de=timezone.now() - timedelta(seconds=30),
+        )
+        revogacao_local._atualizar(forcar=True)
+        self.assertEqual(self.acessar(antigo), 401)
+        self.assertEqual(self.acessar(token_para(self.psicologo)), 200)
+        # A marca é só do psicólogo
+        self.assertFalse(revogacao_local.token_revogado(
+            {'user_id': self.paciente.id, 'iat': int(timezone.now().timestamp()) - 60}
+        ))
+
+    def test_token_do_mesmo_segundo_da_marca_vale(self):
+        from .revocation import revogar_tokens_do_usuario
+        revogar_tokens_do_usuario(self.psicologo.id)
+        marca = RevogacaoUsuario.objects.get(usuario_id=self.psicologo.id).revogar_antes_de
+        segundo = int(marca.timestamp())
+        self.assertFalse(revogacao_local.token_revogado({'user_id': self.psicologo.id, 'iat': segundo}))
+        self.assertTrue(revogacao_local.token_revogado({'user_id': self.psicologo.id, 'iat': segundo - 1}))
+        # O mesmo vale para a marca lida do banco por outro processo
+        revogacao_local.limpar()
+        self.assertFalse(revogacao_local.token_revogado({'user_id': self.psicologo.id, 'iat': segundo}))
+        self.assertTrue(revogacao_local.token_revogado({'user_id': self.psicologo.id, 'iat': segundo - 1}))
+
+    def test_desativacao_revoga_tokens(self):
+        token = self.token_emitido_ha(self.psicologo, 5)
+        self.assertEqual(self.acessar(token), 200)
+        resposta = self.client.put(
+            f'/api/users/{self.psicologo.id}/', json.dumps({'status': 'inativo'}), content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(RevogacaoUsuario.objects.filter(usuario_id=self.psicologo.id).exists())
+        self.assertEqual(self.acessar(token), 401)
+
+    def test_falso_positivo_do_bloom_consulta_uma_vez(self):
+        revogacao_local.bloom.add('jti-fantasma')
+        payload = {'jti': 'jti-fantasma', 'user_id': self.paciente.id, 'iat': int(timezone.now().timestamp())}
+        with self.assertNumQueries(1):
+            self.assertFalse(revogacao_local.token_revogado(payload))
+        self.assertIn('jti-fantasma', revogacao_local.falsos_positivos)
+        with self.assertNumQueries(0):
+            self.assertFalse(revogacao_local.token_revogado(payload))
+
+    def revogado_em(self, jti, data_criacao):
+        TokenRevogado.objects.create(jti=jti, expira_em=timezone.now() + timedelta(hours=1))
+        TokenRevogado.objects.filter(jti=jti).update(data_criacao=data_criacao)
+
+    def test_commit_fora_de_ordem_entra_na_janela(self):
+        agora = timezone.now()
+        self.revogado_em('jti-novo', agora)
+        revogacao_local._atualizar(forcar=True)
+        # Gravado antes (data menor), visível só agora
+        self.revogado_em('jti-atrasado', agora - timedelta(seconds=30))
+        self.revogado_em('jti-muito-atrasado', agora - timedelta(hours=1))
+        revogacao_local._atualizar(forcar=True)
+        self.assertTrue(revogacao_local.token_revogado({'jti': 'jti-atrasado'}))
+        self.assertFalse(revogacao_local.token_revogado({'jti': 'jti-muito-atrasado'}))
+        # Fora da janela: entra na recarga completa
+        revogacao_local.proxima_recarga = 0.0
+        revogacao_local._atualizar(forcar=True)
+        self.assertTrue(revogacao_local.token_revogado({'jti': 'jti-muito-atrasado'}))
+        self.assertTrue(revogacao_local.token_revogado({'jti': 'jti-novo'}))
+
+    def test_limpeza_apaga_tokens_expirados(self):
+        from django.core.management import call_command
+
+        TokenRevogado.objects.create(jti='expirado', expira_em=timezone.now() - timedelta(minutes=1))
+        TokenRevogado.objects.create(jti='valido', expira_em=timezone.now() + timedelta(hours=1))
+        call_command('limpar_tokens_revogados', lote=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(TokenRevogado.objects.values_list('jti', flat=True)), ['valido'])
+
+
+class LoginGoogleTests(BaseAPITestCase):
+    """ID tokens assinados aqui, com as chaves servidas por um JWKS local."""
+
+    @classmethod
+    def setUpClass(cls):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        super().setUpClass()
+        cls.chaves = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048) for kid in ('k1', 'k2')}
+        cls.publicadas = ['k1']
+        cls.buscas = []
+        teste = cls
+
+        class JWKS(BaseHTTPRequestHandler):
+            def do_GET(self):
+                teste.buscas.append(self.path)
+                chaves = []
+                for kid in teste.publicadas:
+                    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(teste.chaves[kid].public_key()))
+                    chaves.append({**jwk, 'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+                corpo = json.dumps({'keys': chaves}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', 'public, max-age=3600')
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), JWKS)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.ajustes = override_settings(
+            GOOGLE_JWKS_URL=f'http://127.0.0.1:{cls.servidor.server_port}/certs',
+            GOOGLE_CLIENT_ID='cliente-teste.apps.googleusercontent.com',
+        )
+        cls.ajustes.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ajustes.disable()
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        jwks_google.limpar()
+        self.publicadas[:] = ['k1']
+        self.buscas.clear()
+
+    def id_token(self, kid='k1', **claims):
+        agora = int(timezone.now().timestamp())
+        dados = {
+            'iss': 'https://accounts.google.com', 'aud': 'cliente-teste.apps.googleusercontent.com',
+            'sub': '123', 'email': 'google@teste.com', 'email_verified': True, 'name': 'Google',
+            'iat': agora, 'exp': agora + 3600,
+        }
+        dados.update(claims)
+        return jwt.encode(dados, self.chaves[kid], algorithm='RS256', headers={'kid': kid})
+
+    def login(self, token):
+        return self.client.post('/api/auth/google/', json.dumps({'token': token}), content_type='application/json')
+
+    def test_assinatura_valida(self):
+        resposta = self.login(self.id_token())
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('token', resposta.json())
+        # Chaves ficam em cache: o segundo login não busca o JWKS
+        self.assertEqual(self.login(self.id_token()).status_code, 200)
+        self.assertEqual(len(self.buscas), 1)
+
+    def test_kid_desconhecido_atualiza_as_chaves(self):
+        self.assertEqual(self.login(self.id_token()).status_code, 200)
+        self.publicadas.append('k2')  # rotação de chaves no Google
+        with mock.patch.object(google_auth, 'JWKS_INTERVALO_MINIMO', 0):
+            self.assertEqual(self.login(self.id_token(kid='k2')).status_code, 200)
+        self.assertEqual(len(self.buscas), 2)
+
+    def test_audience_de_outro_app(self):
+        self.assertEqual(self.login(self.id_token(aud='outro-app')).status_code, 400)
+        self.assertEqual(self.login(self.id_token(aud=None)).status_code, 400)
+
+    def test_token_expirado(self):
+        passado = int(timezone.now().timestamp()) - 7200
+        self.assertEqual(self.login(self.id_token(iat=passado, exp=passado + 3600)).status_code, 400)
+
+    def test_email_nao_verificado(self):
+        self.assertEqual(self.login(self.id_token(email_verified=False)).status_code, 400)
+        token = self.id_token()
+        dados = jwt.decode(token, options={'verify_signature': False})
+        del dados['email_verified']
+        sem_campo = jwt.encode(dados, self.chaves['k1'], algorithm='RS256', headers={'kid': 'k1'})
+        self.assertEqual(self.login(sem_campo).status_code, 400)
+
+    def test_sem_client_id_recusa(self):
+        with override_settings(GOOGLE_CLIENT_ID=None), self.assertLogs('app_projeto.views', 'ERROR'):
+            self.assertEqual(self.login(self.id_token()).status_code, 503)
+        self.assertEqual(self.buscas, [])
+
+
+class RehashSenhaTests(TransactionTestCase):
+    """A regravação roda na thread do executor: precisa de commits de verdade."""
+
+    def setUp(self):
+        usuario_cache.clear()
+        self.hash_pbkdf2 = make_password('senha', hasher='pbkdf2_sha256')
+        self.usuario = Usuario.objects.create(
+            nome='Paciente', email='paciente@teste.com', cpf='111.111.111-11',
+            senha=self.hash_pbkdf2, role='Paciente',
+        )
+
+    def aguardar_rehash(self):
+        # Executor com um worker: esta tarefa só roda depois das agendadas antes
+        hashers._executor_rehash.submit(lambda: None).result(timeout=10)
+
+    def test_login_com_pbkdf2_regrava_em_argon2(self):
+        resposta = self.client.post(
+            '/login_usuario/', json.dumps({'email': 'paciente@teste.com', 'password': 'senha'}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200)
+        self.aguardar_rehash()
+        self.usuario.refresh_from_db()
+        self.assertTrue(self.usuario.senha.startswith('argon2$'))
+        self.assertTrue(hashers.verificar_senha(self.usuario, 'senha'))
+
+    def test_regravacao_so_troca_o_hash_lido(self):
+        # Dois logins concorrentes leram o mesmo hash antigo: só o primeiro grava
+        hashers.agendar_rehash(self.usuario.id, 'senha', self.hash_pbkdf2)
+        self.aguardar_rehash()
+        primeiro = Usuario.objects.get(id=self.usuario.id).senha
+        hashers.agendar_rehash(self.usuario.id, 'senha', self.hash_pbkdf2)
+        self.aguardar_rehash()
+        self.assertEqual(Usuario.objects.get(id=self.usuario.id).senha, primeiro)
+
+        # Senha trocada entre o login e a regravação: a nova senha fica
+        nova = make_password('outra')
+        Usuario.objects.filter(id=self.usuario.id).update(senha=nova)
+        hashers.agendar_rehash(self.usuario.id, 'senha', primeiro)
+        self.aguardar_rehash()
+        self.assertEqual(Usuario.objects.get(id=self.usuario.id).senha, nova)
+
+
+class ListagemAgendamentosTests(BaseAPITestCase):
+    def contar_queries(self, url, usuario):
+        with CaptureQueriesContext(connection) as ctx:
+            resposta = self.get(url, usuario)
+        self.assertEqual(resposta.status_code, 200)
+        return len(ctx.captured_queries), resposta.json()
+
+    def test_numero_de_queries_constante(self):
+        # Listagem do paciente tem GET condicional: +1 query (versão para o ETag)
+        for url, usuario, esperado in [
+            ('/api/agendamentos_paciente/', self.paciente, 2),
+            ('/api/agendamentos_profissional/', self.psicologo, 1),
+        ]:
+            Agendamento.objects.all().delete()
+            self.criar_agendamentos(1)
+            queries_um, _ = self.contar_queries(url, usuario)
+            self.criar_agendamentos(20)
+            queries_muitos, dados = self.contar_queries(url, usuario)
+            self.assertEqual(len(dados), 21)
+            self.assertEqual(queries_um, queries_muitos)
+            self.assertEqual(queries_muitos, esperado)
+
+    def test_formato_paciente(self):
+        self.criar_agendamentos(1)
+        item = self.get('/api/agendamentos_paciente/', self.paciente).json()[0]
+        ag = Agendamento.objects.get()
+        local = timezone.localtime(ag.data_hora)
+        self.assertEqual(item['data_hora'], local.isoformat())
+        self.assertEqual(item['data'], local.strftime('%Y-%m-%d'))
+        self.assertEqual(item['hora'], local.strftime('%H:%M'))
+        self.assertEqual(item['paciente']['nome'], 'Paciente')
+        self.assertEqual(item['profissional']['id'], self.psicologo.id)
+        self.assertEqual(item['profissional']['valor_consulta'], '150.00')
+        self.assertEqual(item['valor_pago_profissional'], 0.0)
+
+    def test_filtros(self):
+        self.criar_agendamentos(3)
+        Agendamento.objects.filter(id=Agendamento.objects.order_by('id').first().id).update(status='paga')
+        passado = timezone.now() - timedelta(days=10)
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=passado)
+
+        url = '/api/agendamentos_profissional/'
+        self.assertEqual(len(self.get(url, self.psicologo, status='paga').json()), 1)
+        self.assertEqual(len(self.get(url, self.psicologo, proximos='true').json()), 3)
+        dia = timezone.localtime(passado).date().isoformat()
+        self.assertEqual(len(self.get(url, self.psicologo, data_inicio=dia, data_fim=dia).json()), 1)
+        self.assertEqual(self.get(url, self.psicologo, data_inicio='ontem').status_code, 400)
+
+
+class PaginacaoKeysetTests(BaseAPITestCase):
+    def test_percorre_todas_as_paginas_sem_repetir(self):
+        self.criar_agendamentos(7)
+        url = '/api/agendamentos_profissional/'
+        vistos, cursor = [], None
+        while True:
+            params = {'limite': 3, 'total': 1}
+            if cursor:
+                params['cursor'] = cursor
+            dados = self.get(url, self.psicologo, **params).json()
+            self.assertEqual(dados['total_estimado'], 7)
+            vistos += [item['id'] for item in dados['resultados']]
+            cursor = dados['proximo_cursor']
+            if not cursor:
+                break
+        esperado = list(Agendamento.objects.order_by('data_hora', 'id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperado)
+
+    def test_sem_paginacao_mantem_lista(self):
+        self.criar_agendamentos(2)
+        dados = self.get('/api/agendamentos_paciente/', self.paciente, paginado='false').json()
+        self.assertIsInstance(dados, list)
+        self.assertEqual(self.get('/api/agendamentos_paciente/', self.paciente, cursor='???').status_code, 400)
+
+    def test_cursor_malformado_responde_400(self):
+        self.criar_agendamentos(2)
+        for valores in (
+            ['garbage', 1], ['2024-13-45T00:00:00', 1], ['2024-01-01T00:00:00', 'x'],
+            {'a': 1, 'b': 2}, [None, 1], [1], 'texto', 5,
+        ):
+            cursor = _codificar_cursor(valores) if isinstance(valores, list) else (
+                base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+            )
+            resposta = self.get('/api/agendamentos_profissional/', self.psicologo, cursor=cursor)
+            self.assertEqual(resposta.status_code, 400, valores)
+            self.assertEqual(resposta.json(), {'error': 'cursor inválido.'})
+        # Sem fuso (cursor gerado à mão) ainda funciona
+        resposta = self.get('/api/agendamentos_profissional/', self.psicologo, cursor=_codificar_cursor(['2000-01-01T00:00:00', 0]))
+        self.assertEqual(len(resposta.json()['resultados']), 2)
+
+
+class ListagemProntuariosTests(BaseAPITestCase):
+    def test_uma_query_e_sem_texto(self):
+        self.criar_agendamentos(5)
+        with CaptureQueriesContext(connection) as ctx:
+            resposta = self.get('/api/prontuarios/', self.psicologo)
+        self.assertEqual(resposta.status_code, 200)
+        # Versão (ETag) + listagem
+        self.assertEqual(len(ctx.captured_queries), 2)
+        item = resposta.json()[0]
+        self.assertNotIn('texto', item)
+        self.assertEqual(item['paciente']['nome'], 'Paciente')
+        self.assertEqual(item['agendamento']['psicologo_nome'], 'Psicólogo')
+
+    def test_prontuario_criado_so_na_primeira_escrita(self):
+        self.criar_agendamentos(2)
+        self.assertFalse(Prontuario.objects.exists())
+        ag, cancelado = Agendamento.objects.order_by('id')
+        Agendamento.objects.filter(id=cancelado.id).update(status='cancelado')
+
+        itens = self.get('/api/prontuarios/', self.psicologo).json()
+        self.assertEqual([(i['id'], i['agendamento']['id']) for i in itens], [(None, ag.id)])
+
+        url = f'/api/agendamentos/{ag.id}/prontuario/'
+        self.assertTrue(self.get(url, self.psicologo).json()['virtual'])
+        self.assertFalse(Prontuario.objects.exists())
+
+        resposta = self.client.patch(
+            url, {'texto': 'Evolução'}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {token_para(self.psicologo)}',
+        )
+        self.assertEqual(resposta.status_code, 200)
+        prontuario = Prontuario.objects.get()
+        self.assertEqual((prontuario.agendamento_id, prontuario.texto), (ag.id, 'Evolução'))
+        detalhe = self.get(f'/api/prontuarios/{prontuario.id}/', self.psicologo).json()
+        self.assertFalse(detalhe['virtual'])
+        self.assertEqual(self.get('/api/prontuarios/', self.psicologo).json()[0]['id'], prontuario.id)
+
+
+class IndicesAgendamentoTests(BaseAPITestCase):
+    """
+    Roda EXPLAIN nas queries que os caminhos quentes realmente emitem e exige
+    que o índice composto correspondente apareça no plano.
+    """
+
+    def explicar(self, sql):
+        prefixo = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefixo + sql)
+            return ' '.join(str(coluna) for linha in cursor.fetchall() for coluna in linha)
+
+    def assertUsaIndice(self, indice, acao):
+        with CaptureQueriesContext(connection) as ctx:
+            acao()
+        selects = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and 'app_projeto_agendamento' in q['sql'].split(' WHERE ')[0]
+        ]
+        self.assertTrue(selects, 'nenhuma query em Agendamento foi executada')
+        planos = [self.explicar(sql) for sql in selects]
+        self.assertTrue(any(indice in plano for plano in planos), f'{indice} não usado: {planos}')
+
+    def test_disponibilidade_usa_indice_do_profissional(self):
+        self.criar_agendamentos(3)
+        dia = timezone.localdate() + timedelta(days=1)
+        self.assertUsaIndice('agendamento_profissional_data', lambda: self.client.get('/api/horarios_disponiveis/', {
+            'profissional_id': self.psicologo.id, 'tipo': 'psicologo', 'data': dia.isoformat(),
+        }))
+
+    def test_conflito_ao_agendar_usa_indice_do_profissional(self):
+        data_hora = (timezone.now() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+        self.assertUsaIndice('agendamento_profissional_data', lambda: self.client.post('/api/agendamentos/criar/', {
+            'usuario': self.paciente.id, 'psicologo': self.psicologo.id, 'data_hora': data_hora.isoformat(),
+        }, content_type='application/json'))
+
+    def test_listagem_paginada_do_paciente_usa_indice(self):
+        self.criar_agendamentos(3)
+        self.assertUsaIndice('agendamento_paciente_data', lambda: self.get(
+            '/api/agendamentos_paciente/', self.paciente, paginado='true'))
+
+    def test_webhook_stripe_usa_indice_da_sessao(self):
+        self.criar_agendamentos(1, stripe_session_id='cs_teste')
+        evento = {'type': 'checkout.session.completed', 'data': {'object': {'id': 'cs_teste'}}}
+        self.assertUsaIndice('agendamento_stripe_session', lambda: self.client.post(
+            '/api/stripe/webhook/', json.dumps(evento), content_type='application/json'))
+
+    def test_expiracao_de_pendentes_usa_indice(self):
+        from .management.commands.expirar_agendamentos_pendentes import expirar_lote
+        agora = timezone.now()
+        self.assertUsaIndice('agendamento_status_criacao', lambda: expirar_lote(agora, agora, 100))
+
+    def test_conclusao_de_passadas_usa_indice(self):
+        from .management.commands.concluir_agendamentos import concluir_lote
+        self.assertUsaIndice('agendamento_status_data', lambda: concluir_lote(timezone.now(), 100))
+
+
+class ProfissionalAgendamentoTests(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.psiquiatra = Usuario.objects.create(
+            nome='Psiquiatra', email='psiquiatra@teste.com', cpf='333.333.333-33',
+            senha=make_password('senha'), role='Psiquiatra', crm='12345',
+        )
+        self.data_hora = timezone.now() + timedelta(days=1)
+
+    def test_so_profissional_preenche_campo_do_papel(self):
+        for profissional, campo, vazio in ((self.psiquiatra, 'psiquiatra', 'psicologo'),
+                                           (self.psicologo, 'psicologo', 'psiquiatra')):
+            ag = Agendamento.objects.create(usuario=self.paciente, profissional=profissional, data_hora=self.data_hora)
+            ag.refresh_from_db()
+            self.assertEqual(getattr(ag, f'{campo}_id'), profissional.id)
+            self.assertIsNone(getattr(ag, f'{vazio}_id'))
+
+    def test_escrita_legada_define_profissional(self):
+        ag = Agendamento.objects.create(usuario=self.paciente, psiquiatra=self.psiquiatra, data_hora=self.data_hora)
+        ag.refresh_from_db()
+        self.assertEqual(ag.profissional_id, self.psiquiatra.id)
+        # save(update_fields=[campo antigo]) também grava o profissional
+        Agendamento.objects.filter(id=ag.id).update(profissional=None)
+        ag.refresh_from_db()
+        ag.save(update_fields=['psiquiatra'])
+        ag.refresh_from_db()
+        self.assertEqual(ag.profissional_id, self.psiquiatra.id)
+
+    def test_par_conflitante_recusado(self):
+        for campos in ({'psiquiatra': self.psiquiatra, 'psicologo': self.psicologo},
+                       {'psiquiatra': self.psiquiatra, 'profissional': self.psicologo}):
+            with self.assertRaises(ValidationError):
+                Agendamento.objects.create(usuario=self.paciente, data_hora=self.data_hora, **campos)
+        self.assertFalse(Agendamento.objects.exists())
+
+    def test_backfill_nao_deixa_profissional_nulo(self):
+        migracao = importlib.import_module('app_projeto.migrations.0036_agendamento_profissional')
+        self.criar_agendamentos(3)
+        Agendamento.objects.create(usuario=self.paciente, psiquiatra=self.psiquiatra, data_hora=self.data_hora)
+        # Estado anterior à migração: só os campos antigos preenchidos
+        Agendamento.objects.update(profissional=None)
+        with mock.patch.object(migracao, 'TAMANHO_LOTE', 2):
+            migracao.preencher_profissional(django_apps, None)
+        self.assertFalse(Agendamento.objects.filter(profissional__isnull=True).exists())
+        self.assertEqual(Agendamento.objects.get(psiquiatra=self.psiquiatra).profissional_id, self.psiquiatra.id)
+        self.assertEqual(Agendamento.objects.filter(profissional=self.psicologo).count(), 3)
+
+
+class DisponibilidadeTests(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        hoje = timezone.localdate()
+        # Uma segunda-feira futura e a terça seguinte
+        self.segunda = hoje + timedelta(days=7 - hoje.weekday())
+        self.terca = self.segunda + timedelta(days=1)
+
+    def disponiveis(self, data):
+        resposta = self.get(
+            '/api/horarios_disponiveis/', self.paciente,
+            profissional_id=self.psicologo.id, tipo='psicologo', data=data.isoformat(),
+        )
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def agendar(self, data, hora, minuto=0, **kwargs):
+        return Agendamento.objects.create(
+            usuario=self.paciente, psicologo=self.psicologo,
+            data_hora=timezone.make_aware(datetime.combine(data, time(hora, minuto))), **kwargs,
+        )
+
+    def test_horarios_fixos_sem_horario_de_trabalho(self):
+        dados = self.disponiveis(self.segunda)
+        esperado = [f'{8 + i // 2:02d}:{30 * (i % 2):02d}' for i in range(20)]
+        self.assertEqual(dados['horarios_disponiveis'], esperado)
+        self.assertTrue(dados['usando_horarios_fixos'])
+        self.assertEqual(dados['profissional_nome'], 'Psicólogo')
+
+    def test_horarios_de_trabalho_e_limites(self):
+        for inicio, fim in ((time(9), time(11)), (time(14), time(15, 15))):
+            HorarioTrabalho.objects.create(
+                profissional=self.psicologo, dia_semana=0, horario_inicio=inicio, horario_fim=fim,
+            )
+        dados = self.disponiveis(self.segunda)
+        # O fim do expediente não abre slot; 15:00 começa antes das 15:15
+        self.assertEqual(dados['horarios_disponiveis'], ['09:00', '09:30', '10:00', '10:30', '14:00', '14:30', '15:00'])
+        self.assertFalse(dados['usando_horarios_fixos'])
+        # Outro dia da semana continua no horário fixo
+        self.assertTrue(self.disponiveis(self.terca)['usando_horarios_fixos'])
+
+    def test_reservas_ocupam_slots(self):
+        self.agendar(self.segunda, 8)        # primeiro slot
+        self.agendar(self.segunda, 17, 30)   # último slot
+        self.agendar(self.segunda, 12, 15)   # fora da grade: bloqueia os dois vizinhos
+        self.agendar(self.segunda, 18)       # depois do expediente: não tira nada
+        livres = self.disponiveis(self.segunda)['horarios_disponiveis']
+        for ocupado in ('08:00', '17:30', '12:00', '12:30'):
+            self.assertNotIn(ocupado, livres)
+        self.assertEqual(len(livres), 16)
+        ocupados = self.get(
+            '/api/horarios_ocupados/', self.paciente,
+            profissional_id=self.psicologo.id, tipo='psicologo', data=self.segunda.isoformat(),
+        ).json()
+        # Horário local, como os slots que a página de agendamento compara
+        self.assertEqual(ocupados, ['08:00', '12:15', '17:30', '18:00'])
+
+    def test_cancelado_libera_slot_e_cache_e_invalidado(self):
+        self.agendar(self.segunda, 9, status='cancelado')
+        self.assertIn('09:00', self.disponiveis(self.segunda)['horarios_disponiveis'])
+
+        # Com o dia em cache, um agendamento novo aparece na próxima leitura
+        ag = self.agendar(self.segunda, 10)
+        self.assertNotIn('10:00', self.disponiveis(self.segunda)['horarios_disponiveis'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.disponiveis(self.segunda)
+        self.assertFalse(any('app_projeto_agendamento' in q['sql'] for q in ctx.captured_queries))
+
+        ag.status = 'cancelado'
+        ag.save()
+        self.assertIn('10:00', self.disponiveis(self.segunda)['horarios_disponiveis'])
+
+    def intervalo(self, inicio, fim, **headers):
+        return self.client.get(
+            '/api/horarios_disponiveis/intervalo/',
+            {'profissional_id': self.psicologo.id, 'tipo': 'psicologo', 'inicio': inicio.isoformat(), 'fim': fim.isoformat()},
+            HTTP_AUTHORIZATION=f'Bearer {token_para(self.paciente)}', **headers,
+        )
+
+    def test_intervalo_limite_de_dias(self):
+        resposta = self.intervalo(self.segunda, self.segunda + timedelta(days=DISPONIBILIDADE_MAX_DIAS - 1))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()['dias']), DISPONIBILIDADE_MAX_DIAS)
+        resposta = self.intervalo(self.segunda, self.segunda + timedelta(days=DISPONIBILIDADE_MAX_DIAS))
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(self.intervalo(self.terca, self.segunda).status_code, 400)
+
+    def test_intervalo_etag_e_304(self):
+        fim = self.segunda + timedelta(days=6)
+        resposta = self.intervalo(self.segunda, fim)
+        etag = resposta['ETag']
+        dias = resposta.json()['dias']
+        self.assertEqual(dias[0]['horarios_disponiveis'], self.disponiveis(self.segunda)['horarios_disponiveis'])
+
+        resposta = self.intervalo(self.segunda, fim, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta['ETag'], etag)
+
+        self.agendar(self.terca, 9)
+        resposta = self.intervalo(self.segunda, fim, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertNotIn('09:00', resposta.json()['dias'][1]['horarios_disponiveis'])
+
+
+class AgendamentosLoteTests(BaseAPITestCase):
+    url = '/api/agendamentos/criar_lote/'
+
+    def setUp(self):
+        super().setUp()
+        self.base = timezone.localtime(timezone.now() + timedelta(days=2)).replace(hour=14, minute=0, second=0, microsecond=0)
+
+    def lote(self, commit=True, **corpo):
+        corpo = {'usuario': self.paciente.id, 'psicologo': self.psicologo.id, **corpo}
+        with self.captureOnCommitCallbacks(execute=commit):
+            return self.client.post(self.url, corpo, content_type='application/json')
+
+    def semanas(self, n):
+        return [(self.base + timedelta(weeks=i)).isoformat() for i in range(n)]
+
+    def test_tudo_ou_nada_desfaz_o_lote_no_conflito(self):
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=self.base + timedelta(weeks=2, minutes=15))
+        resposta = self.lote(datas_hora=self.semanas(4))
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json()['criados'], 0)
+        self.assertEqual([r['status'] for r in resposta.json()['resultados']], ['nao_criado', 'nao_criado', 'conflito', 'nao_criado'])
+        self.assertEqual(Agendamento.objects.count(), 1)
+        self.assertFalse(AgendamentoHistorico.objects.filter(origem='lote').exists())
+
+    def test_parcial_cria_os_livres_e_relata_conflitos(self):
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=self.base + timedelta(weeks=1))
+        resposta = self.lote(datas_hora=self.semanas(3), modo='parcial')
+        self.assertEqual(resposta.status_code, 201)
+        dados = resposta.json()
+        self.assertEqual(dados['criados'], 2)
+        self.assertEqual([r['status'] for r in dados['resultados']], ['criado', 'conflito', 'criado'])
+        self.assertIn('erro', dados['resultados'][1])
+        self.assertEqual(Agendamento.objects.count(), 3)
+        self.assertEqual(AgendamentoHistorico.objects.filter(origem='lote').count(), 2)
+
+    def test_sobreposicao_dentro_do_lote(self):
+        datas = [self.base, self.base + timedelta(minutes=15), self.base + timedelta(hours=1)]
+        resposta = self.lote(datas_hora=[d.isoformat() for d in datas], modo='parcial')
+        self.assertEqual([r['status'] for r in resposta.json()['resultados']], ['criado', 'conflito', 'criado'])
+        self.assertEqual(resposta.json()['resultados'][1]['erro'], 'Sobrepõe outra data do próprio lote.')
+        self.assertEqual(self.lote(datas_hora=[d.isoformat() for d in datas[:2]]).status_code, 400)
+
+    def horarios_locais(self):
+        return [timezone.localtime(d).strftime('%Y-%m-%d %H:%M') for d in Agendamento.objects.order_by('data_hora').values_list('data_hora', flat=True)]
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_recorrencia_mantem_o_horario_local_na_mudanca_de_horario_de_verao(self):
+        # Horário de verão em Nova York começa em 10/03/2030
+        resposta = self.lote(recorrencia={'data_hora': '2030-03-03T14:00:00', 'semanas': 3})
+        self.assertEqual(resposta.status_code, 201, resposta.content)
+        self.assertEqual(self.horarios_locais(), ['2030-03-03 14:00', '2030-03-10 14:00', '2030-03-17 14:00'])
+        # Mesmo horário de parede, offsets diferentes: 19h UTC antes da mudança, 18h depois
+        datas = Agendamento.objects.order_by('data_hora').values_list('data_hora', flat=True)
+        self.assertEqual([d.astimezone(dt_timezone.utc).hour for d in datas], [19, 18, 18])
+
+    def test_recorrencia_atravessa_a_virada_do_dia_e_do_mes(self):
+        # 23h30 em São Paulo já é o dia seguinte em UTC
+        resposta = self.lote(recorrencia={'data_hora': '2030-01-30T23:30:00-03:00', 'semanas': 3, 'intervalo_dias': 1})
+        self.assertEqual(resposta.status_code, 201, resposta.content)
+        self.assertEqual(self.horarios_locais(), ['2030-01-30 23:30', '2030-01-31 23:30', '2030-02-01 23:30'])
+
+    def test_limite_de_ocorrencias(self):
+        maximo = views.AGENDAMENTO_LOTE_MAX
+        self.assertEqual(self.lote(datas_hora=self.semanas(maximo + 1)).status_code, 400)
+        self.assertEqual(self.lote(recorrencia={'data_hora': self.base.isoformat(), 'semanas': maximo + 1}).status_code, 400)
+        self.assertFalse(Agendamento.objects.exists())
+        resposta = self.lote(recorrencia={'data_hora': self.base.isoformat(), 'semanas': maximo})
+        self.assertEqual(resposta.json()['criados'], maximo)
+
+    def test_numero_de_queries_nao_cresce_com_as_ocorrencias(self):
+        # Só as queries da view: o histórico e o feed são gravados no commit, em lote,
+        # pelo middleware (no TestCase o commit fica para depois da requisição)
+        contagens = []
+        for n in (2, 10):
+            Agendamento.objects.all().delete()
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.lote(commit=False, datas_hora=self.semanas(n)).status_code, 201)
+            contagens.append(len(ctx.captured_queries))
+        self.assertEqual(contagens[0], contagens[1])
+
+
+class HorariosTrabalhoLoteTests(BaseAPITestCase):
+    def test_put_aplica_so_a_diferenca_e_invalida_caches(self):
+        def horario(dia, inicio, fim):
+            return HorarioTrabalho.objects.create(
+                profissional=self.psicologo, dia_semana=dia, horario_inicio=time(inicio), horario_fim=time(fim),
+            )
+        manha, tarde, quarta = horario(0, 8, 12), horario(0, 14, 18), horario(2, 8, 12)
+
+        # Caches aquecidos: horários públicos e motor de disponibilidade
+        publico = f'/api/horarios-trabalho/profissional/{self.psicologo.id}/'
+        self.assertEqual(len(self.client.get(publico).json()), 3)
+        hoje = timezone.localdate()
+        segunda = hoje + timedelta(days=7 - hoje.weekday())
+        self.assertIn('14:00', disponibilidade.dia(self.psicologo.id, segunda).horarios_disponiveis())
+
+        corpo = {'horarios': [
+            {'dia_semana': 0, 'horario_inicio': '08:00', 'horario_fim': '12:00', 'ativo': True},   # igual
+            {'dia_semana': 0, 'horario_inicio': '14:00', 'horario_fim': '18:00', 'ativo': False},  # desativado
+            {'dia_semana': 4, 'horario_inicio': '09:00', 'horario_fim': '11:00', 'ativo': True},   # novo
+        ]}
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.put(
+                '/api/horarios-trabalho/', corpo, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {token_para(self.psicologo)}',
+            )
+        self.assertEqual(resposta.status_code, 200)
+
+        linhas = {h.dia_semana * 100 + h.horario_inicio.hour: h for h in HorarioTrabalho.objects.all()}
+        self.assertEqual(set(linhas), {8, 14, 409})
+        self.assertEqual(linhas[8].id, manha.id)
+        self.assertEqual(linhas[8].data_atualizacao, manha.data_atualizacao)
+        self.assertEqual(linhas[14].id, tarde.id)
+        self.assertFalse(linhas[14].ativo)
+        self.assertFalse(HorarioTrabalho.objects.filter(id=quarta.id).exists())
+
+        self.assertEqual(
+            [(h['dia_semana'], h['horario_inicio']) for h in self.client.get(publico).json()],
+            [(0, '08:00:00'), (4, '09:00:00')],
+        )
+        self.assertNotIn(self.psicologo.id, disponibilidade._agendas)
+        self.assertNotIn('14:00', disponibilidade.dia(self.psicologo.id, segunda).horarios_disponiveis())
+
+
+class IndiceProximoLivreTests(BaseAPITestCase):
+    """
+    Índice e motor locais ao teste: os sinais de save só invalidam os globais,
+    então aqui eles fazem o papel de outro processo.
+    """
+
+    def setUp(self):
+        super().setUp()
+        hoje = timezone.localdate()
+        self.segunda = hoje + timedelta(days=7 - hoje.weekday())
+        self.outro = Usuario.objects.create(
+            nome='Outra', email='outra@teste.com', cpf='333.333.333-33',
+            senha=make_password('senha'), role='Psicologo', crp='06/9999', valor_consulta=120,
+        )
+        for profissional, inicio, fim in ((self.psicologo, time(8, 30), time(9, 30)), (self.outro, time(9), time(10))):
+            HorarioTrabalho.objects.create(profissional=profissional, dia_semana=0, horario_inicio=inicio, horario_fim=fim)
+        self.agora = self.em(7)
+        self.motor = MotorDisponibilidade()
+        self.indice = IndiceProximoLivre(self.motor, horizonte_dias=2)
+
+    def em(self, hora, minuto=0, dias=0):
+        return timezone.make_aware(datetime.combine(self.segunda + timedelta(days=dias), time(hora, minuto)))
+
+    def test_primeiros_livres_intercala_as_agendas(self):
+        p, o = self.psicologo.id, self.outro.id
+        self.assertEqual(self.indice.primeiros_livres('psicologo', 5, self.agora), [
+            (self.em(8, 30), p), (self.em(9), p), (self.em(9), o), (self.em(9, 30), o),
+            (self.em(8, dias=1), p),  # terça sem horário cadastrado: horário fixo
+        ])
+
+    def test_cabeca_defasada_e_conferida_no_motor(self):
+        self.indice.primeiros_livres('psicologo', 1, self.agora)
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=self.em(8, 30))
+        # O motor venceu (TTL), o índice ainda aponta para 8h30
+        self.motor.invalidar(self.psicologo.id)
+        self.assertEqual(self.indice._proximos['psicologo'][self.psicologo.id][0], self.em(8, 30))
+        self.assertEqual(self.indice.primeiros_livres('psicologo', 1, self.agora), [(self.em(9), self.psicologo.id)])
+        self.assertEqual(self.indice._proximos['psicologo'][self.psicologo.id][0], self.em(9))
+
+    def test_entradas_vencem_com_o_ttl_do_motor(self):
+        indice = IndiceProximoLivre(MotorDisponibilidade(ttl=0), horizonte_dias=2)
+        self.assertEqual(indice._atualizar('psicologo', self.agora)[self.psicologo.id], self.em(8, 30))
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=self.em(8, 30))
+        self.assertEqual(indice._atualizar('psicologo', self.agora)[self.psicologo.id], self.em(9))
+
+    def test_livres_entre(self):
+        livres = self.indice.livres_entre('psicologo', self.em(9), self.em(10), self.agora)
+        self.assertEqual(livres, {
+            self.psicologo.id: [self.em(9)],
+            self.outro.id: [self.em(9), self.em(9, 30)],
+        })
+        Agendamento.objects.create(usuario=self.paciente, psicologo=self.outro, data_hora=self.em(9, 30))
+        self.motor.invalidar(self.outro.id)
+        # 9h30 da outra foi reservado: ninguém tem slot que caiba em [9h15, 10h)
+        self.assertEqual(self.indice.livres_entre('psicologo', self.em(9, 15), self.em(10), self.agora), {})
+        self.assertEqual(self.indice.livres_entre('psicologo', self.em(6), self.em(8), self.agora), {})
+
+
+class SlotUnicoTests(BaseAPITestCase):
+    url = '/api/agendamentos/criar/'
+
+    def setUp(self):
+        super().setUp()
+        self.slot = (timezone.now() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+        self.corpo = {'usuario': self.paciente.id, 'psicologo': self.psicologo.id, 'data_hora': self.slot.isoformat()}
+
+    def criar(self):
+        return self.client.post(self.url, self.corpo, content_type='application/json')
+
+    def test_slot_duplicado_responde_400_sem_segunda_linha(self):
+        self.assertEqual(self.criar().status_code, 201)
+        resposta = self.criar()
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('error', resposta.json())
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+    def test_corrida_decidida_pela_restricao(self):
+        self.assertEqual(self.criar().status_code, 201)
+        # Outra requisição passou pela checagem antes do primeiro commit
+        with mock.patch('django.db.models.query.QuerySet.exists', return_value=False):
+            resposta = self.criar()
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+    def test_cancelado_ou_concluido_libera_o_slot(self):
+        for status_final in ('cancelado', 'Concluida'):
+            self.assertEqual(self.criar().status_code, 201)
+            ag = Agendamento.objects.get(slot_ativo__isnull=False)
+            self.assertEqual(ag.slot_ativo, self.slot)
+            ag.status = status_final
+            ag.save()
+            ag.refresh_from_db()
+            self.assertIsNone(ag.slot_ativo)
+        self.assertEqual(self.criar().status_code, 201)
+        self.assertEqual(Agendamento.objects.filter(data_hora=self.slot).count(), 3)
+
+
+class HistoricoAgendamentoTests(BaseAPITestCase):
+    def eventos(self):
+        return list(AgendamentoHistorico.objects.order_by('id').values_list('status_anterior', 'status_novo', 'origem'))
+
+    def test_transicoes_gravadas_na_transacao_da_mudanca(self):
+        data_hora = (timezone.now() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post('/api/agendamentos/criar/', {
+                'usuario': self.paciente.id, 'psicologo': self.psicologo.id, 'data_hora': data_hora.isoformat(),
+            }, content_type='application/json')
+        self.assertEqual(resposta.status_code, 201)
+        ag = Agendamento.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with em_lote('webhook'):
+                ag.status = 'paga'
+                ag.save()
+                ag.observacoes = 'sem mudança de status'
+                ag.save()
+                self.assertEqual(len(self.eventos()), 2)  # já gravado, sem esperar o commit
+        self.assertEqual(self.eventos(), [(None, 'pendente', 'api'), ('pendente', 'paga', 'webhook')])
+
+    def test_rollback_descarta_evento(self):
+        self.criar_agendamentos(1)
+        ag = Agendamento.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ag.status = 'cancelado'
+                    ag.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.eventos(), [(None, 'pendente', 'sistema')])
+
+    def test_arquivamento_comprime_e_remove(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_agendamentos(2)
+            registrar(Agendamento.objects.first().id, 'paga', de='pendente', origem='webhook')
+        AgendamentoHistorico.objects.update(data_status=timezone.now() - timedelta(days=400))
+        self.assertEqual(arquivar_lote(timezone.now() - timedelta(days=180), 2), 2)
+        self.assertEqual(arquivar_lote(timezone.now() - timedelta(days=180), 2), 1)
+        self.assertFalse(AgendamentoHistorico.objects.exists())
+        arquivados = [e for bloco in AgendamentoHistoricoArquivo.objects.order_by('id') for e in bloco.eventos()]
+        self.assertEqual(len(arquivados), 3)
+        self.assertEqual(arquivados[-1][2:5], ['pendente', 'paga', 'webhook'])
+
+
+class EventosJobsTests(BaseAPITestCase):
+    def test_lote_do_job_grava_historico_na_propria_transacao(self):
+        from .management.commands.concluir_agendamentos import concluir_lote
+        for horas in (2, 3, 4):
+            Agendamento.objects.create(
+                usuario=self.paciente, psicologo=self.psicologo, status='paga',
+                data_hora=timezone.now() - timedelta(hours=horas),
+            )
+
+        # Sem rodar os on_commit: o histórico do lote já está gravado
+        self.assertEqual(concluir_lote(timezone.now(), 2), 2)
+        self.assertEqual(AgendamentoHistorico.objects.filter(origem='conclusao').count(), 2)
+        self.assertEqual(Alteracao.objects.count(), 2)
+
+        # Falha ao gravar o histórico desfaz as mudanças de status do lote
+        with mock.patch('app_projeto.eventos._gravar', side_effect=DatabaseError('falhou')):
+            with self.assertRaises(DatabaseError):
+                concluir_lote(timezone.now(), 2)
+        self.assertEqual(Agendamento.objects.filter(status='paga').count(), 1)
+        self.assertEqual(AgendamentoHistorico.objects.filter(origem='conclusao').count(), 2)
+
+
+class EventosMiddlewareTests(TransactionTestCase):
+    """Histórico e feed da requisição com commits de verdade."""
+
+    def setUp(self):
+        self.paciente = Usuario.objects.create(
+            nome='Paciente', email='paciente@teste.com', cpf='111.111.111-11', senha='x', role='Paciente',
+        )
+        self.psicologo = Usuario.objects.create(
+            nome='Psicólogo', email='psicologo@teste.com', cpf='222.222.222-22', senha='x',
+            role='Psicologo', crp='06/1234', valor_consulta=150,
+        )
+        self.data_hora = (timezone.now() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+
+    def criar(self):
+        return self.client.post('/api/agendamentos/criar/', {
+            'usuario': self.paciente.id, 'psicologo': self.psicologo.id, 'data_hora': self.data_hora.isoformat(),
+        }, content_type='application/json')
+
+    def test_falha_ao_gravar_historico_desfaz_a_mudanca(self):
+        with mock.patch('app_projeto.eventos._gravar', side_effect=DatabaseError('falhou')):
+            with self.assertRaises(DatabaseError):
+                self.criar()
+        # Nem agendamento sem histórico, nem histórico perdido em silêncio
+        self.assertFalse(Agendamento.objects.exists())
+        self.assertFalse(AgendamentoHistorico.objects.exists())
+
+    def test_falha_ao_gravar_feed_sobe_como_erro(self):
+        with mock.patch('app_projeto.eventos._gravar_alteracoes', side_effect=DatabaseError('falhou')):
+            with self.assertRaises(DatabaseError):
+                self.criar()
+        self.assertEqual(AgendamentoHistorico.objects.count(), Agendamento.objects.count())
+
+    def test_criado_e_removido_na_mesma_requisicao(self):
+        with em_lote('api'):
+            ag = Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=self.data_hora)
+            ag.status = 'cancelado'
+            ag.save()
+            ag.delete()
+        self.assertFalse(AgendamentoHistorico.objects.exists())
+        self.assertEqual(list(Alteracao.objects.values_list('removido', flat=True)), [True])
+
+
+class ConclusaoAgendamentosTests(BaseAPITestCase):
+    def test_conclui_so_passadas_pagas_ou_confirmadas(self):
+        from django.core.management import call_command
+        agora = timezone.now()
+        casos = [
+            (agora - timedelta(hours=3), 'paga', 'Concluida'),
+            (agora - timedelta(hours=2), 'confirmado', 'Concluida'),
+            (agora - timedelta(hours=1), 'pendente', 'pendente'),
+            (agora - timedelta(minutes=10), 'paga', 'paga'),  # ainda em andamento
+            (agora + timedelta(days=1), 'paga', 'paga'),
+        ]
+        for data_hora, status, _ in casos:
+            Agendamento.objects.create(usuario=self.paciente, psicologo=self.psicologo, data_hora=data_hora, status=status)
+
+        for _ in range(2):  # idempotente
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('concluir_agendamentos', lote=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(
+            list(Agendamento.objects.order_by('data_hora').values_list('status', flat=True)),
+            [esperado for _, _, esperado in casos],
+        )
+        self.assertEqual(sorted(AgendamentoHistorico.objects.filter(origem='conclusao').values_list('status_anterior', flat=True)),
+                         ['confirmado', 'paga'])
+
+
+class ExpiracaoPendentesTests(BaseAPITestCase):
+    def test_cancela_so_pendentes_vencidos(self):
+        from django.core.management import call_command
+        agora = timezone.now()
+        casos = [
+            # (criado há, sessão de checkout, status, esperado)
+            (timedelta(hours=2), None, 'pendente', 'cancelado'),
+            (timedelta(hours=2), '', 'pendente', 'cancelado'),
+            (timedelta(minutes=5), None, 'pendente', 'pendente'),         # dentro do TTL
+            (timedelta(hours=2), 'cs_aberta', 'pendente', 'pendente'),    # checkout ainda pode pagar
+            (timedelta(hours=26), 'cs_antiga', 'pendente', 'cancelado'),  # checkout vencido
+            (timedelta(days=2), 'cs_paga', 'paga', 'paga'),
+        ]
+        for i, (idade, sessao, status, _) in enumerate(casos):
+            ag = Agendamento.objects.create(
+                usuario=self.paciente, psicologo=self.psicologo, status=status, stripe_session_id=sessao,
+                data_hora=agora + timedelta(days=1, hours=i),
+            )
+            Agendamento.objects.filter(id=ag.id).update(data_criacao=agora - idade)
+
+        for _ in range(2):  # a segunda rodada não encontra mais nada
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('expirar_agendamentos_pendentes', lote=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(
+            list(Agendamento.objects.order_by('data_hora').values_list('status', flat=True)),
+            [esperado for _, _, _, esperado in casos],
+        )
+        eventos = AgendamentoHistorico.objects.filter(origem='expiracao')
+        self.assertEqual(eventos.count(), 3)
+        self.assertEqual(set(eventos.values_list('status_anterior', 'status_novo')), {('pendente', 'cancelado')})
+
+
+class AvaliacaoResumoTests(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.outro = Usuario.objects.create(
+            nome='Outro', email='outro@teste.com', cpf='333.333.333-33',
+            senha=make_password('senha'), role='Psicologo',
+        )
+
+    def resumo(self, profissional):
+        r = AvaliacaoResumo.objects.get(profissional=profissional)
+        return r.total, r.soma, r.distribuicao()
+
+    def test_mantido_nos_sinais_e_igual_ao_recalculo(self):
+        from django.core.management import call_command
+        a = self.avaliar(self.psicologo, 5)
+        self.avaliar(self.psicologo, 3)
+        self.avaliar(self.psicologo, 4, tipo='profissional')  # não entra
+        a.nota = 2
+        a.save()
+        self.avaliar(self.outro, 4).delete()
+        self.assertEqual(self.resumo(self.psicologo), (2, 5, {1: 0, 2: 1, 3: 1, 4: 0, 5: 0}))
+        self.assertEqual(self.resumo(self.outro)[:2], (0, 0))
+
+        incremental = [self.resumo(p) for p in (self.psicologo, self.outro)]
+        call_command('recalcular_avaliacoes', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.resumo(self.psicologo), incremental[0])
+        self.assertFalse(AvaliacaoResumo.objects.filter(profissional=self.outro).exists())
+
+    def test_estatisticas_e_listagem_ordenada(self):
+        self.avaliar(self.psicologo, 3)
+        self.avaliar(self.outro, 5)
+        dados = self.client.get(f'/api/avaliacoes/profissional/{self.psicologo.id}/').json()
+        self.assertEqual(dados['estatisticas']['media_avaliacoes'], 3.0)
+        self.assertEqual(dados['estatisticas']['total_avaliacoes'], 1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            lista = self.client.get('/api/psicologos/', {'ordenar': 'avaliacao'}).json()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual([p['id'] for p in lista], [self.outro.id, self.psicologo.id])
+        self.assertEqual(lista[0]['avaliacoes']['media_avaliacoes'], 5.0)
+
+
+class CarrosselAvaliacoesTests(BaseAPITestCase):
+    url = '/api/avaliacoes/melhores/'
+
+    def test_payload_em_cache_com_etag_e_invalidacao(self):
+        avaliacao = self.avaliar(self.psicologo, 5)
+        avaliacao.comentario = 'Ótimo atendimento'
+        avaliacao.save()
+
+        with CaptureQueriesContext(connection) as ctx:
+            primeira = self.client.get(self.url)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(primeira.json()[0]['profissional_tipo'], 'Psicólogo')
+        self.assertIn('max-age', primeira['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.url).content, primeira.content)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=primeira['ETag']).status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        self.avaliar(self.psicologo, 2)  # não elegível: mantém o cache
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=primeira['ETag']).status_code, 304)
+        avaliacao.nota = 3  # sai do carrossel
+        avaliacao.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=primeira['ETag']).json(), [])
+
+    def test_remontagem_antes_do_commit_e_descartada(self):
+        from .carrossel import CARROSSEL_CHAVE, montar
+        avaliacao = self.avaliar(self.psicologo, 5)
+        avaliacao.comentario = 'Ótimo atendimento'
+        avaliacao.save()
+        exibido = montar()
+
+        for mudar in (lambda: setattr(avaliacao, 'nota', 3), lambda: setattr(avaliacao, 'nota', 4)):
+            with self.captureOnCommitCallbacks(execute=True):
+                mudar()
+                avaliacao.save()
+                # Requisição concorrente remonta com o estado de antes do commit
+                cache.set(CARROSSEL_CHAVE, exibido)
+            self.assertIsNone(cache.get(CARROSSEL_CHAVE))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.psicologo.nome = 'Psicóloga'
+            self.psicologo.save()
+            cache.set(CARROSSEL_CHAVE, exibido)
+        self.assertIsNone(cache.get(CARROSSEL_CHAVE))
+
+
+class CachePublicoTests(BaseAPITestCase):
+    def test_invalidacao_agora_e_de_novo_no_commit(self):
+        chamadas = []
+        with self.captureOnCommitCallbacks(execute=True):
+            agora_e_no_commit(lambda: chamadas.append(len(chamadas)))
+            self.assertEqual(chamadas, [0])
+        self.assertEqual(chamadas, [0, 1])
+
+    def test_listagem_em_cache_e_invalidada_no_save(self):
+        url = '/api/psicologos/'
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(self.client.get(url).json()), 1)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.psicologo.nome = 'Psicóloga'
+            self.psicologo.save()
+        self.assertEqual(self.client.get(url).json()[0]['nome'], 'Psicóloga')
+
+    def test_horarios_publicos_invalidados(self):
+        url = f'/api/horarios-trabalho/profissional/{self.psicologo.id}/'
+        antes = self.client.get(url).json()
+        with self.captureOnCommitCallbacks(execute=True):
+            HorarioTrabalho.objects.create(
+                profissional=self.psicologo, dia_semana=0, horario_inicio=time(8), horario_fim=time(12),
+            )
+        self.assertNotEqual(self.client.get(url).json(), antes)
+
+    def test_lembrar_calcula_uma_vez(self):
+        chamadas = []
+
+        def calcular():
+            chamadas.append(1)
+            threading.Event().wait(0.1)
+            return 'valor'
+
+        threads = [threading.Thread(target=lembrar, args=('teste_lembrar', calcular)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(lembrar('teste_lembrar', calcular), 'valor')
+
+
+class GetCondicionalTests(BaseAPITestCase):
+    url = '/api/agendamentos_paciente/'
+
+    def test_304_sem_mudanca_e_200_depois_de_alterar(self):
+        self.criar_agendamentos(3)
+        primeira = self.get(self.url, self.paciente)
+        self.assertEqual(primeira.status_code, 200)
+        self.assertIn('Last-Modified', primeira)
+        token = f'Bearer {token_para(self.paciente)}'
+
+        with CaptureQueriesContext(connection) as ctx:
+            resposta = self.client.get(self.url, HTTP_AUTHORIZATION=token, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta['ETag'], primeira['ETag'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        # Filtro diferente é outra representação
+        outra = self.client.get(self.url, {'status': 'paga'}, HTTP_AUTHORIZATION=token, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(outra.status_code, 200)
+
+        agendamento = Agendamento.objects.first()
+        agendamento.observacoes = 'Trazer exames'
+        agendamento.save()
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=token, HTTP_IF_NONE_MATCH=primeira['ETag']).status_code, 200)
+
+        segunda = self.get(self.url, self.paciente)
+        Agendamento.objects.filter(id=agendamento.id).delete()
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=token, HTTP_IF_NONE_MATCH=segunda['ETag']).status_code, 200)
+
+    def test_outro_usuario_nao_reaproveita_etag(self):
+        self.criar_agendamentos(1)
+        etag = self.get('/api/prontuarios/', self.paciente)['ETag']
+        resposta = self.client.get(
+            '/api/prontuarios/', HTTP_AUTHORIZATION=f'Bearer {token_para(self.psicologo)}', HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(resposta.status_code, 200)
+
+
+class SincronizacaoTests(BaseAPITestCase):
+    url = '/api/alteracoes/'
+
+    def sincronizar(self, usuario, cursor):
+        resposta = self.get(self.url, usuario, cursor=cursor)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def test_feed_incremental_com_remocoes(self):
+        cursor = self.get(self.url, self.paciente).json()['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_agendamentos(2)
+        primeiro, segundo = Agendamento.objects.order_by('id')
+        segundo_id = segundo.id
+
+        dados = self.sincronizar(self.paciente, cursor)
+        self.assertEqual(sorted(a['id'] for a in dados['agendamentos']), [primeiro.id, segundo.id])
+        self.assertFalse(dados['mais'])
+        cursor = dados['cursor']
+        # Nada mudou: resposta vazia com o mesmo cursor
+        vazio = self.sincronizar(self.paciente, cursor)
+        self.assertEqual((vazio['agendamentos'], vazio['cursor']), ([], cursor))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            primeiro.status = 'paga'
+            primeiro.save()
+            primeiro.status = 'confirmado'
+            primeiro.save()
+            Prontuario.objects.create(agendamento=primeiro, mensagem_paciente='Retorno em 30 dias')
+            segundo.delete()
+        dados = self.sincronizar(self.paciente, cursor)
+        self.assertEqual([(a['id'], a['status']) for a in dados['agendamentos']], [(primeiro.id, 'confirmado')])
+        self.assertEqual(dados['prontuarios'][0]['mensagem_paciente'], 'Retorno em 30 dias')
+        self.assertEqual(dados['removidos']['agendamentos'], [segundo_id])
+
+        # Outro paciente não vê nada disso
+        outro = Usuario.objects.create(nome='Outro', email='outro@teste.com', cpf='333.333.333-33', senha='x')
+        self.assertEqual(self.sincronizar(outro, cursor)['agendamentos'], [])
+        self.assertEqual(self.get(self.url, self.paciente, cursor='???').status_code, 400)
+
+    def test_compactacao_mantem_ultima_alteracao(self):
+        from django.core.management import call_command
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_agendamentos(1)
+        agendamento = Agendamento.objects.get()
+        for status in ('paga', 'confirmado'):
+            with self.captureOnCommitCallbacks(execute=True):
+                agendamento.status = status
+                agendamento.save()
+        self.assertEqual(Alteracao.objects.filter(objeto_id=agendamento.id).count(), 3)
+        call_command('compactar_alteracoes', stdout=open(os.devnull, 'w'))
+        self.assertEqual(Alteracao.objects.filter(objeto_id=agendamento.id).count(), 1)
+        dados = self.sincronizar(self.psicologo, sincronizacao.codificar_cursor(0))
+        self.assertEqual(dados['agendamentos'][0]['status'], 'confirmado')
+
+
+class NotificacoesTests(BaseAPITestCase):
+    url = '/api/notificacoes/stream/'
+
+    def test_transicao_publicada_no_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def assinar():
+            return notificacoes.hub.assinar(self.paciente.id)
+
+        assinatura = loop.run_until_complete(assinar())
+        self.addCleanup(notificacoes.hub.cancelar, self.paciente.id, assinatura)
+        self.criar_agendamentos(1)
+        agendamento = Agendamento.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            agendamento.status = 'paga'
+            agendamento.save()
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertTrue(assinatura.fila.empty())  # só depois do commit
+        loop.run_until_complete(asyncio.sleep(0))
+        evento = assinatura.fila.get_nowait()
+        self.assertEqual((evento['tipo'], evento['agendamento_id']), ('pago', agendamento.id))
+        self.assertEqual(notificacoes.tipo_evento('cancelado', 'paga', 'estorno'), 'estornado')
+
+    def test_wsgi_e_sem_login(self):
+        self.assertEqual(self.get(self.url, self.paciente).status_code, 503)
+
+    async def test_stream_sse(self):
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 401)
+        token = await sync_to_async(token_para)(self.paciente)
+        resposta = await self.async_client.get(self.url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(resposta['Content-Type'], 'text/event-stream')
+        conteudo = aiter(resposta.streaming_content)
+        self.assertIn(b'retry:', await anext(conteudo))
+        self.assertEqual(notificacoes.hub.conexoes(self.paciente.id), 1)
+
+        await sync_to_async(notificacoes.publicar)([self.paciente.id], {'tipo': 'pago', 'agendamento_id': 1})
+        self.assertIn(b'event: pago', await anext(conteudo))
+        # Cliente desconecta: o servidor cancela a tarefa que espera o próximo evento
+        espera = asyncio.ensure_future(anext(conteudo))
+        await asyncio.sleep(0)
+        espera.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await espera
+        self.assertEqual(notificacoes.hub.conexoes(self.paciente.id), 0)
+
+    async def consumir(self, conteudo):
+        """Lê o stream até ele terminar (falha se não terminar logo)."""
+        async def ler():
+            return [parte async for parte in conteudo]
+        return await asyncio.wait_for(ler(), 5)
+
+    @mock.patch.object(notificacoes, 'NOTIFICACOES_HEARTBEAT_SEGUNDOS', 0.01)
+    async def test_stream_termina_no_exp_do_token(self):
+        import time as relogio
+        conteudo = notificacoes.fluxo(self.paciente.id, expira_em=relogio.time() + 0.1)
+        self.assertIn('retry:', await anext(conteudo))
+        await self.consumir(conteudo)
+        self.assertEqual(notificacoes.hub.conexoes(self.paciente.id), 0)
+
+    @mock.patch.object(notificacoes, 'NOTIFICACOES_HEARTBEAT_SEGUNDOS', 0.01)
+    async def test_stream_termina_quando_o_token_e_revogado(self):
+        from .authentication import decodificar_token
+        from .revocation import revogar_token
+
+        token = await sync_to_async(token_para)(self.paciente)
+        resposta = await self.async_client.get(self.url, headers={'Authorization': f'Bearer {token}'})
+        conteudo = aiter(resposta.streaming_content)
+        self.assertIn(b'retry:', await anext(conteudo))
+        self.assertEqual(await anext(conteudo), b': ping\n\n')  # token ainda vale
+        await sync_to_async(revogar_token)(decodificar_token(token))
+        await self.consumir(conteudo)
+        self.assertEqual(notificacoes.hub.conexoes(self.paciente.id), 0)
@@ -0,0 +1,87 @@
+"""
+Transições de status de Agendamento em lote, para os jobs
+(concluir_agendamentos, expirar_agendamentos_pendentes).
+
+Cada lote é uma transação curta: trava as linhas com skip_locked, muda o status
+com um UPDATE só e grava histórico e feed de sincronização antes do commit
+(eventos.na_transacao). `ComandoTransicaoLote` é a base dos comandos: repete o
+lote até sobrar menos que um lote e, com --loop, roda como worker.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from .availability import invalidar_profissional
+from .eventos import na_transacao, registrar
+from .models import Agendamento
+from .sincronizacao import registrar as registrar_alteracao
+
+
+def transicionar_lote(agendamentos, status_novo, origem, tamanho):
+    """
+    Passa para `status_novo` até `tamanho` agendamentos de `agendamentos`
+    (queryset já ordenado), numa transação. Devolve quantos mudou.
+    """
+    # Histórico e feed do lote são gravados antes do commit, na mesma transação
+    with transaction.atomic(), na_transacao(origem):
+        # skip_locked: vários workers podem rodar juntos sem pegar as mesmas linhas
+        linhas = list(
+            agendamentos.select_for_update(skip_locked=True)
+            .values_list('id', 'status', 'usuario_id', 'profissional_id')[:tamanho]
+        )
+        if not linhas:
+            return 0
+        ids = [linha[0] for linha in linhas]
+        # O filtro de status repetido deixa o UPDATE idempotente
+        Agendamento.objects.filter(id__in=ids, status__in={linha[1] for linha in linhas}).update(
+            status=status_novo, data_atualizacao=timezone.now(),
+        )
+        # O update em lote não dispara os sinais: histórico, feed de sincronização
+        # e cache de disponibilidade são atualizados à mão
+        for agendamento_id, status_anterior, paciente_id, profissional_id in linhas:
+            registrar(agendamento_id, status_novo, de=status_anterior, origem=origem,
+                      destinatarios=(paciente_id, profissional_id))
+            registrar_alteracao('agendamento', agendamento_id, paciente_id, profissional_id)
+        profissionais = {linha[3] for linha in linhas if linha[3]}
+        transaction.on_commit(lambda: [invalidar_profissional(pid) for pid in profissionais])
+    return len(ids)
+
+
+class ComandoTransicaoLote(BaseCommand):
+    """
+    Base dos jobs de transição: a subclasse define `agendamentos(options)`,
+    `status_novo`, `origem` e a mensagem do total.
+    """
+    status_novo = None
+    origem = 'sistema'
+    mensagem = '{} agendamento(s) atualizado(s).'
+    intervalo_padrao = 300
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Agendamentos por transação.')
+        parser.add_argument('--loop', action='store_true', help='Continua rodando, a cada --intervalo segundos.')
+        parser.add_argument('--intervalo', type=int, default=self.intervalo_padrao,
+                            help='Segundos entre execuções no modo --loop.')
+
+    def agendamentos(self, options):
+        raise NotImplementedError
+
+    def executar(self, options):
+        agendamentos = self.agendamentos(options)
+        lote = max(1, options['lote'])
+        total = 0
+        while True:
+            feitos = transicionar_lote(agendamentos, self.status_novo, self.origem, lote)
+            total += feitos
+            if feitos < lote:
+                return total
+
+    def handle(self, *args, **options):
+        while True:
+            total = self.executar(options)
+            self.stdout.write(self.mensagem.format(total))
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
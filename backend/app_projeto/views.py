@@ -2,6 +2,7 @@
 # Imports padrão do Python
 import json
 import jwt
+import logging
 import mimetypes
 import os
 import re
@@ -10,17 +11,20 @@ import tempfile
 from datetime import datetime, timedelta, time, timezone
 
 # Imports do Django
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate, login, get_user_model
-from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import default_token_generator
 from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.mail import send_mail, EmailMultiAlternatives
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
-from django.http import JsonResponse, HttpResponseRedirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
@@ -39,7 +43,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.tokens import UntypedToken, RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
@@ -47,14 +51,31 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 import stripe
 
 # Imports locais
-from .models import Usuario, Endereco, Prontuario, Agendamento, AgendamentoHistorico, HorarioTrabalho, Avaliacao
+from .authentication import UsuarioPrincipal, decodificar_token, extrair_token, principal_do_token, usuario_da_requisicao
+from .availability import (
+    DISPONIBILIDADE_HTTP_MAX_AGE, DISPONIBILIDADE_MAX_DIAS, ROLE_POR_TIPO, disponibilidade, etag_dias, indice_proximo_livre,
+    invalidar_profissional,
+)
+from .cache_publico import em_cache, invalidar as invalidar_cache_publico
+from .carrossel import CARROSSEL_HTTP_MAX_AGE, obter_carrossel
+from .condicional import condicional, versao_queryset
+from .eventos import na_transacao, origem_eventos, registrar
+from .google_auth import verificar_id_token_google
+from .hashers import verificar_senha
+from .models import Usuario, Endereco, Prontuario, Agendamento, HorarioTrabalho, Avaliacao, AvaliacaoResumo
+from .pagination import PaginacaoKeyset
+from .revocation import revogar_token, revogar_tokens_do_usuario
+from . import notificacoes, sincronizacao
 from .permissions import IsAdmin, IsPaciente, IsPsicologo, IsPsiquiatra
 from .serializers import (
     MyTokenObtainPairSerializer, UsuarioSerializer, AgendamentoSerializer, 
-    EnderecoSerializer, UsuarioComEnderecoSerializer, ProntuarioSerializer, 
-    HorarioTrabalhoSerializer, AvaliacaoSerializer, AvaliacaoListSerializer
+    EnderecoSerializer, UsuarioComEnderecoSerializer, ProntuarioListSerializer,
+    HorarioTrabalhoSerializer, HorarioTrabalhoLoteSerializer, AvaliacaoSerializer, AvaliacaoListSerializer,
+    ProfissionalSerializer, estatisticas_avaliacoes,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def get_csrf_token(request):
     return JsonResponse({'csrfToken': get_token(request)})
@@ -154,8 +175,8 @@ def cadastrar_usuario(request):
                 tipo=data.get('tipo_endereco'),
             )
 
-        # Gera o token JWT para o novo usuário usando SimpleJWT
-        refresh = RefreshToken.for_user(usuario)
+        # Gera o token JWT para o novo usuário usando SimpleJWT (com as claims role/nome)
+        refresh = MyTokenObtainPairSerializer.get_token(usuario)
         token = str(refresh.access_token)
 
         # Retorna uma resposta de sucesso com o token JWT
@@ -177,10 +198,12 @@ def login_usuario(request):
         except Usuario.DoesNotExist:
             return JsonResponse({'error': 'Usuário não encontrado'}, status=404)
 
-        if check_password(password, usuario.senha):
+        # Hash antigo é regravado em background (fora da resposta)
+        if verificar_senha(usuario, password):
             if usuario.status.strip().lower() != 'ativo':
                 return JsonResponse({'error': 'Usuário inativo'}, status=403)
-            refresh = RefreshToken.for_user(usuario)
+            # Inclui role/nome no token para a autenticação não precisar consultar o banco
+            refresh = MyTokenObtainPairSerializer.get_token(usuario)
             token = str(refresh.access_token)
 
             response = JsonResponse({
@@ -214,34 +237,18 @@ def decode_jwt(token):
     
 @api_view(['GET'])
 def usuario_autenticado(request):
-    # Obtendo o token da cookie
-    token = request.COOKIES.get('jwt')
-    print("JWT Token recebido:", token)
-
-    if not token:
+    # O token da cookie já foi decodificado por JWTUsuarioAuthentication
+    if not request.COOKIES.get('jwt'):
         return Response({'error': 'Token JWT não encontrado'}, status=401)
 
-    try:
-        # Decodificando o token e verificando a assinatura e expiração
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"], options={"verify_exp": True})
-        print("Payload decodificado:", payload)
-
-        # Verificando se o 'user_id' (não 'sub') está no payload
-        user_id = payload.get('user_id')
-        if not user_id:
-            raise TokenError("Token não contém 'user_id'.")
-
-        # Buscando o usuário com o 'user_id'
-        usuario = Usuario.objects.get(id=user_id)
-        
-    except jwt.ExpiredSignatureError:
-        return Response({'error': 'Token expirado'}, status=401)
-    except jwt.InvalidTokenError:
+    principal = request.user
+    if not isinstance(principal, UsuarioPrincipal):
         return Response({'error': 'Token inválido'}, status=401)
-    except Usuario.DoesNotExist:
+
+    # Linha completa (para a foto) vem do cache de usuários
+    usuario = principal.usuario
+    if usuario is None:
         return Response({'error': 'Usuário não encontrado'}, status=404)
-    except TokenError as e:
-        return Response({'error': str(e)}, status=401)
 
     # Preparando a resposta
     response_data = {
@@ -321,6 +328,12 @@ class RedefinirSenhaAPIView(APIView):
         
 @csrf_exempt
 def logout(request):
+    # Revoga o token atual para que ele não continue valendo até expirar
+    token = extrair_token(request)
+    payload = decodificar_token(token) if token else None
+    if payload:
+        revogar_token(payload)
+
     response = JsonResponse({'message': 'Logout realizado com sucesso'})
     
     # Remover o cookie "jwt"
@@ -335,36 +348,57 @@ def logout(request):
 @api_view(['GET'])
 def listar_usuarios(request):
     usuarios = Usuario.objects.all()
+    # Usuario não tem data de criação: o cursor é só o id
+    pagina, erro = PaginacaoKeyset(campo=None).paginar(request, usuarios)
+    if erro:
+        return erro
+    if pagina:
+        return pagina.resposta(UsuarioSerializer(pagina.itens, many=True).data)
     serializer = UsuarioSerializer(usuarios, many=True)
     return Response(serializer.data)
 
 
 
+def _listar_profissionais(request, role):
+    # Resumo das avaliações vem no mesmo SELECT (LEFT JOIN em AvaliacaoResumo)
+    profissionais = Usuario.objects.filter(role=role).select_related('avaliacao_resumo')
+    # ?ordenar=avaliacao: maior média primeiro, quem não tem avaliação no fim
+    if request.GET.get('ordenar') == 'avaliacao':
+        profissionais = profissionais.annotate(
+            media_avaliacoes=AvaliacaoResumo.expressao_media('avaliacao_resumo__'),
+        ).order_by(
+            models.F('media_avaliacoes').desc(nulls_last=True),
+            models.F('avaliacao_resumo__total').desc(nulls_last=True),
+            'id',
+        )
+    return Response(ProfissionalSerializer(profissionais, many=True).data)
+
+
 @api_view(['GET'])
+@em_cache(lambda id=None: ['profissionais'])
 def listar_psiquiatras(request, id=None):
     if id:
         try:
             # Agora estamos filtrando apenas pelo role 'Psiquiatra'
-            psiquiatra = Usuario.objects.get(id=id, role='Psiquiatra')
-            serializer = UsuarioSerializer(psiquiatra)
+            psiquiatra = Usuario.objects.select_related('avaliacao_resumo').get(id=id, role='Psiquiatra')
+            serializer = ProfissionalSerializer(psiquiatra)
             return Response(serializer.data)
         except Usuario.DoesNotExist:
             return Response({"error": "Psiquiatra não encontrado"}, status=404)
     else:
         # Listando todos os usuários com o role 'Psiquiatra'
-        psiquiatras = Usuario.objects.filter(role='Psiquiatra')
-        serializer = UsuarioSerializer(psiquiatras, many=True)
-        return Response(serializer.data)
+        return _listar_profissionais(request, 'Psiquiatra')
     
 
 @api_view(['GET'])
+@em_cache(lambda id: ['profissionais'])
 def listar_psiquiatras_id(request, id):
     try:
-        psiquiatra = Usuario.objects.get(id=id, role='Psiquiatra')
+        psiquiatra = Usuario.objects.select_related('avaliacao_resumo').get(id=id, role='Psiquiatra')
     except Usuario.DoesNotExist:
         return Response({'error': 'Psiquiatra não encontrado'}, status=404)
 
-    serializer = UsuarioSerializer(psiquiatra)
+    serializer = ProfissionalSerializer(psiquiatra)
     return Response(serializer.data)
 
 
@@ -379,6 +413,8 @@ def editar_usuario(request, id):
         return JsonResponse(serializer.data, status=200)
 
     elif request.method == 'PUT':
+        status_anterior = usuario.status
+        role_anterior = usuario.role
         if request.content_type and request.content_type.startswith('multipart/form-data'):
             data = request.POST
             foto = request.FILES.get('foto')
@@ -415,6 +451,10 @@ def editar_usuario(request, id):
             # usuario.stripe_email = data.get('stripe_email', usuario.stripe_email)
             # usuario.stripe_account_id = data.get('stripe_account_id', usuario.stripe_account_id)
             usuario.save()
+            # Desativado ou com outro papel: derruba os tokens já emitidos, que
+            # carregam o papel antigo nas claims
+            if (usuario.status != 'ativo' and status_anterior == 'ativo') or usuario.role != role_anterior:
+                revogar_tokens_do_usuario(usuario.id)
             usuario.refresh_from_db()  # Garante que o path da foto está atualizado
             serializer = UsuarioComEnderecoSerializer(usuario)
             return JsonResponse(serializer.data, status=200)
@@ -451,6 +491,10 @@ def editar_usuario(request, id):
             else:
                 usuario.foto = data.get('foto', usuario.foto)
             usuario.save()
+            # Desativado ou com outro papel: derruba os tokens já emitidos, que
+            # carregam o papel antigo nas claims
+            if (usuario.status != 'ativo' and status_anterior == 'ativo') or usuario.role != role_anterior:
+                revogar_tokens_do_usuario(usuario.id)
             usuario.refresh_from_db()  # Garante que o path da foto está atualizado
             serializer = UsuarioComEnderecoSerializer(usuario)
             return JsonResponse(serializer.data, status=200)
@@ -462,8 +506,10 @@ def excluir_usuario(request, id):
     usuario = get_object_or_404(Usuario, id=id)
 
     if request.method == 'DELETE':
-        # Excluir o usuário
+        # Excluir o usuário e invalidar os tokens dele
+        usuario_id = usuario.id
         usuario.delete()
+        revogar_tokens_do_usuario(usuario_id)
         
         return JsonResponse({'message': 'Usuário excluído com sucesso'}, status=200)
 
@@ -523,21 +569,41 @@ class PacienteOnlyView(APIView):
 @api_view(['GET'])
 def listar_agendamentos(request):
     # Apenas admin pode ver todos os agendamentos
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     if usuario.role != 'Admin':
         return Response({'error': 'Apenas administradores podem ver todos os agendamentos.'}, status=403)
-    agendamentos = Agendamento.objects.all()
+    agendamentos = Agendamento.objects.select_related('usuario', 'psiquiatra', 'psicologo')
+    pagina, erro = PaginacaoKeyset('data_hora').paginar(request, agendamentos)
+    if erro:
+        return erro
+    if pagina:
+        return pagina.resposta(AgendamentoSerializer(pagina.itens, many=True).data)
     serializer = AgendamentoSerializer(agendamentos, many=True)
     return Response(serializer.data)
 
+def gerar_link_consulta():
+    # Gero um nome único para a sala (ex: consulta-<timestamp>-<randstr>)
+    nome_sala = f"consulta-{int(datetime.utcnow().timestamp())}-{get_random_string(6)}"
+    return f"https://meet.jit.si/{nome_sala}"
+
+
+def normalizar_inicio_slot(valor):
+    """
+    Converte a data_hora recebida (ISO, com ou sem fuso) para o início do slot
+    em UTC, no minuto cheio: é o valor que a restrição de unicidade compara.
+    Retorna None se não for uma data/hora válida.
+    """
+    inicio = parse_datetime(valor) if isinstance(valor, str) else None
+    if not inicio:
+        return None
+    # Se a datetime não tem timezone info, assume timezone local do servidor
+    if django_timezone.is_naive(inicio):
+        inicio = django_timezone.make_aware(inicio)
+    return inicio.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
 @api_view(['POST'])
 def criar_agendamento(request):
     """
@@ -545,72 +611,209 @@ def criar_agendamento(request):
     e salvo no campo link_consulta do agendamento.
     """
     data = request.data.copy()  # Faço uma cópia mutável dos dados recebidos
-    # Gero um nome único para a sala (ex: consulta-<timestamp>-<randstr>)
-    nome_sala = f"consulta-{int(datetime.utcnow().timestamp())}-{get_random_string(6)}"
-    url = f"https://meet.jit.si/{nome_sala}"
-    data['link_consulta'] = url
-    # Antes de criar, verifica se já existe agendamento no mesmo bloco de 30 minutos
+    data['link_consulta'] = gerar_link_consulta()
     try:
         data_hora = data.get('data_hora')
         if not data_hora:
             return Response({'error': 'data_hora é obrigatória.'}, status=400)
-        
-        # CORREÇÃO: Melhor tratamento de timezone
-        
-        # Tenta fazer parse da datetime
-        inicio = parse_datetime(data_hora)
-        if not inicio:
+
+        inicio_utc = normalizar_inicio_slot(data_hora)
+        if not inicio_utc:
             return Response({'error': 'data_hora inválida. Use formato ISO: YYYY-MM-DDTHH:MM:SS'}, status=400)
-        
-        # Se a datetime não tem timezone info, assume timezone local do servidor
-        if inicio.tzinfo is None:
-            local_tz = django_timezone.get_current_timezone()
-            inicio = local_tz.localize(inicio)
-        
-        # Converte para UTC para salvar no banco (padrão Django)
-        inicio_utc = inicio.astimezone(timezone.utc)
-        
-        fim = inicio_utc + timedelta(minutes=30)
 
         # Descobre profissional e campo correto
-        profissional_id = None
+        campo = None
         if data.get('psiquiatra'):
-            profissional_id = data.get('psiquiatra')
+            campo = 'psiquiatra'
             data['psicologo'] = None
         elif data.get('psicologo'):
-            profissional_id = data.get('psicologo')
+            campo = 'psicologo'
             data['psiquiatra'] = None
-        if not profissional_id:
+        if not campo:
             return Response({'error': 'Profissional não informado.'}, status=400)
 
-        # Busca conflitos (pendente ou confirmado)
-        conflito = Agendamento.objects.filter(
-            (Q(psiquiatra_id=profissional_id) | Q(psicologo_id=profissional_id)) &
-            Q(data_hora__lt=fim) & Q(data_hora__gte=inicio_utc) &
-            Q(status__in=['pendente', 'confirmado'])
-        ).exists()
-        if conflito:
-            return Response({'error': 'Já existe um agendamento neste horário ou bloco de 30 minutos.'}, status=400)
-            
         # Atualiza data_hora no dict com a versão UTC para salvar
         data['data_hora'] = inicio_utc.isoformat()
-        
+
     except Exception as e:
         return Response({'error': f'Erro ao validar conflito de horário: {str(e)}'}, status=400)
 
-    # Crio o agendamento normalmente, agora com o link_consulta preenchido
     serializer = AgendamentoSerializer(data=data)
-    if serializer.is_valid():
-        agendamento = serializer.save()
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # Adiciona histórico
-        AgendamentoHistorico.objects.create(
-            agendamento=agendamento,
-            status_anterior='pendente'
-        )
+    erro_conflito = Response({'error': 'Já existe um agendamento neste horário ou bloco de 30 minutos.'}, status=400)
+    intervalo = timedelta(minutes=30)
+    try:
+        # Transação curta: a checagem pega sobreposições de blocos de 30 min e a
+        # restrição única (profissional, slot_ativo) decide a corrida pelo mesmo slot.
+        # A checagem não trava nada: duas requisições simultâneas com inícios que se
+        # sobrepõem sem ser iguais (ex.: 10h00 e 10h15) ainda podem passar as duas.
+        with transaction.atomic():
+            conflito = Agendamento.objects.filter(
+                profissional_id=data[campo],
+                data_hora__gt=inicio_utc - intervalo,
+                data_hora__lt=inicio_utc + intervalo,
+                status__in=Agendamento.STATUS_OCUPAM_AGENDA,
+            ).exists()
+            if conflito:
+                return erro_conflito
+
+            # O evento de criação vai para o histórico pelo Agendamento.save()
+            serializer.save()
+    except IntegrityError:
+        return erro_conflito
+
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+AGENDAMENTO_LOTE_MAX = getattr(settings, 'AGENDAMENTO_LOTE_MAX', 26)
+
+
+@api_view(['POST'])
+def criar_agendamentos_lote(request):
+    """
+    Cria vários agendamentos do mesmo paciente com o mesmo profissional de uma vez.
+    Corpo: usuario, psiquiatra ou psicologo, observacoes (opcional), e
+      datas_hora: [ISO, ...]  ou  recorrencia: {data_hora: ISO, semanas: N, intervalo_dias: 7}
+    modo: 'tudo_ou_nada' (padrão: se um horário falha, nada é criado) ou 'parcial'
+    (cria os que estão livres). A resposta traz o resultado de cada ocorrência.
+    """
+    data = request.data
+    modo = data.get('modo', 'tudo_ou_nada')
+    if modo not in ('tudo_ou_nada', 'parcial'):
+        return Response({'error': "modo deve ser 'tudo_ou_nada' ou 'parcial'."}, status=400)
+
+    if data.get('psiquiatra'):
+        campo, profissional_id = 'psiquiatra', data.get('psiquiatra')
+    elif data.get('psicologo'):
+        campo, profissional_id = 'psicologo', data.get('psicologo')
+    else:
+        return Response({'error': 'Profissional não informado.'}, status=400)
+
+    # Ocorrências pedidas
+    recorrencia = data.get('recorrencia')
+    if recorrencia:
+        try:
+            semanas = int(recorrencia.get('semanas', 0))
+            intervalo_dias = int(recorrencia.get('intervalo_dias', 7))
+        except (TypeError, ValueError, AttributeError):
+            return Response({'error': 'recorrencia inválida.'}, status=400)
+        primeiro = normalizar_inicio_slot(recorrencia.get('data_hora'))
+        if not primeiro or semanas < 1 or intervalo_dias < 1:
+            return Response({'error': 'recorrencia precisa de data_hora, semanas >= 1 e intervalo_dias >= 1.'}, status=400)
+        # Soma dias no fuso local, para a consulta ficar no mesmo horário de parede
+        primeiro_local = localtime(primeiro)
+        pedidos = [
+            django_timezone.make_aware(datetime.combine(primeiro_local.date() + timedelta(days=intervalo_dias * n), primeiro_local.time()))
+            .astimezone(timezone.utc).isoformat()
+            for n in range(semanas)
+        ]
+    else:
+        pedidos = data.get('datas_hora')
+        if not isinstance(pedidos, list) or not pedidos:
+            return Response({'error': 'Informe datas_hora (lista) ou recorrencia.'}, status=400)
+    if len(pedidos) > AGENDAMENTO_LOTE_MAX:
+        return Response({'error': f'No máximo {AGENDAMENTO_LOTE_MAX} agendamentos por lote.'}, status=400)
+
+    try:
+        usuario_id, profissional_id = int(data.get('usuario')), int(profissional_id)
+    except (TypeError, ValueError):
+        return Response({'error': 'usuario e profissional devem ser ids.'}, status=400)
+    usuarios = dict(Usuario.objects.filter(id__in=[usuario_id, profissional_id]).values_list('id', 'role'))
+    if usuario_id not in usuarios:
+        return Response({'error': 'Paciente não encontrado.'}, status=400)
+    if usuarios.get(profissional_id) != campo.capitalize():
+        return Response({'error': 'Profissional não encontrado.'}, status=400)
+
+    # Valida cada ocorrência e as sobreposições entre elas
+    intervalo = timedelta(minutes=30)
+    resultados = []
+    validos = []
+    for valor in pedidos:
+        inicio = normalizar_inicio_slot(valor)
+        if not inicio:
+            resultados.append({'data_hora': valor, 'status': 'invalido', 'erro': 'data_hora inválida.'})
+        elif any(abs(inicio - outro) < intervalo for outro in validos):
+            resultados.append({'data_hora': valor, 'status': 'conflito', 'erro': 'Sobrepõe outra data do próprio lote.'})
+        else:
+            resultados.append({'data_hora': valor, 'status': None, 'inicio': inicio})
+            validos.append(inicio)
+
+    erro_conflito = 'Já existe um agendamento neste horário ou bloco de 30 minutos.'
+    livres = []
+    try:
+        # Checagem e gravação na mesma transação curta, como em criar_agendamento
+        with transaction.atomic():
+            # Uma query para os conflitos de todas as ocorrências
+            ocupados = []
+            if validos:
+                ocupados = list(Agendamento.objects.filter(
+                    profissional_id=profissional_id,
+                    data_hora__gt=min(validos) - intervalo,
+                    data_hora__lt=max(validos) + intervalo,
+                    status__in=Agendamento.STATUS_OCUPAM_AGENDA,
+                ).values_list('data_hora', flat=True))
+            for resultado in resultados:
+                if resultado['status'] is None and any(abs(resultado['inicio'] - o) < intervalo for o in ocupados):
+                    resultado.update(status='conflito', erro=erro_conflito)
+
+            livres = [r for r in resultados if r['status'] is None]
+            falhou = len(livres) < len(resultados)
+            if not livres or (falhou and modo == 'tudo_ou_nada'):
+                return _resposta_lote(modo, resultados, status=400)
+
+            for resultado in livres:
+                resultado['link_consulta'] = gerar_link_consulta()
+            novos = [
+                Agendamento(
+                    usuario_id=usuario_id, profissional_id=profissional_id, **{f'{campo}_id': profissional_id},
+                    data_hora=r['inicio'], status='pendente', link_consulta=r['link_consulta'],
+                    observacoes=data.get('observacoes'),
+                )
+                for r in livres
+            ]
+            # No modo parcial, um horário tomado por outra requisição nesse meio
+            # tempo (restrição única) é ignorado em vez de derrubar o lote todo
+            Agendamento.objects.bulk_create(novos, ignore_conflicts=(modo == 'parcial'))
+            # bulk_create nem sempre devolve os ids (MySQL): busca pelos links, que são únicos
+            criados = dict(Agendamento.objects.filter(
+                link_consulta__in=[r['link_consulta'] for r in livres]
+            ).values_list('link_consulta', 'id'))
+            # bulk_create não passa pelo save(): registra as criações à mão,
+            # num bulk_create só dentro desta transação
+            with na_transacao('lote'):
+                for agendamento_id in criados.values():
+                    registrar(agendamento_id, 'pendente', destinatarios=(usuario_id, profissional_id))
+                    sincronizacao.registrar('agendamento', agendamento_id, usuario_id, profissional_id)
+            transaction.on_commit(lambda: invalidar_profissional(profissional_id))
+    except IntegrityError:
+        for resultado in livres:
+            resultado.update(status='conflito', erro=erro_conflito)
+        return _resposta_lote(modo, resultados, status=400)
+
+    agendamentos = Agendamento.objects.filter(id__in=criados.values()).select_related('usuario', 'psiquiatra', 'psicologo')
+    serializados = {a['link_consulta']: a for a in AgendamentoSerializer(agendamentos, many=True).data}
+    for resultado in livres:
+        if resultado['link_consulta'] in serializados:
+            resultado.update(status='criado', agendamento=serializados[resultado['link_consulta']])
+        else:
+            resultado.update(status='conflito', erro=erro_conflito)
+    return _resposta_lote(modo, resultados, status=201)
+
+
+def _resposta_lote(modo, resultados, status):
+    itens = []
+    for r in resultados:
+        item = {'data_hora': r['inicio'].isoformat() if r.get('inicio') else r['data_hora'], 'status': r['status'] or 'nao_criado'}
+        if r.get('erro'):
+            item['erro'] = r['erro']
+        if r.get('agendamento'):
+            item['agendamento'] = r['agendamento']
+        itens.append(item)
+    criados = sum(1 for item in itens if item['status'] == 'criado')
+    return Response({'modo': modo, 'criados': criados, 'resultados': itens}, status=status)
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['PUT'])
 def atualizar_agendamento(request, id):
@@ -619,19 +822,11 @@ def atualizar_agendamento(request, id):
     except Agendamento.DoesNotExist:
         return Response({"error": "Agendamento não encontrado"}, status=404)
 
-    status_anterior = agendamento.status
     serializer = AgendamentoSerializer(agendamento, data=request.data)
 
     if serializer.is_valid():
+        # Mudança de status vai para o histórico pelo Agendamento.save()
         serializer.save()
-
-        # Registra no histórico se o status mudou
-        if request.data.get("status") and request.data.get("status") != status_anterior:
-            AgendamentoHistorico.objects.create(
-                agendamento=agendamento,
-                status_anterior=status_anterior
-            )
-
         return Response(serializer.data)
     return Response(serializer.errors, status=400)
 
@@ -651,12 +846,15 @@ def google_login_view(request):
         data = json.loads(request.body)
         token = data.get("token")
 
-        # Validar o token com o Google
-        google_response = requests.get(f"https://www.googleapis.com/oauth2/v3/tokeninfo?id_token={token}")
-        if google_response.status_code != 200:
+        # Valida o token localmente com as chaves públicas do Google (em cache)
+        try:
+            user_data = verificar_id_token_google(token)
+        except jwt.InvalidTokenError:
             return JsonResponse({"error": "Token inválido"}, status=400)
+        except ImproperlyConfigured as e:
+            logger.error('Login com Google recusado: %s', e)
+            return JsonResponse({"error": "Login com Google indisponível"}, status=503)
 
-        user_data = google_response.json()
         email = user_data.get("email")
         name = user_data.get("name")
 
@@ -704,24 +902,24 @@ def enderecos_usuario(request, usuario_id):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@em_cache(lambda id: [f'usuario:{id}'])
 def detalhar_usuario(request, id):
     usuario = get_object_or_404(Usuario, id=id)
     serializer = UsuarioComEnderecoSerializer(usuario)
     return Response(serializer.data)
 
 @api_view(['GET'])
+@em_cache(lambda id=None: ['profissionais'])
 def listar_psicologos(request, id=None):
     if id:
         try:
-            psicologo = Usuario.objects.get(id=id, role='Psicologo')
-            serializer = UsuarioSerializer(psicologo)
+            psicologo = Usuario.objects.select_related('avaliacao_resumo').get(id=id, role='Psicologo')
+            serializer = ProfissionalSerializer(psicologo)
             return Response(serializer.data)
         except Usuario.DoesNotExist:
             return Response({"error": "Psicólogo não encontrado"}, status=404)
     else:
-        psicologos = Usuario.objects.filter(role='Psicologo')
-        serializer = UsuarioSerializer(psicologos, many=True)
-        return Response(serializer.data)
+        return _listar_profissionais(request, 'Psicologo')
 
 
 import stripe
@@ -730,6 +928,7 @@ from django.conf import settings
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 @csrf_exempt
+@origem_eventos('checkout')
 def criar_pagamento_stripe(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Método não permitido'}, status=405)
@@ -850,18 +1049,107 @@ def criar_pagamento_stripe(request):
         return JsonResponse({'error': str(e)}, status=400)
 
 
+# Campos buscados (com JOIN) para as listagens de agendamentos: uma única query
+CAMPOS_LISTAGEM_AGENDAMENTO = [
+    'id', 'data_hora', 'status', 'observacoes', 'link_consulta',
+    'valor_recebido_profissional', 'valor_plataforma',
+    'usuario_id', 'usuario__nome', 'usuario__email', 'usuario__telefone',
+    'usuario__cpf', 'usuario__status', 'usuario__role',
+]
+CAMPOS_PROFISSIONAL = ['id', 'nome', 'email', 'telefone', 'role', 'crm', 'crp', 'especialidade', 'valor_consulta']
+
+
+def filtrar_agendamentos(request, agendamentos):
+    """
+    Filtros opcionais das listagens de agendamento (query string):
+    status=paga,confirmado | data_inicio=AAAA-MM-DD | data_fim=AAAA-MM-DD | proximos=true
+    As datas são do fuso local e viram um intervalo [inicio, fim) em data_hora.
+    Retorna (queryset, None) ou (None, Response 400).
+    """
+    status_param = request.GET.get('status')
+    if status_param:
+        agendamentos = agendamentos.filter(status__in=[s.strip() for s in status_param.split(',') if s.strip()])
+
+    local_tz = django_timezone.get_current_timezone()
+    data_inicio = request.GET.get('data_inicio')
+    if data_inicio:
+        dia = parse_date(data_inicio)
+        if not dia:
+            return None, Response({'error': 'data_inicio inválida. Use AAAA-MM-DD.'}, status=400)
+        agendamentos = agendamentos.filter(data_hora__gte=datetime.combine(dia, time.min, tzinfo=local_tz))
+    data_fim = request.GET.get('data_fim')
+    if data_fim:
+        dia = parse_date(data_fim)
+        if not dia:
+            return None, Response({'error': 'data_fim inválida. Use AAAA-MM-DD.'}, status=400)
+        agendamentos = agendamentos.filter(data_hora__lt=datetime.combine(dia + timedelta(days=1), time.min, tzinfo=local_tz))
+
+    if request.GET.get('proximos', '').lower() in ('1', 'true', 'sim'):
+        agendamentos = agendamentos.filter(data_hora__gte=django_timezone.now())
+    return agendamentos, None
+
+
+def projetar_agendamentos_lista(agendamentos, incluir_profissional=False):
+    """Projeção values() com JOIN em paciente (e profissional): uma query, sem N+1."""
+    campos = list(CAMPOS_LISTAGEM_AGENDAMENTO)
+    if incluir_profissional:
+        campos += ['profissional_id'] + [f'profissional__{c}' for c in CAMPOS_PROFISSIONAL[1:]]
+    return agendamentos.values(*campos)
+
+
+def formatar_agendamentos_lista(linhas, incluir_profissional=False):
+    """Monta o payload das listagens a partir da projeção, no formato antigo dos campos."""
+    local_tz = django_timezone.get_current_timezone()
+    data = []
+    for ag in linhas:
+        # Converte para o timezone local uma vez e deriva data/hora do ISO
+        data_hora_iso = ag['data_hora'].astimezone(local_tz).isoformat() if ag['data_hora'] else ''
+        item = {
+            'id': ag['id'],
+            'paciente': {
+                'id': ag['usuario_id'],
+                'nome': ag['usuario__nome'],
+                'email': ag['usuario__email'],
+                'telefone': ag['usuario__telefone'],
+                'cpf': ag['usuario__cpf'],
+                'status': ag['usuario__status'],
+                'role': ag['usuario__role'],
+            },
+        }
+        if incluir_profissional:
+            profissional_dict = None
+            if ag['profissional_id']:
+                profissional_dict = {'id': ag['profissional_id']}
+                for campo in CAMPOS_PROFISSIONAL[1:]:
+                    profissional_dict[campo] = ag[f'profissional__{campo}']
+                profissional_dict['valor_consulta'] = str(profissional_dict['valor_consulta'])
+            item['profissional'] = profissional_dict
+        valor_profissional = float(ag['valor_recebido_profissional']) if ag['valor_recebido_profissional'] is not None else 0.0
+        item.update({
+            # CORREÇÃO: Usar apenas data_hora no formato ISO com timezone
+            'data_hora': data_hora_iso,
+            # Manter campos legados para compatibilidade
+            'data_iso': data_hora_iso,
+            'data': data_hora_iso[:10],
+            'hora': data_hora_iso[11:16],
+            'status': ag['status'],
+            'observacao': ag['observacoes'] or '',
+            'link_consulta': ag['link_consulta'] or '',
+        })
+        if incluir_profissional:
+            item['valor_pago_profissional'] = valor_profissional
+        else:
+            item['valor_recebido_profissional'] = valor_profissional
+        item['valor_plataforma'] = float(ag['valor_plataforma']) if ag['valor_plataforma'] is not None else 0.0
+        data.append(item)
+    return data
+
+
 @api_view(['GET'])
 def listar_agendamentos_profissional(request):
-    # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     if usuario.role == 'Admin':
         tipo = request.GET.get('tipo')
         if tipo == 'psiquiatra':
@@ -870,55 +1158,24 @@ def listar_agendamentos_profissional(request):
             agendamentos = Agendamento.objects.filter(psicologo__isnull=False)
         else:
             agendamentos = Agendamento.objects.all()
-    elif usuario.role == 'Psiquiatra':
-        agendamentos = Agendamento.objects.filter(psiquiatra=usuario)
-    elif usuario.role == 'Psicologo':
-        agendamentos = Agendamento.objects.filter(psicologo=usuario)
+    elif usuario.role in ('Psiquiatra', 'Psicologo'):
+        agendamentos = Agendamento.objects.filter(profissional_id=usuario.id)
     else:
         return Response({'error': 'Apenas profissionais ou admin podem acessar suas consultas.'}, status=403)
-    data = []
-    for ag in agendamentos:
-        paciente = ag.usuario
-        # Garante que a data/hora seja convertida para o timezone local do servidor
-        data_hora_local = localtime(ag.data_hora) if ag.data_hora else None
-        data.append({
-            'id': ag.id,
-            'paciente': {
-                'id': paciente.id,
-                'nome': paciente.nome,
-                'email': paciente.email,
-                'telefone': paciente.telefone,
-                'cpf': paciente.cpf,
-                'status': paciente.status,
-                'role': paciente.role,
-            },
-            # CORREÇÃO: Usar apenas data_hora no formato ISO com timezone
-            'data_hora': data_hora_local.isoformat() if data_hora_local else '',
-            # Manter campos legados para compatibilidade
-            'data_iso': data_hora_local.isoformat() if data_hora_local else '',
-            'data': data_hora_local.strftime('%Y-%m-%d') if data_hora_local else '',
-            'hora': data_hora_local.strftime('%H:%M') if data_hora_local else '',
-            'status': ag.status,
-            'observacao': ag.observacoes or '',
-            'link_consulta': ag.link_consulta or '',
-            'valor_recebido_profissional': float(ag.valor_recebido_profissional) if ag.valor_recebido_profissional is not None else 0.0,
-            'valor_plataforma': float(ag.valor_plataforma) if ag.valor_plataforma is not None else 0.0,
-        })
-    return Response(data)
-
-
-@api_view(['GET'])
-def listar_agendamentos_paciente(request):
-    # Busca o usuário logado via JWT manualmente (igual ao de profissional)
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    agendamentos, erro = filtrar_agendamentos(request, agendamentos)
+    if erro:
+        return erro
+    linhas = projetar_agendamentos_lista(agendamentos)
+    pagina, erro = PaginacaoKeyset('data_hora').paginar(request, linhas)
+    if erro:
+        return erro
+    if pagina:
+        return pagina.resposta(formatar_agendamentos_lista(pagina.itens))
+    return Response(formatar_agendamentos_lista(linhas.order_by('id')))
+
+
+def _agendamentos_paciente(request, usuario):
+    """Agendamentos visíveis em listar_agendamentos_paciente, já filtrados. Retorna (queryset, erro)."""
     if usuario.role == 'Admin':
         tipo = request.GET.get('tipo')
         if tipo == 'psiquiatra':
@@ -928,51 +1185,119 @@ def listar_agendamentos_paciente(request):
         else:
             agendamentos = Agendamento.objects.all()
     else:
-        agendamentos = Agendamento.objects.filter(usuario=usuario)
-    data = []
-    for ag in agendamentos:
-        paciente = ag.usuario
-        profissional = ag.psiquiatra if ag.psiquiatra else ag.psicologo
-        profissional_dict = None
-        if profissional:
-            profissional_dict = {
-                'id': profissional.id,
-                'nome': profissional.nome,
-                'email': profissional.email,
-                'telefone': profissional.telefone,
-                'role': profissional.role,
-                'crm': getattr(profissional, 'crm', None),
-                'crp': getattr(profissional, 'crp', None),
-                'especialidade': getattr(profissional, 'especialidade', None),
-                'valor_consulta': str(getattr(profissional, 'valor_consulta', '')),
-            }
-        data_hora_local = localtime(ag.data_hora) if ag.data_hora else None
-        # Sempre incluir os campos de valor, independente do tipo de usuário
-        data.append({
-            'id': ag.id,
-            'paciente': {
-                'id': paciente.id,
-                'nome': paciente.nome,
-                'email': paciente.email,
-                'telefone': paciente.telefone,
-                'cpf': paciente.cpf,
-                'status': paciente.status,
-                'role': paciente.role,
-            },
-            'profissional': profissional_dict,
-            # CORREÇÃO: Usar apenas data_hora no formato ISO com timezone
-            'data_hora': data_hora_local.isoformat() if data_hora_local else '',
-            # Manter campos legados para compatibilidade
-            'data_iso': data_hora_local.isoformat() if data_hora_local else '',
-            'data': data_hora_local.strftime('%Y-%m-%d') if data_hora_local else '',
-            'hora': data_hora_local.strftime('%H:%M') if data_hora_local else '',
-            'status': ag.status,
-            'observacao': ag.observacoes or '',
-            'link_consulta': ag.link_consulta or '',
-            'valor_pago_profissional': float(ag.valor_recebido_profissional) if ag.valor_recebido_profissional is not None else 0.0,
-            'valor_plataforma': float(ag.valor_plataforma) if ag.valor_plataforma is not None else 0.0,
-        })
-    return Response(data)
+        agendamentos = Agendamento.objects.filter(usuario_id=usuario.id)
+    return filtrar_agendamentos(request, agendamentos)
+
+
+def _versao_agendamentos_paciente(usuario, request):
+    agendamentos, erro = _agendamentos_paciente(request, usuario)
+    if erro:
+        return None
+    return versao_queryset(
+        agendamentos, 'data_atualizacao', 'usuario__data_atualizacao', 'profissional__data_atualizacao',
+    )
+
+
+@api_view(['GET'])
+@condicional(_versao_agendamentos_paciente)
+def listar_agendamentos_paciente(request):
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+    agendamentos, erro = _agendamentos_paciente(request, usuario)
+    if erro:
+        return erro
+    # Sempre incluir os campos de valor, independente do tipo de usuário
+    linhas = projetar_agendamentos_lista(agendamentos, incluir_profissional=True)
+    pagina, erro = PaginacaoKeyset('data_hora').paginar(request, linhas)
+    if erro:
+        return erro
+    if pagina:
+        return pagina.resposta(formatar_agendamentos_lista(pagina.itens, incluir_profissional=True))
+    return Response(formatar_agendamentos_lista(linhas.order_by('id'), incluir_profissional=True))
+
+@api_view(['GET'])
+def listar_alteracoes(request):
+    """
+    Feed de sincronização: agendamentos, prontuários e avaliações do usuário
+    criados, alterados ou removidos depois do cursor (ver sincronizacao.py).
+    Sem cursor, devolve só o cursor atual: o cliente guarda esse cursor e
+    então carrega as listagens completas.
+    """
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        return Response({'cursor': sincronizacao.cursor_atual(), 'mais': False})
+    try:
+        sequencia = sincronizacao.decodificar_cursor(cursor)
+    except ValueError:
+        return Response({'error': 'cursor inválido.'}, status=400)
+    ultima, mais, alterados, removidos = sincronizacao.ler(usuario, sequencia)
+
+    agendamentos = Agendamento.objects.all()
+    if usuario.role != 'Admin':
+        agendamentos = agendamentos.filter(Q(usuario_id=usuario.id) | Q(profissional_id=usuario.id))
+    linhas = list(projetar_agendamentos_lista(
+        agendamentos.filter(id__in=alterados['agendamento']).order_by('id'), incluir_profissional=True,
+    )) if alterados['agendamento'] else []
+    consultas = list(ProntuarioListSerializer.otimizar_queryset(
+        agendamentos.filter(prontuario__id__in=alterados['prontuario'])
+    )) if alterados['prontuario'] else []
+    avaliacoes = list(
+        Avaliacao.objects.filter(id__in=alterados['avaliacao'], agendamento__in=agendamentos)
+        .select_related('avaliador', 'agendamento__usuario', 'agendamento__psiquiatra', 'agendamento__psicologo')
+    ) if alterados['avaliacao'] else []
+
+    # Alterado mas não encontrado: removido depois (a marca vem adiante) ou não
+    # é mais visível ao usuário; nos dois casos o cliente descarta
+    encontrados = {
+        'agendamento': {linha['id'] for linha in linhas},
+        'prontuario': {ag.prontuario.id for ag in consultas},
+        'avaliacao': {avaliacao.id for avaliacao in avaliacoes},
+    }
+    for modelo, ids in alterados.items():
+        removidos[modelo] += [objeto_id for objeto_id in ids if objeto_id not in encontrados[modelo]]
+
+    return Response({
+        'cursor': sincronizacao.codificar_cursor(ultima),
+        'mais': mais,
+        'agendamentos': formatar_agendamentos_lista(linhas, incluir_profissional=True),
+        'prontuarios': ProntuarioListSerializer([Prontuario.do_agendamento(ag) for ag in consultas], many=True).data,
+        'avaliacoes': AvaliacaoSerializer(avaliacoes, many=True).data,
+        'removidos': {f'{modelo}s': ids for modelo, ids in removidos.items()},
+    })
+
+
+async def stream_notificacoes(request):
+    """
+    Stream SSE das mudanças de status dos agendamentos do usuário logado
+    (eventos pago, cancelado, estornado, concluido e status; ver notificacoes.py).
+    Uma conexão parada por aba substitui o polling das listagens. Depois de
+    reconectar, o cliente recupera o que perdeu por /api/alteracoes/.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método não permitido.'}, status=405)
+    # No WSGI um stream infinito prenderia o worker: o cliente fica no polling
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Notificações em tempo real só no servidor ASGI.'}, status=503)
+    token = extrair_token(request)
+    usuario = await sync_to_async(principal_do_token)(token)
+    if usuario is None:
+        return JsonResponse({'error': 'Não autenticado.'}, status=401)
+
+    @sync_to_async
+    def valido():
+        return principal_do_token(token) is not None
+
+    # A conexão acaba com o token: no exp dele ou no heartbeat depois da revogação
+    fluxo = notificacoes.fluxo(usuario.id, expira_em=usuario.payload.get('exp'), valido=valido)
+    resposta = StreamingHttpResponse(fluxo, content_type='text/event-stream')
+    resposta['Cache-Control'] = 'no-cache'
+    resposta['X-Accel-Buffering'] = 'no'  # nginx: não acumular o stream
+    return resposta
+
 
 @api_view(['GET'])
 def detalhar_agendamento(request, id):
@@ -984,135 +1309,165 @@ def detalhar_agendamento(request, id):
     return Response(serializer.data)
 
 
-@api_view(['GET'])
-def horarios_ocupados(request):
+def _buscar_profissional(profissional_id, tipo):
+    """Devolve (profissional, erro)."""
+    profissional = Usuario.objects.filter(id=profissional_id, role__iexact=tipo.capitalize()).only('id', 'nome').first()
+    if not profissional:
+        return None, Response({'error': 'Profissional não encontrado.'}, status=404)
+    return profissional, None
+
+
+def _disponibilidade_do_dia(request):
+    """
+    Valida profissional_id/tipo/data e devolve (profissional, DiaDisponibilidade, erro).
+    """
     profissional_id = request.GET.get('profissional_id')
     tipo = request.GET.get('tipo')
     data_str = request.GET.get('data')
     if not profissional_id or not tipo or not data_str:
-        return Response({'error': 'profissional_id, tipo e data são obrigatórios.'}, status=400)
+        return None, None, Response({'error': 'profissional_id, tipo e data são obrigatórios.'}, status=400)
     try:
         data = parse_date(data_str)
         if not data:
             raise ValueError
     except Exception:
-        return Response({'error': 'Data inválida.'}, status=400)
-    
-    from .models import Agendamento, Usuario
-    from datetime import timedelta
-    
-    profissional = Usuario.objects.filter(id=profissional_id, role__iexact=tipo.capitalize()).first()
-    if not profissional:
-        return Response({'error': 'Profissional não encontrado.'}, status=404)
-    
-    # Busca agendamentos confirmados ou pendentes para o dia
-    if tipo == 'psiquiatra':
-        ags = Agendamento.objects.filter(psiquiatra=profissional, data_hora__date=data, status__in=['pendente', 'confirmado', 'paga'])
-    else:
-        ags = Agendamento.objects.filter(psicologo=profissional, data_hora__date=data, status__in=['pendente', 'confirmado', 'paga'])
+        return None, None, Response({'error': 'Data inválida.'}, status=400)
 
-    # Coleta horários ocupados pelos agendamentos
-    horarios_ocupados = set()
-    intervalo = timedelta(minutes=30)
-    for ag in ags:
-        inicio = ag.data_hora
-        fim = inicio + intervalo
-        atual = inicio
-        while atual < fim:
-            horarios_ocupados.add(atual.strftime('%H:%M'))
-            atual += intervalo
+    profissional, erro = _buscar_profissional(profissional_id, tipo)
+    if erro:
+        return None, None, erro
+    return profissional, disponibilidade.dia(profissional.id, data), None
 
-    horarios = sorted(horarios_ocupados)
-    return Response(horarios)
+
+@api_view(['GET'])
+def horarios_ocupados(request):
+    _, dia, erro = _disponibilidade_do_dia(request)
+    if erro:
+        return erro
+    return Response(dia.horarios_ocupados())
 
 
 @api_view(['GET'])
 def horarios_disponiveis(request):
     """
     Nova API que retorna horários disponíveis baseados nos horários de trabalho cadastrados
+    (ou no horário fixo antigo, 8h às 17h30, nos dias sem horário cadastrado)
+    """
+    profissional, dia, erro = _disponibilidade_do_dia(request)
+    if erro:
+        return erro
+    return Response({
+        'horarios_disponiveis': dia.horarios_disponiveis(),
+        'usando_horarios_fixos': dia.usando_horarios_fixos,
+        'profissional_nome': profissional.nome
+    })
+
+@api_view(['GET'])
+def horarios_disponiveis_intervalo(request):
+    """
+    Horários disponíveis de vários dias (semana/mês do calendário) numa chamada só.
+    Parâmetros: profissional_id, tipo, inicio e fim (datas YYYY-MM-DD, inclusive).
     """
     profissional_id = request.GET.get('profissional_id')
     tipo = request.GET.get('tipo')
-    data_str = request.GET.get('data')
-    if not profissional_id or not tipo or not data_str:
-        return Response({'error': 'profissional_id, tipo e data são obrigatórios.'}, status=400)
-    
+    inicio_str = request.GET.get('inicio')
+    fim_str = request.GET.get('fim')
+    if not profissional_id or not tipo or not inicio_str or not fim_str:
+        return Response({'error': 'profissional_id, tipo, inicio e fim são obrigatórios.'}, status=400)
     try:
-        data = parse_date(data_str)
-        if not data:
+        inicio = parse_date(inicio_str)
+        fim = parse_date(fim_str)
+        if not inicio or not fim:
             raise ValueError
     except Exception:
         return Response({'error': 'Data inválida.'}, status=400)
-    
-    profissional = Usuario.objects.filter(id=profissional_id, role__iexact=tipo.capitalize()).first()
-    if not profissional:
-        return Response({'error': 'Profissional não encontrado.'}, status=404)
-    
-    # Busca agendamentos confirmados ou pendentes para o dia
-    if tipo == 'psiquiatra':
-        ags = Agendamento.objects.filter(psiquiatra=profissional, data_hora__date=data, status__in=['pendente', 'confirmado', 'paga'])
+    if fim < inicio:
+        return Response({'error': 'fim deve ser igual ou posterior a inicio.'}, status=400)
+    total_dias = (fim - inicio).days + 1
+    if total_dias > DISPONIBILIDADE_MAX_DIAS:
+        return Response({'error': f'O intervalo pode ter no máximo {DISPONIBILIDADE_MAX_DIAS} dias.'}, status=400)
+
+    profissional, erro = _buscar_profissional(profissional_id, tipo)
+    if erro:
+        return erro
+
+    datas = [inicio + timedelta(days=i) for i in range(total_dias)]
+    dias = disponibilidade.dias(profissional.id, datas)
+    etag = etag_dias(profissional.id, (dias[d] for d in datas))
+
+    if etag in request.headers.get('If-None-Match', ''):
+        resposta = Response(status=304)
     else:
-        ags = Agendamento.objects.filter(psicologo=profissional, data_hora__date=data, status__in=['pendente', 'confirmado', 'paga'])
+        resposta = Response({
+            'profissional_nome': profissional.nome,
+            'dias': [
+                {
+                    'data': d.isoformat(),
+                    'horarios_disponiveis': dias[d].horarios_disponiveis(),
+                    'usando_horarios_fixos': dias[d].usando_horarios_fixos,
+                }
+                for d in datas
+            ],
+        })
+    resposta['ETag'] = etag
+    resposta['Cache-Control'] = f'public, max-age={DISPONIBILIDADE_HTTP_MAX_AGE}'
+    return resposta
 
-    # Coleta horários ocupados pelos agendamentos
-    horarios_ocupados = set()
-    intervalo = timedelta(minutes=30)
-    for ag in ags:
-        inicio = ag.data_hora
-        fim = inicio + intervalo
-        atual = inicio
-        while atual < fim:
-            horarios_ocupados.add(atual.strftime('%H:%M'))
-            atual += intervalo
-
-    # Busca horários de trabalho do profissional para o dia da semana
-    dia_semana = data.weekday()  # Segunda = 0, Domingo = 6
-    horarios_trabalho = HorarioTrabalho.objects.filter(
-        profissional=profissional,
-        dia_semana=dia_semana,
-        ativo=True
-    )
-    
-    # Se não tem horários de trabalho cadastrados, usa horários fixos antigos (8h às 17h30)
-    if not horarios_trabalho.exists():
-        horarios_disponiveis = []
-        for i in range(20):  # 8h às 17h30 = 20 slots de 30 min
-            hour = 8 + i // 2
-            minute = 30 if i % 2 == 1 else 0
-            horario_str = f"{hour:02d}:{minute:02d}"
-            if horario_str not in horarios_ocupados:
-                horarios_disponiveis.append(horario_str)
-        
-        return Response({
-            'horarios_disponiveis': horarios_disponiveis,
-            'usando_horarios_fixos': True,
-            'profissional_nome': profissional.nome
+@api_view(['GET'])
+def buscar_horarios_livres(request):
+    """
+    Busca entre todos os profissionais de um tipo (psicologo/psiquiatra):
+      - sem inicio/fim: os `limite` horários livres mais cedo (padrão 10, máximo 50);
+      - com inicio e fim (data/hora ISO): quem tem horário livre nessa janela.
+    """
+    tipo = request.GET.get('tipo')
+    if tipo not in ROLE_POR_TIPO:
+        return Response({'error': 'tipo deve ser psicologo ou psiquiatra.'}, status=400)
+
+    inicio_str = request.GET.get('inicio')
+    fim_str = request.GET.get('fim')
+    if inicio_str or fim_str:
+        inicio = parse_datetime(inicio_str or '')
+        fim = parse_datetime(fim_str or '')
+        if not inicio or not fim:
+            return Response({'error': 'inicio e fim devem ser data/hora ISO: YYYY-MM-DDTHH:MM.'}, status=400)
+        if django_timezone.is_naive(inicio):
+            inicio = django_timezone.make_aware(inicio)
+        if django_timezone.is_naive(fim):
+            fim = django_timezone.make_aware(fim)
+        if fim <= inicio:
+            return Response({'error': 'fim deve ser posterior a inicio.'}, status=400)
+        if (fim - inicio).days >= DISPONIBILIDADE_MAX_DIAS:
+            return Response({'error': f'A janela pode ter no máximo {DISPONIBILIDADE_MAX_DIAS} dias.'}, status=400)
+        livres = indice_proximo_livre.livres_entre(tipo, inicio, fim)
+        nomes = dict(Usuario.objects.filter(id__in=livres).values_list('id', 'nome'))
+        resultados = [
+            {
+                'profissional_id': pid,
+                'profissional_nome': nomes.get(pid),
+                'horarios': [localtime(slot).isoformat() for slot in slots],
+            }
+            for pid, slots in sorted(livres.items(), key=lambda item: (item[1][0], item[0]))
+        ]
+        return Response({'resultados': resultados})
+
+    try:
+        limite = max(1, min(int(request.GET.get('limite', 10)), 50))
+    except ValueError:
+        return Response({'error': 'limite deve ser um número inteiro.'}, status=400)
+    slots = indice_proximo_livre.primeiros_livres(tipo, limite)
+    nomes = dict(Usuario.objects.filter(id__in={pid for _, pid in slots}).values_list('id', 'nome'))
+    resultados = []
+    for slot, pid in slots:
+        local = localtime(slot)
+        resultados.append({
+            'profissional_id': pid,
+            'profissional_nome': nomes.get(pid),
+            'data_hora': local.isoformat(),
+            'data': local.strftime('%Y-%m-%d'),
+            'hora': local.strftime('%H:%M'),
         })
-    
-    # Gera horários disponíveis baseados nos horários de trabalho cadastrados
-    horarios_disponiveis = []
-    for horario_trabalho in horarios_trabalho:
-        inicio = horario_trabalho.horario_inicio
-        fim = horario_trabalho.horario_fim
-        
-        # Gera slots de 30 em 30 minutos dentro do período de trabalho
-        atual = datetime.combine(data, inicio)
-        fim_datetime = datetime.combine(data, fim)
-        
-        while atual < fim_datetime:
-            horario_str = atual.strftime('%H:%M')
-            if horario_str not in horarios_ocupados:
-                horarios_disponiveis.append(horario_str)
-            atual += intervalo
-    
-    # Remove duplicatas e ordena
-    horarios_disponiveis = sorted(list(set(horarios_disponiveis)))
-    
-    return Response({
-        'horarios_disponiveis': horarios_disponiveis,
-        'usando_horarios_fixos': False,
-        'profissional_nome': profissional.nome
-    })
+    return Response({'resultados': resultados})
 
 @csrf_exempt
 def upload_foto_usuario(request, id):
@@ -1144,66 +1499,87 @@ def upload_foto_usuario(request, id):
 
 # Listar prontuários conforme o papel do usuário autenticado (padrão das outras views)
 
-@api_view(['GET'])
-def listar_prontuarios(request):
-    # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
-
-    if usuario.role == 'Psiquiatra':
-        prontuarios = Prontuario.objects.filter(agendamento__psiquiatra=usuario)
-    elif usuario.role == 'Psicologo':
-        prontuarios = Prontuario.objects.filter(agendamento__psicologo=usuario)
+def _agendamentos_prontuarios(usuario):
+    # Prontuários são criados na primeira escrita: a listagem parte das consultas
+    # e mostra um prontuário virtual vazio para as que ainda não têm um
+    if usuario.role in ('Psiquiatra', 'Psicologo'):
+        agendamentos = Agendamento.objects.filter(profissional_id=usuario.id)
     elif usuario.role == 'Admin':
-        prontuarios = Prontuario.objects.all()
+        agendamentos = Agendamento.objects.all()
     elif usuario.role == 'Paciente':
-        prontuarios = Prontuario.objects.filter(agendamento__usuario=usuario)
+        agendamentos = Agendamento.objects.filter(usuario_id=usuario.id)
     else:
-        prontuarios = Prontuario.objects.none()
-    serializer = ProntuarioSerializer(prontuarios, many=True)
-    return Response(serializer.data)
+        agendamentos = Agendamento.objects.none()
+    # Consulta cancelada sem prontuário gravado não tem o que mostrar
+    return agendamentos.exclude(status='cancelado', prontuario__isnull=True)
 
 
-@csrf_exempt
-@api_view(['GET', 'PATCH'])
-def prontuario_detalhe_editar(request, id):
-    # Autenticação manual via JWT (igual padrão)
-    token = request.COOKIES.get('jwt')
-    if not token:
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header.startswith('Bearer '):
-            possible_token = auth_header.replace('Bearer ', '').strip()
-            if possible_token and possible_token.lower() != 'null':
-                token = possible_token
-    if not token or token.lower() == 'null':
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+def _versao_prontuarios(usuario, request):
+    return versao_queryset(
+        _agendamentos_prontuarios(usuario), 'data_atualizacao', 'prontuario__data_atualizacao',
+        'usuario__data_atualizacao', 'profissional__data_atualizacao',
+    )
 
-    # Busca o prontuário
+
+@api_view(['GET'])
+@condicional(_versao_prontuarios)
+def listar_prontuarios(request):
+    # Busca o usuário logado via JWT manualmente
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+
+    agendamentos = _agendamentos_prontuarios(usuario)
+    # Listagem usa a representação enxuta (uma query); o detalhe continua com ProntuarioSerializer
+    agendamentos = ProntuarioListSerializer.otimizar_queryset(agendamentos)
+    pagina, erro = PaginacaoKeyset('data_criacao').paginar(request, agendamentos)
+    if erro:
+        return erro
+    if pagina:
+        prontuarios = [Prontuario.do_agendamento(ag) for ag in pagina.itens]
+        return pagina.resposta(ProntuarioListSerializer(prontuarios, many=True).data)
+    prontuarios = [Prontuario.do_agendamento(ag) for ag in agendamentos.order_by('id')]
+    return Response(ProntuarioListSerializer(prontuarios, many=True).data)
+
+
+def _buscar_prontuario(usuario, id=None, agendamento_id=None, sem_permissao='Sem permissão para acessar este prontuário.'):
+    """
+    Resolve o prontuário pelo id dele (rotas antigas) ou pelo id da consulta
+    (devolve o virtual se ainda não foi gravado) e checa o acesso do usuário.
+    Retorna (prontuario, erro).
+    """
+    agendamentos = Agendamento.objects.select_related('usuario', 'psiquiatra', 'psicologo', 'prontuario')
     try:
-        prontuario = Prontuario.objects.get(id=id)
-    except Prontuario.DoesNotExist:
-        return Response({'error': 'Prontuário não encontrado.'}, status=404)
+        if agendamento_id is not None:
+            prontuario = Prontuario.do_agendamento(agendamentos.get(id=agendamento_id))
+        else:
+            prontuario = Prontuario.objects.select_related(
+                'agendamento__usuario', 'agendamento__psiquiatra', 'agendamento__psicologo'
+            ).get(id=id)
+    except (Agendamento.DoesNotExist, Prontuario.DoesNotExist):
+        return None, Response({'error': 'Prontuário não encontrado.'}, status=404)
 
-    # Só psiquiatra do agendamento ou admin pode editar/ver
     if usuario.role == 'Psiquiatra' and prontuario.agendamento.psiquiatra_id != usuario.id:
-        return Response({'error': 'Sem permissão para acessar este prontuário.'}, status=403)
+        return None, Response({'error': sem_permissao}, status=403)
     if usuario.role == 'Psicologo' and prontuario.agendamento.psicologo_id != usuario.id:
-        return Response({'error': 'Sem permissão para acessar este prontuário.'}, status=403)
+        return None, Response({'error': sem_permissao}, status=403)
     if usuario.role not in ['Psiquiatra', 'Admin', 'Psicologo']:
-        return Response({'error': 'Sem permissão.'}, status=403)
+        return None, Response({'error': 'Sem permissão.'}, status=403)
+    return prontuario, None
+
+
+@csrf_exempt
+@api_view(['GET', 'PATCH'])
+def prontuario_detalhe_editar(request, id=None, agendamento_id=None):
+    # Autenticação manual via JWT (igual padrão)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+
+    # Busca o prontuário; só o profissional do agendamento ou admin pode editar/ver
+    prontuario, erro = _buscar_prontuario(usuario, id, agendamento_id)
+    if erro:
+        return erro
 
     if request.method == 'GET':
         # Serializa com dados do paciente e agendamento, incluindo mensagem_paciente
@@ -1215,6 +1591,8 @@ def prontuario_detalhe_editar(request, id):
             'receita_pdf': prontuario.receita_pdf.url if prontuario.receita_pdf else None,
             'data_criacao': prontuario.data_criacao,
             'data_atualizacao': prontuario.data_atualizacao,
+            # True enquanto ninguém escreveu no prontuário (ainda não existe no banco)
+            'virtual': prontuario.virtual,
             'paciente': {
                 'id': prontuario.agendamento.usuario.id,
                 'nome': prontuario.agendamento.usuario.nome,
@@ -1249,51 +1627,38 @@ def prontuario_detalhe_editar(request, id):
             nova_mensagem = body.get('mensagem_paciente', '').strip()
             if not novo_texto:
                 return Response({'error': 'O texto do prontuário não pode ser vazio.'}, status=400)
-            prontuario.texto = novo_texto
-            prontuario.mensagem_paciente = nova_mensagem
-            prontuario.save()
-            return Response({'success': 'Prontuário atualizado com sucesso.'})
+            if prontuario.virtual:
+                # Primeira escrita cria o prontuário; update_or_create trata duas
+                # gravações simultâneas na mesma consulta
+                prontuario, _ = Prontuario.objects.update_or_create(
+                    agendamento=prontuario.agendamento,
+                    defaults={'texto': novo_texto, 'mensagem_paciente': nova_mensagem},
+                )
+            else:
+                prontuario.texto = novo_texto
+                prontuario.mensagem_paciente = nova_mensagem
+                prontuario.save()
+            return Response({'success': 'Prontuário atualizado com sucesso.', 'id': prontuario.id})
         except Exception as e:
             return Response({'error': f'Erro ao atualizar prontuário: {str(e)}'}, status=400)
 
 
 @csrf_exempt
 @api_view(['POST'])
-def baixar_pdf_prontuario(request, id):
+def baixar_pdf_prontuario(request, id=None, agendamento_id=None):
     """
     Baixa um PDF de um link e salva no prontuário
     """
     # Autenticação manual via JWT
-    token = request.COOKIES.get('jwt')
-    if not token:
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header.startswith('Bearer '):
-            possible_token = auth_header.replace('Bearer ', '').strip()
-            if possible_token and possible_token.lower() != 'null':
-                token = possible_token
-    if not token or token.lower() == 'null':
-        return Response({'error': 'Não autenticado.'}, status=401)
-    
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
-
-    # Busca o prontuário
-    try:
-        prontuario = Prontuario.objects.get(id=id)
-    except Prontuario.DoesNotExist:
-        return Response({'error': 'Prontuário não encontrado.'}, status=404)
-    
-    # Verificar se o usuário tem permissão (deve ser o psiquiatra da consulta)
-    if usuario.role == 'Psiquiatra' and prontuario.agendamento.psiquiatra_id != usuario.id:
-        return Response({'error': 'Você não tem permissão para editar este prontuário'}, status=403)
-    if usuario.role == 'Psicologo' and prontuario.agendamento.psicologo_id != usuario.id:
-        return Response({'error': 'Você não tem permissão para editar este prontuário'}, status=403)
-    if usuario.role not in ['Psiquiatra', 'Admin', 'Psicologo']:
-        return Response({'error': 'Sem permissão.'}, status=403)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+
+    # Busca o prontuário e verifica se o usuário tem permissão (deve ser o profissional da consulta)
+    prontuario, erro = _buscar_prontuario(
+        usuario, id, agendamento_id, 'Você não tem permissão para editar este prontuário')
+    if erro:
+        return erro
     
     try:
         link_pdf = request.data.get('link_pdf', '').strip()
@@ -1413,6 +1778,10 @@ def baixar_pdf_prontuario(request, id):
             
             # Salvar o arquivo
             arquivo_content = ContentFile(response.content, name=nome_arquivo)
+
+            if prontuario.virtual:
+                # Primeira escrita: grava o prontuário só agora que há o que guardar
+                prontuario, _ = Prontuario.objects.get_or_create(agendamento=prontuario.agendamento)
             
             if tipo == 'atestado':
                 # Remover arquivo anterior se existir
@@ -1450,41 +1819,20 @@ def baixar_pdf_prontuario(request, id):
 
 @csrf_exempt
 @api_view(['POST'])
-def enviar_prontuario_email(request, id):
+def enviar_prontuario_email(request, id=None, agendamento_id=None):
     """
     Envia os PDFs do prontuário e a mensagem para o email do paciente
     """
     # Autenticação manual via JWT
-    token = request.COOKIES.get('jwt')
-    if not token:
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header.startswith('Bearer '):
-            possible_token = auth_header.replace('Bearer ', '').strip()
-            if possible_token and possible_token.lower() != 'null':
-                token = possible_token
-    if not token or token.lower() == 'null':
-        return Response({'error': 'Não autenticado.'}, status=401)
-    
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
-
-    # Busca o prontuário
-    try:
-        prontuario = Prontuario.objects.get(id=id)
-    except Prontuario.DoesNotExist:
-        return Response({'error': 'Prontuário não encontrado.'}, status=404)
-    
-    # Verificar se o usuário tem permissão (deve ser o profissional da consulta)
-    if usuario.role == 'Psiquiatra' and prontuario.agendamento.psiquiatra_id != usuario.id:
-        return Response({'error': 'Você não tem permissão para enviar este prontuário'}, status=403)
-    if usuario.role == 'Psicologo' and prontuario.agendamento.psicologo_id != usuario.id:
-        return Response({'error': 'Você não tem permissão para enviar este prontuário'}, status=403)
-    if usuario.role not in ['Psiquiatra', 'Admin', 'Psicologo']:
-        return Response({'error': 'Sem permissão.'}, status=403)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+
+    # Busca o prontuário e verifica se o usuário tem permissão (deve ser o profissional da consulta)
+    prontuario, erro = _buscar_prontuario(
+        usuario, id, agendamento_id, 'Você não tem permissão para enviar este prontuário')
+    if erro:
+        return erro
     
     try:
         import mimetypes
@@ -1656,6 +2004,7 @@ def enviar_prontuario_email(request, id):
         return Response({'error': f'Erro ao enviar email: {str(e)}'}, status=500)
         
 @csrf_exempt
+@origem_eventos('webhook')
 def stripe_webhook(request):
     
     payload = request.body
@@ -1749,17 +2098,16 @@ def criar_stripe_connect_account(request, id=None):
     O usuário deve estar autenticado e ser profissional (Psiquiatra ou Psicologo).
     Agora também checa se a capability 'transfers' está habilitada.
     """
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
+    principal, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+    if principal.role not in ['Psiquiatra', 'Psicologo']:
+        return Response({'error': 'Apenas profissionais podem criar conta Stripe Connect.'}, status=403)
+    # Esta view grava no usuário, então busca a linha atual no banco (não a do cache)
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
+        usuario = Usuario.objects.get(id=principal.id)
+    except Usuario.DoesNotExist:
         return Response({'error': 'Usuário não autenticado.'}, status=401)
-    if usuario.role not in ['Psiquiatra', 'Psicologo']:
-        return Response({'error': 'Apenas profissionais podem criar conta Stripe Connect.'}, status=403)
     # Se já tem conta Stripe, retorna status detalhado
     if usuario.stripe_account_id:
         try:
@@ -1821,17 +2169,14 @@ def status_connect_account(request, id=None):
     Retorna o status da conta Stripe Connect do profissional autenticado.
     Se transfers não estiver ativo, retorna o link de onboarding.
     """
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
-    if usuario.role not in ['Psiquiatra', 'Psicologo']:
+    principal, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+    if principal.role not in ['Psiquiatra', 'Psicologo']:
         return Response({'error': 'Apenas profissionais podem consultar status Stripe Connect.'}, status=403)
+    usuario = principal.usuario
+    if usuario is None:
+        return Response({'error': 'Usuário não autenticado.'}, status=401)
     if not usuario.stripe_account_id:
         return Response({
             'stripe_account_id': None,
@@ -1864,6 +2209,7 @@ def status_connect_account(request, id=None):
     
 @csrf_exempt
 @api_view(["POST"])
+@origem_eventos('estorno')
 def estornar_pagamento_stripe(request, agendamento_id):
     """
     Realiza o estorno (refund) do pagamento Stripe referente ao agendamento.
@@ -1997,7 +2343,16 @@ def estornar_pagamento_stripe(request, agendamento_id):
 
 # REGION HORARIOS DE TRABALHO
 
+def _versao_horarios_trabalho(usuario, request):
+    if usuario.role not in ['Psiquiatra', 'Psicologo']:
+        return None
+    return versao_queryset(
+        HorarioTrabalho.objects.filter(profissional_id=usuario.id), 'data_atualizacao', 'profissional__data_atualizacao',
+    )
+
+
 @api_view(['GET', 'POST', 'PUT'])
+@condicional(_versao_horarios_trabalho)
 def horarios_trabalho_profissional(request):
     """
     GET: Lista horários de trabalho do profissional logado
@@ -2005,23 +2360,16 @@ def horarios_trabalho_profissional(request):
     PUT: Atualiza horários de trabalho em lote (substitui todos os horários)
     """
     # Busca o usuário logado via JWT
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
     # Verifica se é um profissional
     if usuario.role not in ['Psiquiatra', 'Psicologo']:
         return Response({'error': 'Apenas profissionais podem gerenciar horários de trabalho.'}, status=403)
     
     if request.method == 'GET':
-        horarios = HorarioTrabalho.objects.filter(profissional=usuario).order_by('dia_semana', 'horario_inicio')
+        horarios = HorarioTrabalho.objects.filter(profissional_id=usuario.id).order_by('dia_semana', 'horario_inicio')
         serializer = HorarioTrabalhoSerializer(horarios, many=True)
         return Response(serializer.data)
     
@@ -2040,38 +2388,69 @@ def horarios_trabalho_profissional(request):
         
         if not isinstance(horarios_data, list):
             return Response({'error': 'Campo "horarios" deve ser uma lista.'}, status=400)
-        
-        # Remove todos os horários existentes do profissional
-        HorarioTrabalho.objects.filter(profissional=usuario).delete()
-        
-        # Cria os novos horários
-        novos_horarios = []
+
+        # Valida tudo antes de tocar no banco
+        enviados = {}
         erros = []
-        
         for i, horario_data in enumerate(horarios_data):
-            horario_data_copy = horario_data.copy()
-            horario_data_copy['profissional'] = usuario.id
-            
-            serializer = HorarioTrabalhoSerializer(data=horario_data_copy)
-            if serializer.is_valid():
-                novos_horarios.append(serializer.save())
-            else:
-                erros.append({
-                    'indice': i,
-                    'erro': serializer.errors
-                })
-        
+            serializer = HorarioTrabalhoLoteSerializer(data=horario_data)
+            if not serializer.is_valid():
+                erros.append({'indice': i, 'erro': serializer.errors})
+                continue
+            item = serializer.validated_data
+            chave = (item['dia_semana'], item['horario_inicio'], item['horario_fim'])
+            if chave in enviados:
+                erros.append({'indice': i, 'erro': 'Horário repetido na lista.'})
+                continue
+            enviados[chave] = (i, item['ativo'])
+
+        # Intervalos ativos do mesmo dia não podem se sobrepor
+        dia_anterior, fim_anterior = None, None
+        for (dia, inicio, fim), i in sorted((chave, i) for chave, (i, ativo) in enviados.items() if ativo):
+            if dia == dia_anterior and inicio < fim_anterior:
+                erros.append({'indice': i, 'erro': 'Horário sobrepõe outro intervalo do mesmo dia.'})
+            if dia != dia_anterior or fim > fim_anterior:
+                dia_anterior, fim_anterior = dia, fim
+
         if erros:
-            # Se houve erros, remove os horários criados e retorna erro
-            for horario in novos_horarios:
-                horario.delete()
             return Response({
                 'error': 'Erro ao validar horários.',
                 'detalhes': erros
             }, status=400)
-        
-        # Retorna os horários criados
-        serializer = HorarioTrabalhoSerializer(novos_horarios, many=True)
+
+        # Aplica só a diferença, numa transação: a agenda nunca fica vazia no meio
+        agora = django_timezone.now()
+        with transaction.atomic():
+            existentes = {
+                (h.dia_semana, h.horario_inicio, h.horario_fim): h
+                for h in HorarioTrabalho.objects.select_for_update().filter(profissional_id=usuario.id)
+            }
+            remover = [h.id for chave, h in existentes.items() if chave not in enviados]
+            criar = [
+                HorarioTrabalho(profissional_id=usuario.id, dia_semana=chave[0], horario_inicio=chave[1],
+                                horario_fim=chave[2], ativo=ativo)
+                for chave, (_, ativo) in enviados.items() if chave not in existentes
+            ]
+            alterar = []
+            for chave, (_, ativo) in enviados.items():
+                horario = existentes.get(chave)
+                if horario is not None and horario.ativo != ativo:
+                    horario.ativo = ativo
+                    horario.data_atualizacao = agora
+                    alterar.append(horario)
+
+            if remover:
+                HorarioTrabalho.objects.filter(id__in=remover).delete()
+            if alterar:
+                HorarioTrabalho.objects.bulk_update(alterar, ['ativo', 'data_atualizacao'])
+            if criar:
+                HorarioTrabalho.objects.bulk_create(criar)
+            # bulk_create/bulk_update não disparam os sinais do modelo
+            transaction.on_commit(lambda: invalidar_profissional(usuario.id))
+            invalidar_cache_publico(f'horarios:{usuario.id}')
+
+        horarios = HorarioTrabalho.objects.filter(profissional_id=usuario.id).select_related('profissional')
+        serializer = HorarioTrabalhoSerializer(horarios.order_by('dia_semana', 'horario_inicio'), many=True)
         return Response({
             'message': 'Horários atualizados com sucesso.',
             'horarios': serializer.data
@@ -2086,16 +2465,9 @@ def horario_trabalho_detalhe(request, id):
     DELETE: Exclui horário de trabalho
     """
     # Busca o usuário logado via JWT
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
     try:
         horario = HorarioTrabalho.objects.get(id=id)
@@ -2103,7 +2475,7 @@ def horario_trabalho_detalhe(request, id):
         return Response({'error': 'Horário de trabalho não encontrado.'}, status=404)
     
     # Verifica se o horário pertence ao usuário logado ou se é admin
-    if horario.profissional != usuario and usuario.role != 'Admin':
+    if horario.profissional_id != usuario.id and usuario.role != 'Admin':
         return Response({'error': 'Você não tem permissão para acessar este horário.'}, status=403)
     
     if request.method == 'GET':
@@ -2123,6 +2495,7 @@ def horario_trabalho_detalhe(request, id):
 
 
 @api_view(['GET'])
+@em_cache(lambda profissional_id: [f'usuario:{profissional_id}', f'horarios:{profissional_id}'])
 def horarios_trabalho_profissional_publico(request, profissional_id):
     """
     Lista horários de trabalho de um profissional específico (acesso público para agendamentos)
@@ -2151,19 +2524,15 @@ def criar_avaliacao(request):
     print(f"DEBUG: Dados recebidos: {request.data}")
     
     # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-        # Adiciona o usuário ao context para o serializer
-        request.user = usuario
-        print(f"DEBUG: Usuário autenticado: {usuario.nome} (ID: {usuario.id})")
-    except Exception as e:
-        print(f"DEBUG: Erro de autenticação: {e}")
+    principal, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
+    usuario = principal.usuario
+    if usuario is None:
         return Response({'error': 'Usuário não autenticado.'}, status=401)
+    # Adiciona o usuário ao context para o serializer
+    request.user = usuario
+    print(f"DEBUG: Usuário autenticado: {usuario.nome} (ID: {usuario.id})")
     
     serializer = AvaliacaoSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
@@ -2174,23 +2543,31 @@ def criar_avaliacao(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _versao_avaliacoes_usuario(usuario, request):
+    return versao_queryset(
+        Avaliacao.objects.filter(avaliador_id=usuario.id), 'data_atualizacao', 'avaliador__data_atualizacao',
+        'agendamento__data_atualizacao', 'agendamento__usuario__data_atualizacao',
+        'agendamento__profissional__data_atualizacao',
+    )
+
+
 @api_view(['GET'])
+@condicional(_versao_avaliacoes_usuario)
 def listar_avaliacoes_usuario(request):
     """
     Lista avaliações feitas pelo usuário autenticado
     """
     # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
-    avaliacoes = Avaliacao.objects.filter(avaliador=usuario).order_by('-data_criacao')
+    avaliacoes = Avaliacao.objects.filter(avaliador_id=usuario.id).order_by('-data_criacao')
+    pagina, erro = PaginacaoKeyset('data_criacao', decrescente=True).paginar(request, avaliacoes)
+    if erro:
+        return erro
+    if pagina:
+        return pagina.resposta(AvaliacaoSerializer(pagina.itens, many=True).data)
     serializer = AvaliacaoSerializer(avaliacoes, many=True)
     return Response(serializer.data)
 
@@ -2201,15 +2578,9 @@ def listar_avaliacoes_agendamento(request, agendamento_id):
     Lista avaliações de um agendamento específico
     """
     # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
     try:
         agendamento = Agendamento.objects.get(id=agendamento_id)
@@ -2218,7 +2589,7 @@ def listar_avaliacoes_agendamento(request, agendamento_id):
     
     # Verifica se o usuário tem permissão para ver as avaliações deste agendamento
     # Admin tem acesso total, outros usuários apenas aos seus próprios agendamentos
-    if usuario.role != 'Admin' and usuario not in [agendamento.usuario, agendamento.psiquiatra, agendamento.psicologo]:
+    if usuario.role != 'Admin' and usuario.id not in [agendamento.usuario_id, agendamento.profissional_id]:
         return Response({'error': 'Sem permissão para ver as avaliações deste agendamento.'}, status=403)
     
     avaliacoes = Avaliacao.objects.filter(agendamento=agendamento)
@@ -2227,45 +2598,37 @@ def listar_avaliacoes_agendamento(request, agendamento_id):
 
 
 @api_view(['GET'])
+@em_cache(lambda profissional_id: [f'usuario:{profissional_id}', f'avaliacoes:{profissional_id}'])
 def listar_avaliacoes_profissional(request, profissional_id):
     """
     Lista avaliações recebidas por um profissional (acesso público)
     """
     try:
-        profissional = Usuario.objects.get(id=profissional_id, role__in=['Psiquiatra', 'Psicologo'])
+        profissional = Usuario.objects.select_related('avaliacao_resumo').get(
+            id=profissional_id, role__in=['Psiquiatra', 'Psicologo'])
     except Usuario.DoesNotExist:
         return Response({'error': 'Profissional não encontrado.'}, status=404)
     
-    # Busca agendamentos onde o profissional esteve envolvido
-    agendamentos = Agendamento.objects.filter(
-        models.Q(psiquiatra=profissional) | models.Q(psicologo=profissional),
-        status='Concluida'
-    )
-    
-    # Busca avaliações desses agendamentos feitas por pacientes
+    # Avaliações feitas por pacientes nas consultas concluídas do profissional
     avaliacoes = Avaliacao.objects.filter(
-        agendamento__in=agendamentos,
+        agendamento__profissional=profissional,
+        agendamento__status='Concluida',
         tipo_avaliador='paciente'
-    ).order_by('-data_criacao')
+    ).select_related('avaliador', 'agendamento').order_by('-data_criacao')
     
-    serializer = AvaliacaoListSerializer(avaliacoes, many=True)
+    pagina, erro = PaginacaoKeyset('data_criacao', decrescente=True).paginar(request, avaliacoes)
+    if erro:
+        return erro
+    serializer = AvaliacaoListSerializer(pagina.itens if pagina else avaliacoes, many=True)
     
-    # Calcula estatísticas das avaliações
-    if avaliacoes.exists():
-        notas = [av.nota for av in avaliacoes]
-        media_avaliacoes = sum(notas) / len(notas)
-        total_avaliacoes = len(notas)
-    else:
-        media_avaliacoes = 0
-        total_avaliacoes = 0
-    
-    return Response({
+    # Estatísticas vêm do agregado mantido a cada avaliação (AvaliacaoResumo)
+    resposta = {
         'avaliacoes': serializer.data,
-        'estatisticas': {
-            'media_avaliacoes': round(media_avaliacoes, 1),
-            'total_avaliacoes': total_avaliacoes
-        }
-    })
+        'estatisticas': estatisticas_avaliacoes(profissional),
+    }
+    if pagina:
+        resposta.update(pagina.metadados())
+    return Response(resposta)
 
 
 @api_view(['GET'])
@@ -2274,62 +2637,16 @@ def listar_melhores_avaliacoes(request):
     Lista as melhores avaliações (nota >= 4) de todos os profissionais
     Para usar no carrossel da página inicial
     """
-    
-    # Busca avaliações de pacientes com nota >= 4 e que tenham comentário
-    avaliacoes = Avaliacao.objects.filter(
-        nota__gte=4,
-        tipo_avaliador='paciente',
-        comentario__isnull=False
-    ).exclude(
-        comentario__exact=''
-    ).exclude(
-        comentario__exact=' '
-    ).order_by('-nota', '-data_criacao')[:20]  # Limita a 20 melhores avaliações
-    
-    data = []
-    for avaliacao in avaliacoes:
-        # Determina o nome do profissional
-        profissional = None
-        if avaliacao.agendamento.psiquiatra:
-            profissional = avaliacao.agendamento.psiquiatra
-        elif avaliacao.agendamento.psicologo:
-            profissional = avaliacao.agendamento.psicologo
-        
-        if profissional:
-            # Determina o tipo do profissional
-            tipo_profissional = None
-            if avaliacao.agendamento.psiquiatra:
-                tipo_profissional = 'Psiquiatra'
-            elif avaliacao.agendamento.psicologo:
-                tipo_profissional = 'Psicólogo'
-            
-            # Corrigir caminho da foto (remover /media/ duplicado se existir)
-            avaliador_foto_url = None
-            if avaliacao.avaliador.foto:
-                avaliador_foto_url = avaliacao.avaliador.foto.url
-                if avaliador_foto_url.startswith('/media/media/'):
-                    avaliador_foto_url = avaliador_foto_url.replace('/media/media/', '/media/', 1)
-            
-            profissional_foto_url = None
-            if profissional.foto:
-                profissional_foto_url = profissional.foto.url
-                if profissional_foto_url.startswith('/media/media/'):
-                    profissional_foto_url = profissional_foto_url.replace('/media/media/', '/media/', 1)
-            
-            data.append({
-                'id': avaliacao.id,
-                'nota': avaliacao.nota,
-                'comentario': avaliacao.comentario,
-                'data_criacao': avaliacao.data_criacao.isoformat(),
-                'avaliador_nome': avaliacao.avaliador.nome,
-                'avaliador_foto': avaliador_foto_url,
-                'profissional_nome': profissional.nome,
-                'profissional_foto': profissional_foto_url,
-                'profissional_tipo': tipo_profissional,
-                'tipo_avaliador_display': avaliacao.get_tipo_avaliador_display()
-            })
-    
-    return Response(data)
+    # Payload pronto (JSON + ETag) no cache; só vai ao banco depois de uma
+    # avaliação elegível mudar (ver carrossel.py)
+    carrossel = obter_carrossel()
+    if carrossel['etag'] in request.headers.get('If-None-Match', ''):
+        resposta = HttpResponse(status=304)
+    else:
+        resposta = HttpResponse(carrossel['corpo'], content_type='application/json')
+    resposta['ETag'] = carrossel['etag']
+    resposta['Cache-Control'] = f'public, max-age={CARROSSEL_HTTP_MAX_AGE}'
+    return resposta
 
 
 @api_view(['GET', 'PUT', 'DELETE'])
@@ -2338,15 +2655,9 @@ def detalhes_avaliacao(request, avaliacao_id):
     Visualiza, edita ou exclui uma avaliação específica
     """
     # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
     try:
         avaliacao = Avaliacao.objects.get(id=avaliacao_id)
@@ -2354,7 +2665,7 @@ def detalhes_avaliacao(request, avaliacao_id):
         return Response({'error': 'Avaliação não encontrada.'}, status=404)
     
     # Verifica se o usuário tem permissão para acessar esta avaliação
-    if avaliacao.avaliador != usuario:
+    if avaliacao.avaliador_id != usuario.id:
         return Response({'error': 'Sem permissão para acessar esta avaliação.'}, status=403)
     
     if request.method == 'GET':
@@ -2379,15 +2690,9 @@ def pode_avaliar_agendamento(request, agendamento_id):
     Verifica se o usuário pode avaliar um agendamento específico
     """
     # Busca o usuário logado via JWT manualmente
-    token = request.COOKIES.get('jwt') or request.headers.get('Authorization', '').replace('Bearer ', '')
-    if not token:
-        return Response({'error': 'Não autenticado.'}, status=401)
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = payload.get('user_id')
-        usuario = Usuario.objects.get(id=user_id)
-    except Exception:
-        return Response({'error': 'Usuário não autenticado.'}, status=401)
+    usuario, erro = usuario_da_requisicao(request)
+    if erro:
+        return erro
     
     try:
         agendamento = Agendamento.objects.get(id=agendamento_id)
@@ -2395,20 +2700,20 @@ def pode_avaliar_agendamento(request, agendamento_id):
         return Response({'error': 'Agendamento não encontrado.'}, status=404)
     
     # Verifica se o usuário está relacionado ao agendamento
-    if usuario not in [agendamento.usuario, agendamento.psiquiatra, agendamento.psicologo]:
+    if usuario.id not in [agendamento.usuario_id, agendamento.profissional_id]:
         return Response({'pode_avaliar': False, 'motivo': 'Usuário não relacionado ao agendamento'})
     # Verifica se a consulta foi concluída
     if agendamento.status != 'Concluida':
         return Response({'pode_avaliar': False, 'motivo': 'Consulta ainda não foi concluída'})
     # Define o tipo de avaliador
-    if usuario == agendamento.usuario:
+    if usuario.id == agendamento.usuario_id:
         tipo_avaliador = 'paciente'
     else:
         tipo_avaliador = 'profissional'
     # Verifica se já existe avaliação do usuário para este agendamento
     avaliacao_existente = Avaliacao.objects.filter(
         agendamento=agendamento,
-        avaliador=usuario,
+        avaliador_id=usuario.id,
         tipo_avaliador=tipo_avaliador
     ).exists()
     if avaliacao_existente:
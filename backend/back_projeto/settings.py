@@ -117,6 +117,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Grava os eventos de status de Agendamento da requisição num lote só
+    'app_projeto.middlewares.EventosAgendamentoMiddleware',
 
     #'app_projeto.middlewares.JWTAuthenticationMiddleware',
     # 'app_projeto.middleware.TokenAuthMiddleware',  # Comente temporariamente
@@ -125,10 +127,88 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # Usa JWT
+        # Decodifica o JWT (cookie ou Bearer) uma vez e monta o usuário a partir das claims
+        'app_projeto.authentication.JWTUsuarioAuthentication',
     ),
 }
 
+# Paginação por cursor das listagens (app_projeto/pagination.py). Enquanto o
+# frontend migra, a lista completa continua sendo o padrão; `?paginado=true`
+# (ou `cursor`/`limite`) ativa a paginação e `?paginado=false` força a lista completa.
+PAGINACAO_PADRAO = False
+PAGINACAO_LIMITE_PADRAO = 50
+PAGINACAO_LIMITE_MAX = 200
+
+# Cache de linhas de Usuario por processo (usado pela autenticação JWT)
+USUARIO_CACHE_MAX = 1024
+USUARIO_CACHE_TTL = 300  # segundos
+
+# Login com Google: ID tokens verificados localmente com o JWKS (URL configurável para testes)
+GOOGLE_JWKS_URL = os.getenv('GOOGLE_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')  # obrigatório para o login com Google (valida o 'aud')
+
+# Revogação de JWT: intervalo de sincronização do espelho local com o banco
+REVOGACAO_REFRESH_SEGUNDOS = 5
+# Sobreposição da leitura incremental (commits fora de ordem) e recarga completa periódica
+REVOGACAO_JANELA_SEGUNDOS = 60
+REVOGACAO_RECARGA_SEGUNDOS = 600
+
+# Motor de disponibilidade: cache por processo das agendas dos profissionais
+DISPONIBILIDADE_CACHE_MAX = 512
+DISPONIBILIDADE_CACHE_TTL = 60  # segundos
+DISPONIBILIDADE_JANELA_DIAS = 7  # dias de agendamentos buscados por query
+DISPONIBILIDADE_MAX_DIAS = 62  # tamanho máximo do intervalo em horarios_disponiveis/intervalo
+DISPONIBILIDADE_HTTP_MAX_AGE = 30  # segundos de Cache-Control nas respostas de intervalo
+DISPONIBILIDADE_BUSCA_DIAS = 30  # horizonte da busca de horário livre entre profissionais
+DISPONIBILIDADE_MEMBROS_TTL = 300  # segundos até recarregar a lista de profissionais da busca
+
+# Expiração de agendamentos 'pendente' abandonados (`manage.py expirar_agendamentos_pendentes`)
+AGENDAMENTO_PENDENTE_TTL_MINUTOS = 30  # sem sessão de checkout do Stripe
+AGENDAMENTO_CHECKOUT_TTL_MINUTOS = 25 * 60  # com sessão aberta (o checkout do Stripe expira em até 24h)
+
+# Máximo de ocorrências por chamada de /api/agendamentos/criar_lote/
+AGENDAMENTO_LOTE_MAX = 26
+
+# Histórico de status de agendamentos (app_projeto/eventos.py)
+AGENDAMENTO_EVENTOS_LOTE_MAX = 500  # eventos acumulados antes de gravar no meio da requisição
+AGENDAMENTO_HISTORICO_RETENCAO_DIAS = 180  # depois disso vão para o arquivo comprimido
+
+# Feed de sincronização (app_projeto/sincronizacao.py)
+SINCRONIZACAO_LIMITE = 500  # linhas de alteração lidas por chamada de /api/alteracoes/
+
+# Notificações SSE de status de agendamento (app_projeto/notificacoes.py), só no ASGI:
+# uvicorn back_projeto.asgi:application. Com NOTIFICACOES_REDIS_URL, os eventos
+# passam entre processos por pub/sub (precisa do pacote redis instalado).
+NOTIFICACOES_REDIS_URL = os.getenv('NOTIFICACOES_REDIS_URL')
+NOTIFICACOES_HEARTBEAT_SEGUNDOS = 15  # comentário de keep-alive na conexão parada
+NOTIFICACOES_FILA_MAX = 100  # eventos pendentes por conexão antes de encerrá-la
+
+# Cache da aplicação: LRU em memória por processo; com CACHE_REDIS_URL definido,
+# Redis compartilhado entre os workers (precisa do pacote redis instalado)
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000))},
+        }
+    }
+
+# Leituras públicas em cache (app_projeto/cache_publico.py)
+CACHE_PUBLICO_TTL = 300  # segundos; a invalidação normal é por versão, nos sinais
+CACHE_TRAVA_SEGUNDOS = 10  # quanto um recálculo pode segurar a chave
+
+# Carrossel de avaliações da página inicial (app_projeto/carrossel.py)
+CARROSSEL_CACHE_TTL = 3600  # segundos; a invalidação normal é pelos sinais de Avaliacao
+CARROSSEL_HTTP_MAX_AGE = 60  # Cache-Control para o navegador/CDN
+
 
 
 APPEND_SLASH = False
@@ -197,6 +277,21 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Hash de senhas: Argon2 com custo ajustável (ver `manage.py benchmark_login`).
+# Os demais hashers ficam para validar senhas antigas, que são regravadas com
+# Argon2 no próximo login bem-sucedido.
+PASSWORD_HASHERS = [
+    'app_projeto.hashers.Argon2AjustavelPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', 65536))  # KiB
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', 2))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
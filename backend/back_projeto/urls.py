@@ -38,6 +38,7 @@ from app_projeto.views import (
     usuario_autenticado,
     listar_agendamentos,
     criar_agendamento,
+    criar_agendamentos_lote,
     atualizar_agendamento,
     enderecos_usuario,
     detalhar_usuario,
@@ -45,8 +46,8 @@ from app_projeto.views import (
     status_connect_account,
     RecuperarSenhaAPIView, 
     RedefinirSenhaAPIView,
-    listar_agendamentos_profissional, listar_agendamentos_paciente, deletar_agendamento,
-    detalhar_agendamento, horarios_ocupados, horarios_disponiveis, upload_foto_usuario, listar_prontuarios, prontuario_detalhe_editar, baixar_pdf_prontuario, enviar_prontuario_email, estornar_pagamento_stripe,
+    listar_agendamentos_profissional, listar_agendamentos_paciente, listar_alteracoes, stream_notificacoes, deletar_agendamento,
+    detalhar_agendamento, horarios_ocupados, horarios_disponiveis, horarios_disponiveis_intervalo, buscar_horarios_livres, upload_foto_usuario, listar_prontuarios, prontuario_detalhe_editar, baixar_pdf_prontuario, enviar_prontuario_email, estornar_pagamento_stripe,
     horarios_trabalho_profissional, horario_trabalho_detalhe, horarios_trabalho_profissional_publico,
     criar_avaliacao, listar_avaliacoes_usuario, listar_avaliacoes_agendamento, listar_avaliacoes_profissional, listar_melhores_avaliacoes, detalhes_avaliacao, pode_avaliar_agendamento
 )
@@ -84,10 +85,13 @@ urlpatterns = [
     # AGENDAMENTO
     path('api/agendamentos/', listar_agendamentos, name='listar_agendamentos'),
     path('api/agendamentos/criar/', criar_agendamento, name='criar_agendamento'),
+    path('api/agendamentos/criar_lote/', criar_agendamentos_lote, name='criar_agendamentos_lote'),
     path('api/agendamentos/<int:id>/atualizar/', atualizar_agendamento, name='atualizar_agendamento'),
     path('api/agendamentos/<int:id>/deletar/', deletar_agendamento, name='deletar_agendamento'),
     path('api/agendamentos_profissional/', listar_agendamentos_profissional, name='listar_agendamentos_profissional'),
     path('api/agendamentos_paciente/', listar_agendamentos_paciente, name='listar_agendamentos_paciente'),
+    path('api/alteracoes/', listar_alteracoes, name='listar_alteracoes'),
+    path('api/notificacoes/stream/', stream_notificacoes, name='stream_notificacoes'),
     path('api/agendamentos/<int:id>/', detalhar_agendamento, name='detalhar_agendamento'),
 
     #PRONTUARIOS
@@ -95,6 +99,10 @@ urlpatterns = [
     path('api/prontuarios/<int:id>/', prontuario_detalhe_editar, name='prontuario_detalhe_editar'),
     path('api/prontuarios/<int:id>/baixar-pdf/', baixar_pdf_prontuario, name='baixar_pdf_prontuario'),
     path('api/prontuarios/<int:id>/enviar-email/', enviar_prontuario_email, name='enviar_prontuario_email'),
+    # Mesmas operações pelo id da consulta: funcionam antes de o prontuário existir
+    path('api/agendamentos/<int:agendamento_id>/prontuario/', prontuario_detalhe_editar, name='prontuario_por_agendamento'),
+    path('api/agendamentos/<int:agendamento_id>/prontuario/baixar-pdf/', baixar_pdf_prontuario, name='baixar_pdf_prontuario_por_agendamento'),
+    path('api/agendamentos/<int:agendamento_id>/prontuario/enviar-email/', enviar_prontuario_email, name='enviar_prontuario_email_por_agendamento'),
     
     
     path('api/enderecos_usuario/<int:usuario_id>/', enderecos_usuario, name='enderecos_usuario'),
@@ -109,6 +117,8 @@ urlpatterns = [
     # HORÁRIOS OCUPADOS
     path('api/horarios_ocupados/', horarios_ocupados, name='horarios_ocupados'),
     path('api/horarios_disponiveis/', horarios_disponiveis, name='horarios_disponiveis'),
+    path('api/horarios_disponiveis/intervalo/', horarios_disponiveis_intervalo, name='horarios_disponiveis_intervalo'),
+    path('api/horarios_disponiveis/busca/', buscar_horarios_livres, name='buscar_horarios_livres'),
 
     # HORÁRIOS DE TRABALHO
     path('api/horarios-trabalho/', horarios_trabalho_profissional, name='horarios_trabalho_profissional'),
@@ -10,6 +10,7 @@ import { format as formatDate } from 'date-fns';
 import { ChevronLeftIcon, ChevronRightIcon } from '@heroicons/react/24/solid';
 import AvaliacaoModal from '../components/AvaliacaoModal';
 import { convertAgendamentosToEvents } from '../utils/dateUtils';
+import { useNotificacoesAgendamento } from '../hooks/useNotificacoesAgendamento';
 
 interface ConsultaEvent {
   id: number;
@@ -223,6 +224,17 @@ export default function ConsultasPaciente() {
     fetchConsultas();
   }, []);
 
+  // Status atualizado pelo servidor (pagamento confirmado pelo webhook, estorno etc.)
+  useNotificacoesAgendamento((evento) => {
+    if (evento.tipo === 'pago') {
+      toast.success('Pagamento confirmado!');
+    }
+    setConsultas((atuais) => atuais.map((c) => (c.id === evento.agendamento_id ? { ...c, status: evento.status } : c)));
+    if (evento.tipo === 'concluido' || !consultas.some((c) => c.id === evento.agendamento_id)) {
+      fetchConsultas();
+    }
+  });
+
   const fetchAgendamentoById = async (id: number) => {
     const res = await fetch(`http://localhost:8000/api/agendamentos/${id}/`, {
       method: 'GET',
@@ -0,0 +1,37 @@
+'use client';
+
+import { useEffect, useRef } from 'react';
+import { getBackendUrl } from '../utils/backend';
+
+export interface NotificacaoAgendamento {
+    tipo: 'pago' | 'cancelado' | 'estornado' | 'concluido' | 'status';
+    agendamento_id: number;
+    status: string;
+    status_anterior: string | null;
+    origem: string;
+    data: string;
+}
+
+const TIPOS = ['pago', 'cancelado', 'estornado', 'concluido', 'status'];
+
+// Uma conexão SSE por aba com as mudanças de status dos agendamentos do usuário
+// (cookie jwt). Se o servidor não tiver o stream (ex.: rodando em WSGI), o
+// navegador desiste e a página segue com as buscas normais.
+export const useNotificacoesAgendamento = (aoNotificar: (evento: NotificacaoAgendamento) => void) => {
+    const callback = useRef(aoNotificar);
+    callback.current = aoNotificar;
+
+    useEffect(() => {
+        if (typeof window === 'undefined' || !('EventSource' in window)) return;
+        const fonte = new EventSource(`${getBackendUrl()}/api/notificacoes/stream/`, { withCredentials: true });
+        const receber = (mensagem: MessageEvent) => {
+            try {
+                callback.current(JSON.parse(mensagem.data));
+            } catch (error) {
+                console.error('Notificação inválida:', error);
+            }
+        };
+        TIPOS.forEach((tipo) => fonte.addEventListener(tipo, receber));
+        return () => fonte.close();
+    }, []);
+};
@@ -132,7 +132,7 @@ export default function ProntuarioPacienteListagem() {
           <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-3 xl:grid-cols-4 gap-8">
             {grouped[activeStatus].map((prontuario) => (
               <div
-                key={prontuario.id}
+                key={prontuario.agendamento.id}
                 className="bg-white/95 border border-blue-300 rounded-3xl shadow-2xl p-7 backdrop-blur-md transition-all hover:scale-[1.05] hover:shadow-blue-400 flex flex-col justify-between"
               >
                 <div className="space-y-4">
@@ -23,7 +23,7 @@ export default function EditarProntuario() {
     if (!id) return;
     setLoading(true);
     setMensagem("");
-    fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+    fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
       credentials: 'include',
     })
       .then(async (resp) => {
@@ -65,7 +65,7 @@ export default function EditarProntuario() {
     if (mensagemAtual !== (prontuario?.mensagem_paciente || "") || textoAtual !== (prontuario?.texto || "")) {
       toast.info("Salvando alterações antes de enviar...");
       try {
-        const respSalvar = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+        const respSalvar = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
           method: 'PATCH',
           headers: { 'Content-Type': 'application/json' },
           credentials: 'include',
@@ -91,7 +91,7 @@ export default function EditarProntuario() {
 
       console.log("Enviando email com dados:", body); // Log para debug
 
-      const resp = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/enviar-email/`, {
+      const resp = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/enviar-email/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
@@ -119,7 +119,7 @@ export default function EditarProntuario() {
     setSalvando(true);
     setMensagemSalvar("");
     try {
-      const resp = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+      const resp = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
         method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
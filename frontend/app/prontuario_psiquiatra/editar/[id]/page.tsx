@@ -27,7 +27,7 @@ export default function EditarProntuario() {
     if (!id) return;
     setLoading(true);
     setMensagem("");
-    fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+    fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
       credentials: 'include',
     })
       .then(async (resp) => {
@@ -75,7 +75,7 @@ export default function EditarProntuario() {
     
     setBaixando(true);
     try {
-      const resp = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/baixar-pdf/`, {
+      const resp = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/baixar-pdf/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
@@ -101,7 +101,7 @@ export default function EditarProntuario() {
       }
 
       // Atualizar prontuário sem reload - buscar dados atualizados
-      const respProntuario = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+      const respProntuario = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
         credentials: 'include',
       });
       
@@ -125,7 +125,7 @@ export default function EditarProntuario() {
 
     setEnviandoEmail(true);
     try {
-      const resp = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/enviar-email/`, {
+      const resp = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/enviar-email/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
@@ -152,7 +152,7 @@ export default function EditarProntuario() {
     setSalvando(true);
     setMensagemSalvar("");
     try {
-      const resp = await fetch(`${getBackendUrl()}/api/prontuarios/${id}/`, {
+      const resp = await fetch(`${getBackendUrl()}/api/agendamentos/${id}/prontuario/`, {
         method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
@@ -211,7 +211,7 @@ export default function ProntuarioListagem() {
           <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-3 xl:grid-cols-4 gap-8">
             {grouped[activeStatus].map((prontuario) => (
               <div
-                key={prontuario.id}
+                key={prontuario.agendamento.id}
                 className="bg-white/95 border border-blue-300 rounded-3xl shadow-2xl p-7 backdrop-blur-md transition-all hover:scale-[1.05] hover:shadow-blue-400 flex flex-col justify-between"
               >
                 <div className="space-y-4">
@@ -230,7 +230,7 @@ export default function ProntuarioListagem() {
                   </div>
                 </div>
                 <div className="flex justify-between items-center border-t border-blue-100 pt-4 mt-4">
-                  <Link href={`/prontuario_psiquiatra/editar/${prontuario.id}`} legacyBehavior>
+                  <Link href={`/prontuario_psiquiatra/editar/${prontuario.agendamento.id}`} legacyBehavior>
                     <a className="text-xs bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded-lg transition font-semibold flex items-center gap-1 drop-shadow">
                       <span>✏️</span> Editar
                     </a>